@@ -7,7 +7,6 @@ if __name__ == "__main__":
 	
 	import asyncio
 	import ctypes
-	import datetime
 	import os
 	import re
 	import sys
@@ -27,17 +26,6 @@ if __name__ == "__main__":
 	# Initialize client
 	client = clients.Bot()
 	
-	# TODO: Move to utilities
-	def replace_null_character(data):
-		data_type = type(data)
-		if data_type is str:
-			return data.replace('\N{NULL}', "")
-		if data_type is dict:
-			return {key: replace_null_character(value) for key, value in data.items()}
-		if data_type is list:
-			return [replace_null_character(item) for item in data]
-		return data
-	
 	@client.event
 	async def on_message(message):
 		
@@ -49,39 +37,7 @@ if __name__ == "__main__":
 		guild = message.guild
 		
 		# Log message
-		if channel.type is discord.ChannelType.private:
-			await ctx.bot.db.execute(
-				"""
-				INSERT INTO chat.messages (
-					created_at, message_id, 
-					author_id, author_name, author_discriminator, author_display_name, 
-					direct_message, 
-					message_content, embeds
-				)
-				VALUES ($1, $2, $3, $4, $5, $6, TRUE, $7, CAST($8 AS jsonb[]))
-				""", 
-				message.created_at.replace(tzinfo = datetime.timezone.utc), message.id, 
-				author.id, author.name, author.discriminator, author.display_name, 
-				message.content.replace('\N{NULL}', ""), 
-				[replace_null_character(embed.to_dict()) for embed in message.embeds]
-			)
-		else:
-			await ctx.bot.db.execute(
-				"""
-				INSERT INTO chat.messages (
-					created_at, message_id, 
-					author_id, author_name, author_discriminator, author_display_name, 
-					direct_message, channel_id, channel_name, guild_id, guild_name, 
-					message_content, embeds
-				)
-				VALUES ($1, $2, $3, $4, $5, $6, FALSE, $7, $8, $9, $10, $11, CAST($12 AS jsonb[]))
-				""", 
-				message.created_at.replace(tzinfo = datetime.timezone.utc), message.id, 
-				author.id, author.name, author.discriminator, author.display_name, 
-				channel.id, channel.name, guild.id, guild.name, 
-				message.content.replace('\N{NULL}', ""), 
-				[replace_null_character(embed.to_dict()) for embed in message.embeds]
-			)
+		await ctx.bot.chat_message_logger.log(message)
 		
 		# Server specific settings
 		if guild is not None:
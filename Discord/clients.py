@@ -17,6 +17,7 @@ from urllib import parse
 import aiml
 import aiohttp
 from aiohttp import web
+import asyncpg
 from clarifai_grpc.channel.clarifai_channel import ClarifaiChannel
 from clarifai_grpc.grpc.api import service_pb2_grpc
 import imgurpython
@@ -30,12 +31,18 @@ import wolframalpha
 from wordnik import swagger, WordApi, WordsApi
 import youtube_dl
 
+from utilities.audio_cache import AudioCache
 from utilities.audio_player import AudioPlayer
+from utilities.cache import TTLCache
 from utilities import errors
 from utilities.context import Context
-from utilities.database import create_database_pool
+from utilities.database import create_database_pool, open_database_connection
 from utilities.help_command import HelpCommand
-from utilities.logging import AiohttpAccessLogger, initialize_aiohttp_access_logging, initialize_logging
+from utilities.logging import (AiohttpAccessLogger, AiohttpAccessLogSink, ChatMessageLogger, 
+								initialize_aiohttp_access_logging, initialize_logging)
+from utilities.permissions import PermissionResolver
+from utilities.process_pool import ProcessPool
+from utilities.statistics import CommandStatistics
 
 sys.path.insert(0, "..")
 from units.files import create_folder
@@ -130,7 +137,10 @@ class Bot(commands.Bot):
 		self.loop.create_task(self.initialize_constant_objects(), name = "Initialize Discord objects as constant attributes of Bot")
 		
 		# Variables
-		self.guild_settings = {}
+		## Invalidated through database notifications, with TTL as fallback
+		self.command_prefixes = TTLCache(max_size = 10000, ttl = 3600)
+		self.guild_settings = TTLCache(max_size = 10000, ttl = 3600)
+		self.permission_resolver = PermissionResolver(self)
 		self.online_time = datetime.datetime.now(datetime.timezone.utc)
 		self.session_commands_invoked = {}
 		
@@ -141,10 +151,10 @@ class Bot(commands.Bot):
 							"GOOGLE_CUSTOM_SEARCH_ENGINE_ID", "HTTP_SERVER_CALLBACK_URL", "IMGUR_CLIENT_ID", 
 							"IMGUR_CLIENT_SECRET", "NEWSAPI.ORG_API_KEY", "OMDB_API_KEY", "OSU_API_KEY", "OWM_API_KEY", 
 							"PAGE2IMAGES_REST_API_KEY", "SENTRY_DSN", "SPOTIFY_CLIENT_ID", "SPOTIFY_CLIENT_SECRET_KEY", 
-							"STEAM_WEB_API_KEY", "TWITCH_CLIENT_ID", "TWITTER_CONSUMER_KEY", "TWITTER_CONSUMER_SECRET", 
-							"TWITTER_ACCESS_TOKEN", "TWITTER_ACCESS_TOKEN_SECRET", "UNSPLASH_ACCESS_KEY", 
-							"WARGAMING_APPLICATION_ID", "WOLFRAM_ALPHA_APP_ID", "WORDNIK_API_KEY", 
-							"YANDEX_TRANSLATE_API_KEY"):
+							"STEAM_WEB_API_KEY", "TWITCH_CLIENT_ID", "TWITCH_CLIENT_SECRET", "TWITTER_CONSUMER_KEY", 
+							"TWITTER_CONSUMER_SECRET", "TWITTER_ACCESS_TOKEN", "TWITTER_ACCESS_TOKEN_SECRET", 
+							"UNSPLASH_ACCESS_KEY", "WARGAMING_APPLICATION_ID", "WOLFRAM_ALPHA_APP_ID", 
+							"WORDNIK_API_KEY", "YANDEX_TRANSLATE_API_KEY"):
 			setattr(self, credential.replace('.', '_'), os.getenv(credential))
 		if not self.BATTLE_NET_API_KEY:
 			self.BATTLE_NET_API_KEY = os.getenv("BLIZZARD_API_KEY")
@@ -188,6 +198,7 @@ class Bot(commands.Bot):
 		self.ytdl_info = youtube_dl.YoutubeDL(self.ytdl_info_options)
 		self.ytdl_playlist_options = {"default_search": "auto", "ignoreerrors": True, "quiet": True, "format": "webm[abr>0]/bestaudio/best", "prefer_ffmpeg": True}
 		self.ytdl_playlist = youtube_dl.YoutubeDL(self.ytdl_playlist_options)
+		self.audio_cache = AudioCache(self, self.data_path + "/audio_cache")
 		
 		# AIML Kernel
 		self.aiml_kernel = aiml.Kernel()
@@ -233,13 +244,34 @@ class Bot(commands.Bot):
 		self.connected_to_database = asyncio.Event()
 		self.connected_to_database.set()
 		self.loop.run_until_complete(self.initialize_database())
+		self.database_listener = None
+		self.loop.run_until_complete(self.initialize_database_listener())
+		
+		# Chat message logging
+		self.chat_message_logger = ChatMessageLogger(self)
+		self.chat_message_logger.start()
+		
+		# Command statistics
+		self.command_statistics = CommandStatistics(self)
+		self.command_statistics.start()
+		
+		# Worker processes for CPU-bound jobs
+		self.process_pool = ProcessPool()
 		
 		# HTTP Web Server
 		self.loop.run_until_complete(initialize_aiohttp_access_logging(self.database))
 		self.aiohttp_web_app = web.Application()
+		self.aiohttp_access_log_sink = AiohttpAccessLogSink(self)
+		self.aiohttp_access_log_sink.start()
+		self.aiohttp_web_app["access_log_sink"] = self.aiohttp_access_log_sink
 		self.aiohttp_web_app.add_routes([web.get('/', self.web_server_get_handler), 
 										web.post('/', self.web_server_post_handler), 
 										web.get("/robots.txt", self.web_server_robots_txt)])
+		self.pubsubhubbub_hub_url = "https://pubsubhubbub.appspot.com/"
+		if os.getenv("PUBSUBHUBBUB_HUB_STUB"):
+			# Local hub stub, for verifying subscription handling
+			self.aiohttp_web_app.add_routes([web.post("/hub", self.web_server_hub_stub_handler)])
+			self.pubsubhubbub_hub_url = parse.urljoin(self.HTTP_SERVER_CALLBACK_URL, "/hub")
 		self.aiohttp_app_runner = web.AppRunner(self.aiohttp_web_app, 
 												access_log_class = AiohttpAccessLogger)
 		self.aiohttp_site = None  # Initialized when starting web server
@@ -360,6 +392,38 @@ class Bot(commands.Bot):
 			)
 			"""
 		)
+		# Notify on changes, for cache invalidation
+		await self.db.execute(
+			"""
+			CREATE OR REPLACE FUNCTION meta.notify_change()
+			RETURNS TRIGGER AS $$
+			DECLARE
+				changed_row JSONB;
+			BEGIN
+				IF TG_OP = 'DELETE' THEN
+					changed_row = to_jsonb(OLD);
+				ELSE
+					changed_row = to_jsonb(NEW);
+				END IF;
+				PERFORM pg_notify(TG_ARGV[0], changed_row ->> TG_ARGV[1]);
+				RETURN NULL;
+			END;
+			$$ LANGUAGE plpgsql
+			"""
+		)
+		for table, channel, column in (("direct_messages.prefixes", "direct_message_prefixes_changed", "channel_id"), 
+										("guilds.prefixes", "guild_prefixes_changed", "guild_id"), 
+										("guilds.settings", "guild_settings_changed", "guild_id")):
+			async with self.db.acquire() as connection:
+				async with connection.transaction():
+					await connection.execute(f"DROP TRIGGER IF EXISTS notify_change ON {table}")
+					await connection.execute(
+						f"""
+						CREATE TRIGGER notify_change
+						AFTER INSERT OR UPDATE OR DELETE ON {table}
+						FOR EACH ROW EXECUTE FUNCTION meta.notify_change('{channel}', '{column}')
+						"""
+					)
 		await self.db.execute(
 			"""
 			CREATE TABLE IF NOT EXISTS meta.commands_invoked (
@@ -424,6 +488,47 @@ class Bot(commands.Bot):
 			"""
 		)
 	
+	async def initialize_database_listener(self):
+		# Dedicated connection, as pooled connections can't hold LISTEN
+		self.database_listener = await open_database_connection()
+		for channel in ("direct_message_prefixes_changed", "guild_prefixes_changed", "guild_settings_changed", 
+						"guild_permissions_changed"):
+			await self.database_listener.add_listener(channel, self.on_database_notification)
+		self.database_listener.add_termination_listener(self.on_database_listener_terminated)
+	
+	def on_database_notification(self, connection, pid, channel, payload):
+		if channel == "direct_message_prefixes_changed":
+			self.command_prefixes.pop(("direct_message", int(payload)))
+		elif channel == "guild_prefixes_changed":
+			self.command_prefixes.pop(("guild", int(payload)))
+		elif channel == "guild_settings_changed":
+			self.guild_settings.pop(int(payload))
+		elif channel == "guild_permissions_changed":
+			self.permission_resolver.invalidate(int(payload))
+	
+	def on_database_listener_terminated(self, connection):
+		# Notifications may have been missed
+		self.command_prefixes.clear()
+		self.guild_settings.clear()
+		self.permission_resolver.guilds.clear()
+		self.database_listener = None
+		self.loop.create_task(self.reconnect_database_listener(), name = "Reconnect database listener")
+	
+	async def reconnect_database_listener(self):
+		delay = 1
+		while not self.database_listener and not self.is_closed():
+			try:
+				await self.initialize_database_listener()
+			except (OSError, asyncpg.PostgresError) as e:
+				self.print(f"Failed to reconnect database listener: {e}")
+				await asyncio.sleep(delay)
+				delay = min(delay * 2, 300)
+			else:
+				# Clear again, in case of changes while reconnecting
+				self.command_prefixes.clear()
+				self.guild_settings.clear()
+				self.permission_resolver.guilds.clear()
+	
 	async def web_server_get_handler(self, request):
 		'''
 		async for line in request.content:
@@ -437,8 +542,10 @@ class Bot(commands.Bot):
 			if "YouTube" not in self.cogs:
 				return web.Response(status = 503)  # Return 503 Service Unavailable
 			channel_id = parse.parse_qs(parse.urlparse(request.query.get("hub.topic")).query)["channel_id"][0]
-			if ((channel_id in self.get_cog("YouTube").uploads_following and hub_mode == "subscribe") or 
-				(channel_id not in self.get_cog("YouTube").uploads_following and hub_mode == "unsubscribe")):
+			if channel_id in self.get_cog("YouTube").uploads_following and hub_mode == "subscribe":
+				self.get_cog("YouTube").subscription_leases.verified(channel_id, request.query.get("hub.lease_seconds"))
+				return web.Response(body = request.query.get("hub.challenge"))
+			elif channel_id not in self.get_cog("YouTube").uploads_following and hub_mode == "unsubscribe":
 				return web.Response(body = request.query.get("hub.challenge"))
 			else:
 				return web.Response(status = 404)  # Return 404 Not Found
@@ -475,6 +582,29 @@ class Bot(commands.Bot):
 	async def web_server_robots_txt(self, request):
 		return web.Response(text = "User-agent: *\nDisallow: /")
 	
+	async def web_server_hub_stub_handler(self, request):
+		'''
+		Minimal PubSubHubbub hub, enabled with the PUBSUBHUBBUB_HUB_STUB environment variable
+		Subscriptions are verified with this web server, regardless of the requested callback
+		PUBSUBHUBBUB_HUB_STUB can be set to a number of seconds to grant as the lease
+		'''
+		data = await request.post()
+		if data.get("hub.mode") not in ("subscribe", "unsubscribe") or not data.get("hub.topic"):
+			return web.Response(status = 400)  # Return 400 Bad Request
+		self.loop.create_task(self.hub_stub_verify(data["hub.mode"], data["hub.topic"]), 
+								name = "PubSubHubbub hub stub verification")
+		return web.Response(status = 202)  # Return 202 Accepted
+	
+	async def hub_stub_verify(self, mode, topic):
+		challenge = str(random.getrandbits(64))
+		params = {"hub.mode": mode, "hub.topic": topic, "hub.challenge": challenge}
+		if mode == "subscribe":
+			lease_seconds = os.getenv("PUBSUBHUBBUB_HUB_STUB")
+			params["hub.lease_seconds"] = lease_seconds if lease_seconds.isdigit() else "432000"
+		async with self.aiohttp_session.get(self.HTTP_SERVER_CALLBACK_URL, params = params) as resp:
+			verified = resp.status == 200 and await resp.text() == challenge
+		self.print(f"PubSubHubbub hub stub {mode} verification {'succeeded' if verified else 'failed'} for {topic}")
+	
 	async def initialize_constant_objects(self):
 		await self.wait_until_ready()
 		self.cache_channel = self.get_channel(self.cache_channel_id)
@@ -529,6 +659,14 @@ class Bot(commands.Bot):
 
 	@staticmethod
 	async def get_command_prefix(bot, message):
+		if message.channel.type is discord.ChannelType.private:
+			key = ("direct_message", message.channel.id)
+		else:
+			key = ("guild", message.guild.id)
+		if (prefixes := bot.command_prefixes.get(key)) is not None:
+			return prefixes
+		# Invalidations during the fetch would be overwritten with the stale value
+		generation = bot.command_prefixes.generation
 		if message.channel.type is discord.ChannelType.private:
 			prefixes = await bot.db.fetchval(
 				"""
@@ -547,7 +685,9 @@ class Bot(commands.Bot):
 				""", 
 				message.guild.id
 			)
-		return prefixes if prefixes else '!'
+		prefixes = prefixes if prefixes else '!'
+		bot.command_prefixes.set_if_current(key, prefixes, generation)
+		return prefixes
 	
 	async def on_ready(self):
 		self.print("readied")
@@ -580,33 +720,8 @@ class Bot(commands.Bot):
 	# TODO: on_command_completion
 	async def on_command(self, ctx):
 		self.session_commands_invoked[ctx.command.name] = self.session_commands_invoked.get(ctx.command.name, 0) + 1
-		await self.db.execute(
-			"""
-			UPDATE meta.stats
-			SET commands_invoked = commands_invoked + 1
-			WHERE timestamp = $1
-			""", 
-			self.online_time
-		)
-		await self.db.execute(
-			"""
-			INSERT INTO meta.commands_invoked (command, invokes)
-			VALUES ($1, 1)
-			ON CONFLICT (command) DO
-			UPDATE SET invokes = commands_invoked.invokes + 1
-			""", 
-			ctx.command.name
-		)
 		# TODO: Handle subcommand names
-		await self.db.execute(
-			"""
-			INSERT INTO users.stats (user_id, commands_invoked)
-			VALUES ($1, 1)
-			ON CONFLICT (user_id) DO
-			UPDATE SET commands_invoked = stats.commands_invoked + 1
-			""", 
-			ctx.author.id
-		)
+		self.command_statistics.record_command(ctx.command.name, ctx.author.id)
 		# TODO: Track names
 	
 	async def on_command_error(self, ctx, error):
@@ -698,6 +813,9 @@ class Bot(commands.Bot):
 	
 	async def on_message_edit(self, before, after):
 		if after.edited_at != before.edited_at:
+			# Ensure the message has been written before logging the edit
+			if after.id in self.chat_message_logger.pending_message_ids:
+				await self.chat_message_logger.flush()
 			if before.content != after.content:
 				await self.db.execute(
 					"""
@@ -725,14 +843,7 @@ class Bot(commands.Bot):
 				)
 	
 	async def increment_menu_reactions_count(self):
-		await self.db.execute(
-			"""
-			UPDATE meta.stats
-			SET menu_reactions = menu_reactions + 1
-			WHERE timestamp = $1
-			""", 
-			self.online_time
-		)
+		self.command_statistics.record_menu_reaction()
 	
 	# TODO: optimize/overhaul
 	def send_embed(self, destination, description = None, *, title = discord.Embed.Empty, title_url = discord.Embed.Empty, 
@@ -849,17 +960,15 @@ class Bot(commands.Bot):
 	# TODO: Case-Insensitive subcommands (override Group)
 	
 	async def get_guild_setting(self, guild_id, name):
-		if guild_id not in self.guild_settings:
-			await self.retrieve_guild_settings(guild_id)
-		return self.guild_settings[guild_id].get(name)
+		return (await self.get_guild_settings(guild_id)).get(name)
 	
 	async def get_guild_settings(self, guild_id):
-		if guild_id not in self.guild_settings:
-			await self.retrieve_guild_settings(guild_id)
-		return self.guild_settings[guild_id]
+		if (guild_settings := self.guild_settings.get(guild_id)) is None:
+			guild_settings = await self.retrieve_guild_settings(guild_id)
+		return guild_settings
 	
 	async def retrieve_guild_settings(self, guild_id):
-		self.guild_settings[guild_id] = {}
+		generation = self.guild_settings.generation
 		records = await self.db.fetch(
 			"""
 			SELECT name, setting
@@ -868,8 +977,9 @@ class Bot(commands.Bot):
 			""", 
 			guild_id
 		)
-		for record in records:
-			self.guild_settings[guild_id][record["name"]] = record["setting"]
+		guild_settings = {record["name"]: record["setting"] for record in records}
+		self.guild_settings.set_if_current(guild_id, guild_settings, generation)
+		return guild_settings
 	
 	async def set_guild_setting(self, guild_id, name, setting):
 		await self.db.execute(
@@ -881,7 +991,7 @@ class Bot(commands.Bot):
 			""", 
 			guild_id, name, setting
 		)
-		self.guild_settings.setdefault(guild_id, {})[name] = setting
+		self.guild_settings.pop(guild_id)
 	
 	# Update stats on sites listing Discord bots
 	async def update_listing_stats(self, site):
@@ -958,10 +1068,26 @@ class Bot(commands.Bot):
 			await sentry_transport.close()
 		# Close aiohttp session
 		await self.aiohttp_session.close()
-		# Close database connection
-		await self.database_connection_pool.close()
+		# Write remaining logged chat messages
+		await self.chat_message_logger.stop()
+		# Flush remaining command statistics
+		await self.command_statistics.stop()
+		# Flush remaining respects paid
+		if respects_cog := self.get_cog("Respects"):
+			await respects_cog.counter.stop()
+		# Stop worker processes
+		self.process_pool.close()
+		# Close database listener connection
+		if database_listener := self.database_listener:
+			self.database_listener = None
+			database_listener.remove_termination_listener(self.on_database_listener_terminated)
+			await database_listener.close()
 		# Stop web server
 		await self.aiohttp_app_runner.cleanup()
+		# Write remaining aiohttp access log entries
+		await self.aiohttp_access_log_sink.stop()
+		# Close database connection
+		await self.database_connection_pool.close()
 	
 	@commands.group(invoke_without_command = True, case_insensitive = True)
 	@commands.is_owner()
@@ -3,10 +3,16 @@ import discord
 from discord.ext import commands
 
 import asyncio
+import collections
+import contextlib
 import datetime
 import io
+import os
 import random
+import shutil
 import subprocess
+import sys
+import time
 from typing import Union
 
 import chess
@@ -22,25 +28,44 @@ except ImportError as e:
 from utilities import checks
 
 # TODO: Dynamically load chess engine not locked to version?
-STOCKFISH_EXECUTABLE = "stockfish_20090216_x64"
-try:
-	CPUID = cpuinfo.CPUID()
-	CPU_FLAGS = CPUID.get_flags(CPUID.get_max_extension_support())
-	if "bmi2" in CPU_FLAGS:
-		STOCKFISH_EXECUTABLE += "_bmi2"
-	elif "avx2" in CPU_FLAGS:
-		STOCKFISH_EXECUTABLE += "_avx2"
-	elif "sse4_1" in CPU_FLAGS and "popcnt" in CPU_FLAGS:
-		STOCKFISH_EXECUTABLE += "_modern"
-	elif "ssse3" in CPU_FLAGS:
-		STOCKFISH_EXECUTABLE += "_ssse"
-	# BMI2 >= AVX2 > SSE4.1 + POPCNT (modern) >= SSSE3 > none
-	# https://stockfishchess.org/download/
-	# TODO: Handle 32-bit?
-	# TODO: Handle not Windows?
-except:
-	pass
-STOCKFISH_EXECUTABLE += ".exe"
+STOCKFISH_BUILD = "stockfish_20090216_x64"
+
+def resolve_stockfish_executable():
+	'''
+	Resolve the Stockfish binary
+	STOCKFISH_PATH, then stockfish on PATH, then bundled builds for the CPU
+	'''
+	if path := os.getenv("STOCKFISH_PATH"):
+		return path
+	if path := shutil.which("stockfish"):
+		return path
+	variant = ""
+	try:
+		cpuid = cpuinfo.CPUID()
+		cpu_flags = cpuid.get_flags(cpuid.get_max_extension_support())
+		if "bmi2" in cpu_flags:
+			variant = "_bmi2"
+		elif "avx2" in cpu_flags:
+			variant = "_avx2"
+		elif "sse4_1" in cpu_flags and "popcnt" in cpu_flags:
+			variant = "_modern"
+		elif "ssse3" in cpu_flags:
+			variant = "_ssse"
+		# BMI2 >= AVX2 > SSE4.1 + POPCNT (modern) >= SSSE3 > none
+		# https://stockfishchess.org/download/
+		# TODO: Handle 32-bit?
+	except:
+		pass
+	extension = ".exe" if sys.platform == "win32" else ""
+	candidates = [f"bin/{STOCKFISH_BUILD}{variant}{extension}", f"bin/{STOCKFISH_BUILD}{extension}"]
+	if sys.platform != "win32":
+		# Debian and Ubuntu packages install outside PATH
+		candidates.append("/usr/games/stockfish")
+	for candidate in candidates:
+		if os.path.isfile(candidate):
+			return candidate
+
+STOCKFISH_EXECUTABLE = resolve_stockfish_executable()
 
 def setup(bot):
 	bot.add_cog(ChessCog())
@@ -49,6 +74,7 @@ class ChessCog(commands.Cog, name = "Chess"):
 	
 	def __init__(self):
 		self.matches = []
+		self.engine_pool = ChessEnginePool(STOCKFISH_EXECUTABLE)
 	
 	async def cog_check(self, ctx):
 		return await checks.not_forbidden().predicate(ctx)
@@ -57,6 +83,7 @@ class ChessCog(commands.Cog, name = "Chess"):
 		# TODO: Persistence - store running chess matches and add way to continue previous ones
 		for match in self.matches:
 			match.task.cancel()
+		self.engine_pool.close()
 	
 	@commands.group(name = "chess", invoke_without_command = True, case_insensitive = True)
 	async def chess_command(self, ctx):
@@ -132,7 +159,7 @@ class ChessCog(commands.Cog, name = "Chess"):
 				return await ctx.send(f"{ctx.author.mention}: {opponent} has declined your challenge")
 			if message.content.lower() in ("no", 'n'):
 				return await ctx.send(f"{ctx.author.mention}: {opponent} has declined your challenge")
-		match = await ChessMatch.start(ctx, white_player, black_player)
+		match = await ChessMatch.start(ctx, white_player, black_player, self.engine_pool)
 		self.matches.append(match)
 		await match.ended.wait()
 		self.matches.remove(match)
@@ -180,6 +207,20 @@ class ChessCog(commands.Cog, name = "Chess"):
 		await ctx.say(ctx.author.name + " flipped the table over in anger!")
 	"""
 	
+	@chess_command.command(hidden = True)
+	@commands.is_owner()
+	async def engines(self, ctx):
+		'''Chess engine pool statistics'''
+		stats = self.engine_pool.stats
+		await ctx.embed_reply(fields = (("Engines", f"{stats['running']} running, {stats['idle']} idle, "
+														f"{stats['max_engines']} max"), 
+										("Leases", f"{stats['leases']}, {stats['waiting']} waiting"), 
+										("Queue Wait", f"{stats['queue_wait_average']:.3f}s average, "
+														f"{stats['queue_wait_max']:.3f}s max"), 
+										("Think Time", f"{stats['think_time_average']:.3f}s average, "
+														f"{stats['think_time_max']:.3f}s max"), 
+										("Restarts", stats["engines_restarted"])))
+	
 	@chess_command.command(hidden = True)
 	async def pgn(self, ctx):
 		'''PGN of the current match'''
@@ -232,15 +273,14 @@ class ChessCog(commands.Cog, name = "Chess"):
 class ChessMatch(chess.Board):
 	
 	@classmethod
-	async def start(cls, ctx, white_player, black_player):
+	async def start(cls, ctx, white_player, black_player, engine_pool):
 		self = cls()
 		self.ctx = ctx
 		self.white_player = white_player
 		self.black_player = black_player
 		self.bot = ctx.bot
 		self.ended = asyncio.Event()
-		self.engine_transport, self.chess_engine = await chess.engine.popen_uci(f"bin/{STOCKFISH_EXECUTABLE}", 
-																				creationflags = subprocess.CREATE_NO_WINDOW)
+		self.engine_pool = engine_pool
 		self.match_message = None
 		self.task = ctx.bot.loop.create_task(self.match_task(), name = "Chess Match")
 		return self
@@ -273,7 +313,7 @@ class ChessMatch(chess.Board):
 			embed = self.match_message.embeds[0]
 			if player == self.bot.user:
 				await self.match_message.edit(embed = embed.set_footer(text = "I'm thinking.."))
-				result = await self.chess_engine.play(self, chess.engine.Limit(time = 2))
+				result = await self.engine_pool.play(self, chess.engine.Limit(time = 2), game = self)
 				self.push(result.move)
 				await self.update_match_embed(footer_text = f"I moved {result.move}")
 			else:
@@ -344,3 +384,127 @@ class ChessMatch(chess.Board):
 		self.match_message = None
 		await self.update_match_embed(orientation = orientation, footer_text = footer_text)
 
+class ChessEnginePool:
+	
+	'''
+	Bounded pool of UCI engine processes shared by chess matches
+	Engines are leased for each search and reset with a new game when the game changes
+	Idle engines are health checked before being leased, and replaced if crashed or unresponsive
+	'''
+	
+	def __init__(self, executable, *, max_engines = 2, health_check_timeout = 5):
+		self.executable = executable
+		self.max_engines = max_engines
+		self.health_check_timeout = health_check_timeout
+		self.semaphore = asyncio.Semaphore(max_engines)
+		self.idle = collections.deque()
+		self.transports = {}
+		self.engine_name = None
+		self.waiting = 0
+		self.leases = 0
+		self.engines_started = 0
+		self.engines_restarted = 0
+		self.queue_wait_total = self.queue_wait_max = 0
+		self.searches = 0
+		self.think_time_total = self.think_time_max = 0
+	
+	async def start_engine(self):
+		if not self.executable:
+			raise RuntimeError("Stockfish executable not found")
+		kwargs = {}
+		if sys.platform == "win32":
+			kwargs["creationflags"] = subprocess.CREATE_NO_WINDOW
+		transport, engine = await chess.engine.popen_uci(self.executable, **kwargs)
+		self.transports[engine] = transport
+		self.engines_started += 1
+		self.engine_name = engine.id.get("name")
+		return engine
+	
+	def kill_engine(self, engine):
+		if transport := self.transports.pop(engine, None):
+			transport.close()
+	
+	async def is_healthy(self, engine):
+		if engine.returncode.done():
+			return False
+		try:
+			await asyncio.wait_for(engine.ping(), timeout = self.health_check_timeout)
+		except (asyncio.TimeoutError, chess.engine.EngineError, chess.engine.EngineTerminatedError):
+			return False
+		return True
+	
+	async def acquire(self):
+		while self.idle:
+			engine = self.idle.popleft()
+			if await self.is_healthy(engine):
+				return engine
+			self.kill_engine(engine)
+			self.engines_restarted += 1
+		return await self.start_engine()
+	
+	@contextlib.asynccontextmanager
+	async def lease(self):
+		started_waiting = time.monotonic()
+		self.waiting += 1
+		try:
+			await self.semaphore.acquire()
+		finally:
+			self.waiting -= 1
+		try:
+			queue_wait = time.monotonic() - started_waiting
+			self.queue_wait_total += queue_wait
+			self.queue_wait_max = max(self.queue_wait_max, queue_wait)
+			self.leases += 1
+			engine = await self.acquire()
+			try:
+				yield engine
+			except BaseException:
+				# Engine state is unknown after an interrupted or failed command
+				self.kill_engine(engine)
+				raise
+			else:
+				self.idle.append(engine)
+		finally:
+			self.semaphore.release()
+	
+	async def play(self, board, limit, *, game = None, retries = 1):
+		'''Search for a move, restarting the engine and retrying if it crashes'''
+		for attempt in range(retries + 1):
+			try:
+				async with self.lease() as engine:
+					started = time.monotonic()
+					# A different game sends ucinewgame, resetting the engine
+					result = await engine.play(board, limit, game = game)
+					think_time = time.monotonic() - started
+			except chess.engine.EngineTerminatedError:
+				self.engines_restarted += 1
+				if attempt == retries:
+					raise
+			else:
+				self.searches += 1
+				self.think_time_total += think_time
+				self.think_time_max = max(self.think_time_max, think_time)
+				return result
+	
+	async def get_engine_name(self):
+		if not self.engine_name:
+			async with self.lease():
+				pass
+		return self.engine_name
+	
+	def close(self):
+		for engine in list(self.transports):
+			self.kill_engine(engine)
+		self.idle.clear()
+	
+	@property
+	def stats(self):
+		return {"running": len(self.transports), "idle": len(self.idle), 
+				"max_engines": self.max_engines, "waiting": self.waiting, 
+				"leases": self.leases, "engines_started": self.engines_started, 
+				"engines_restarted": self.engines_restarted, 
+				"queue_wait_average": self.queue_wait_total / self.leases if self.leases else 0, 
+				"queue_wait_max": self.queue_wait_max, "searches": self.searches, 
+				"think_time_average": self.think_time_total / self.searches if self.searches else 0, 
+				"think_time_max": self.think_time_max}
+
@@ -3,14 +3,17 @@ import discord
 from discord.ext import commands
 
 import asyncio
-import concurrent.futures
 import math
-import multiprocessing
+import sys
 
 import sympy
 
 from utilities import checks
 
+sys.path.insert(0, "..")
+from units.arithmetic import evaluate, UnitExecutionError, UnitOutputError
+sys.path.pop(0)
+
 def setup(bot):
 	bot.add_cog(Math())
 
@@ -30,36 +33,24 @@ class Math(commands.Cog):
 		'''Add numbers together'''
 		await ctx.embed_reply(f"{' + '.join(f'{number:g}' for number in numbers)} = {sum(numbers):g}")
 	
-	# TODO: Fix/Improve
 	@commands.command(aliases = ["calc", "calculator"])
 	async def calculate(self, ctx, *, equation: str):
-		'''Calculator'''
-		#_equation = re.sub("[^[0-9]+-/*^%\.]", "", equation).replace('^', "**") #words
-		replacements = {"pi" : "math.pi", 'e' : "math.e", "sin" : "math.sin", 
-                        "cos" : "math.cos", "tan" : "math.tan", '^' : "**"}
-		allowed = set("0123456789.+-*/^%()")
-		for key, value in replacements.items():
-			equation = equation.replace(key, value)
-		# TODO: use filter
-		equation = "".join(character for character in equation if character in allowed)
-		print("Calculated " + equation)
-		with multiprocessing.Pool(1) as pool:
-			async_result = pool.apply_async(eval, (equation,))
-			future = ctx.bot.loop.run_in_executor(None, async_result.get, 10.0)
-			try:
-				result = await asyncio.wait_for(future, 10.0)
-				await ctx.embed_reply(f"{equation} = {result}")
-			except discord.HTTPException:
-				# TODO: use textwrap/paginate
-				await ctx.embed_reply(":no_entry: Output too long")
-			except SyntaxError:
-				await ctx.embed_reply(":no_entry: Syntax error")
-			except TypeError as e:
-				await ctx.embed_reply(f":no_entry: Error: {e}")
-			except ZeroDivisionError:
-				await ctx.embed_reply(":no_entry: Error: Division by zero")
-			except (concurrent.futures.TimeoutError, multiprocessing.context.TimeoutError):
-				await ctx.embed_reply(":no_entry: Execution exceeded time limit")
+		'''
+		Calculator
+		Supports +, -, *, /, //, %, ** or ^, parentheses, 
+		pi, e, tau, inf, and functions such as sqrt, log, sin, sec, floor, ceil, and factorial
+		'''
+		try:
+			result = await ctx.bot.process_pool.submit(evaluate_expression, equation)
+		except (UnitExecutionError, UnitOutputError) as e:
+			return await ctx.embed_reply(f":no_entry: Error: {e}")
+		except asyncio.TimeoutError:
+			return await ctx.embed_reply(":no_entry: Calculation exceeded time limit")
+		try:
+			await ctx.embed_reply(f"{equation} = {result}")
+		except discord.HTTPException:
+			# TODO: use textwrap/paginate
+			await ctx.embed_reply(":no_entry: Output too long")
 	
 	@commands.command()
 	async def exp(self, ctx, value: float):
@@ -117,7 +108,7 @@ class Math(commands.Cog):
 		'''
 		x = sympy.symbols('x')
 		try:
-			await ctx.embed_reply(f"`{sympy.diff(equation.strip('`'), x)}`",
+			await ctx.embed_reply(f"`{await ctx.bot.process_pool.submit(sympy.diff, equation.strip('`'), x)}`",
                                     title = f"Derivative of {equation}")
 		except Exception as e:
 			await ctx.embed_reply(ctx.bot.PY_CODE_BLOCK.format(f"{type(e).__name__}: {e}"),
@@ -131,7 +122,7 @@ class Math(commands.Cog):
 		'''
 		x = sympy.symbols('x')
 		try:
-			await ctx.embed_reply(f"`{sympy.integrate(equation.strip('`'), x)}`",
+			await ctx.embed_reply(f"`{await ctx.bot.process_pool.submit(sympy.integrate, equation.strip('`'), x)}`",
                                     title = f"Integral of {equation}")
 		except Exception as e:
 			await ctx.embed_reply(ctx.bot.PY_CODE_BLOCK.format(f"{type(e).__name__}: {e}"),
@@ -145,7 +136,7 @@ class Math(commands.Cog):
 		'''
 		x = sympy.symbols('x')
 		try:
-			await ctx.embed_reply(f"`{sympy.integrate(equation.strip('`'), (x, lower_limit, upper_limit))}`",
+			await ctx.embed_reply(f"`{await ctx.bot.process_pool.submit(sympy.integrate, equation.strip('`'), (x, lower_limit, upper_limit))}`",
                                     title = f"Definite Integral of {equation} from {lower_limit} to {upper_limit}")
 		except Exception as e:
 			await ctx.embed_reply(ctx.bot.PY_CODE_BLOCK.format(f"{type(e).__name__}: {e}"),
@@ -215,3 +206,8 @@ class Math(commands.Cog):
 		'''Hyperbolic tangent function'''
 		await ctx.embed_reply(math.tanh(value))
 
+def evaluate_expression(expression):
+	'''Evaluate arithmetic expression, for running in a worker process'''
+	# Defined here so that worker processes import units through this module
+	return evaluate(expression)
+
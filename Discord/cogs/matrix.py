@@ -2,6 +2,8 @@
 from discord.ext import commands
 
 import ast
+import operator
+
 import numpy
 import scipy
 
@@ -42,17 +44,17 @@ class Matrix(commands.Cog):
 	@matrix.group(aliases = ["cosine"], invoke_without_command = True, case_insensitive = True)
 	async def cos(self, ctx, *, matrix: Matrix):
 		'''Cosine of a matrix'''
-		await ctx.embed_reply(str(scipy.linalg.cosm(matrix)))
+		await ctx.embed_reply(str(await ctx.bot.process_pool.submit(scipy.linalg.cosm, matrix)))
 	
 	@cos.command(name = "hyperbolic", aliases = ['h'])
 	async def cos_hyperbolic(self, ctx, *, matrix: Matrix):
 		'''Hyperbolic cosine of a matrix'''
-		await ctx.embed_reply(str(scipy.linalg.coshm(matrix)))
+		await ctx.embed_reply(str(await ctx.bot.process_pool.submit(scipy.linalg.coshm, matrix)))
 	
 	@matrix.command()
 	async def determinant(self, ctx, *, matrix: Matrix):
 		'''Determinant of a matrix'''
-		await ctx.embed_reply(scipy.linalg.det(matrix))
+		await ctx.embed_reply(await ctx.bot.process_pool.submit(scipy.linalg.det, matrix))
 	
 	@matrix.command(aliases = ["division", '/'])
 	async def divide(self, ctx, matrix_a: Matrix, matrix_b: Matrix):
@@ -62,22 +64,22 @@ class Matrix(commands.Cog):
 	@matrix.command(naliases = ["exponential"])
 	async def exp(self, ctx, matrix: Matrix):
 		'''Compute the matrix exponential using Pade approximation'''
-		await ctx.embed_reply(str(scipy.linalg.expm(matrix)))
+		await ctx.embed_reply(str(await ctx.bot.process_pool.submit(scipy.linalg.expm, matrix)))
 	
 	@matrix.command()
 	async def inverse(self, ctx, *, matrix: Matrix):
 		'''Inverse of a matrix'''
-		await ctx.embed_reply(str(numpy.matrix(matrix).I))
+		await ctx.embed_reply(str(await ctx.bot.process_pool.submit(numpy.linalg.inv, numpy.matrix(matrix))))
 	
 	@matrix.command(aliases = ["logarithm"])
 	async def log(self, ctx, *, matrix: Matrix):
 		'''Compute matrix logarithm'''
-		await ctx.embed_reply(str(scipy.linalg.logm(matrix)))
+		await ctx.embed_reply(str(await ctx.bot.process_pool.submit(scipy.linalg.logm, matrix)))
 	
 	@matrix.command()
 	async def lu(self, ctx, *, matrix: Matrix):
 		'''LU decomposition of a matrix'''
-		p, l, u = scipy.linalg.lu(matrix)
+		p, l, u = await ctx.bot.process_pool.submit(scipy.linalg.lu, matrix)
 		await ctx.embed_reply(fields = (("P", p), ("L", l), ("U", u)))
 	
 	@matrix.group(aliases = ["times", '*'], invoke_without_command = True, case_insensitive = True)
@@ -94,34 +96,34 @@ class Matrix(commands.Cog):
 	async def power(self, ctx, matrix: Matrix, power: int):
 		'''Raise a matrix to a power'''
 		try:
-			await ctx.embed_reply(str(numpy.matrix(matrix) ** power))
+			await ctx.embed_reply(str(await ctx.bot.process_pool.submit(operator.pow, numpy.matrix(matrix), power)))
 		except ValueError as e:  # not square matrix
 			await ctx.embed_reply(f"{ctx.bot.error_emoji} Error: {e}")
 	
 	@matrix.command()
 	async def rank(self, ctx, matrix: Matrix):
 		'''Rank of a matrix'''
-		await ctx.embed_reply(numpy.linalg.matrix_rank(matrix))
+		await ctx.embed_reply(await ctx.bot.process_pool.submit(numpy.linalg.matrix_rank, matrix))
 	
 	@matrix.command()
 	async def sign(self, ctx, matrix: Matrix):
 		'''Matrix sign function'''
-		await ctx.embed_reply(str(scipy.linalg.signm(matrix)))
+		await ctx.embed_reply(str(await ctx.bot.process_pool.submit(scipy.linalg.signm, matrix)))
 	
 	@matrix.group(aliases = ["sine"], invoke_without_command = True, case_insensitive = True)
 	async def sin(self, ctx, *, matrix: Matrix):
 		'''Sine of a matrix'''
-		await ctx.embed_reply(str(scipy.linalg.sinm(matrix)))
+		await ctx.embed_reply(str(await ctx.bot.process_pool.submit(scipy.linalg.sinm, matrix)))
 	
 	@sin.command(name = "hyperbolic", aliases = ['h'])
 	async def sin_hyperbolic(self, ctx, *, matrix: Matrix):
 		'''Hyperbolic sine of a matrix'''
-		await ctx.embed_reply(str(scipy.linalg.sinhm(matrix)))
+		await ctx.embed_reply(str(await ctx.bot.process_pool.submit(scipy.linalg.sinhm, matrix)))
 	
 	@matrix.command(aliases = ["squareroot", "square_root", '√'])
 	async def sqrt(self, ctx, *, matrix: Matrix):
 		'''Square root of a matrix'''
-		await ctx.embed_reply(str(scipy.linalg.sqrtm(matrix)))
+		await ctx.embed_reply(str(await ctx.bot.process_pool.submit(scipy.linalg.sqrtm, matrix)))
 	
 	@matrix.command(aliases = ["subtraction", "minus", '-'])
 	async def subtract(self, ctx, matrix_a: Matrix, matrix_b: Matrix):
@@ -131,12 +133,12 @@ class Matrix(commands.Cog):
 	@matrix.group(aliases = ["tangent"], invoke_without_command = True, case_insensitive = True)
 	async def tan(self, ctx, *, matrix: Matrix):
 		'''Tangent of a matrix'''
-		await ctx.embed_reply(str(scipy.linalg.tanm(matrix)))
+		await ctx.embed_reply(str(await ctx.bot.process_pool.submit(scipy.linalg.tanm, matrix)))
 	
 	@tan.command(name = "hyperbolic", aliases = ['h'])
 	async def tan_hyperbolic(self, ctx, *, matrix: Matrix):
 		'''Hyperbolic tangent of a matrix'''
-		await ctx.embed_reply(str(scipy.linalg.tanhm(matrix)))
+		await ctx.embed_reply(str(await ctx.bot.process_pool.submit(scipy.linalg.tanhm, matrix)))
 	
 	@matrix.group(aliases = ["transposition"], invoke_without_command = True, case_insensitive = True)
 	async def transpose(self, ctx, *, matrix: Matrix):
@@ -3,98 +3,56 @@ import discord
 from discord.ext import commands, menus
 
 import asyncio
-from enum import IntEnum
+import functools
 import io
 import random
+import sys
 
 from utilities import checks
 from utilities.menu import Menu
 
+sys.path.insert(0, "..")
+from units.maze import Direction, generate_maze, render_maze, render_maze_image, UnitExecutionError, Viewport
+sys.path.pop(0)
+
+MAX_SIZE = 250
+
 def setup(bot):
 	bot.add_cog(MazeCog())
 
-class Direction(IntEnum):
-	UP = 0
-	RIGHT = 1
-	DOWN = 2
-	LEFT = 3
-	
-	@property
-	def reverse(self):
-		return {self.UP: self.DOWN, self.LEFT: self.RIGHT, self.DOWN: self.UP, self.RIGHT: self.LEFT}[self]
-	
-	@property
-	def vector(self):
-		# (-y, x) to match vertical, horizontal / row, column
-		return {self.UP: (-1, 0), self.RIGHT: (0, 1), self.DOWN: (1, 0), self.LEFT: (0, -1)}[self]
-
 class Maze:
 	
-	def __init__(self, rows, columns, random_start = False, random_end = False):
-		self.rows = min(max(2, rows), 100)
-		self.columns = min(max(2, columns), 100)
+	def __init__(self, connections, random_start = False, random_end = False, algorithm = "backtracker", seed = None):
+		# Connections are generated separately, in a worker process
+		self.connections = connections
+		self.rows, self.columns = connections.shape
 		self.move_counter = 0
-		
-		# Generate connections
-		self.connections = [[[False] * 4 for column in range(self.columns)] for row in range(self.rows)]
-		visited = [[False] * self.columns for row in range(self.rows)]
-		to_visit = [(random.randint(0, self.rows - 1), random.randint(0, self.columns - 1))]
-		while to_visit:
-			row, column = to_visit[-1]
-			visited[row][column] = True
-			for direction in random.sample(tuple(Direction), 4):
-				vertical, horizontal = direction.vector
-				new_row, new_column = row + vertical, column + horizontal
-				if not (0 <= new_row < self.rows and 0 <= new_column < self.columns):
-					continue
-				if visited[new_row][new_column]:
-					continue
-				self.connections[row][column][direction] = True
-				self.connections[new_row][new_column][direction.reverse] = True
-				to_visit.append((new_row, new_column))
-				break
-			else:
-				to_visit.pop()
+		self.algorithm = algorithm
+		self.seed = seed
 		
 		# self.visited = [[False] * self.columns for row in range(self.rows)]
+		# Positions are seeded too, so mazes are reproducible
+		rng = random.Random(self.seed)
 		if random_start:
-			self.row = random.randint(0, self.rows - 1)
-			self.column = random.randint(0, self.columns - 1)
+			self.row = rng.randint(0, self.rows - 1)
+			self.column = rng.randint(0, self.columns - 1)
 		else:
 			self.row = 0
 			self.column = 0
 		# self.visited[self.row][self.column] = True
 		if random_end:
-			self.end_row = random.randint(0, self.rows - 1)
-			self.end_column = random.randint(0, self.columns - 1)
+			self.end_row = rng.randint(0, self.rows - 1)
+			self.end_column = rng.randint(0, self.columns - 1)
 		else:
 			self.end_row = self.rows - 1
 			self.end_column = self.columns - 1
 		
-		self.string = ""
-		for row in range(self.rows):
-			for column in range(self.columns):
-				if self.connections[row][column][Direction.UP]:
-					self.string += "+   "
-				else:
-					self.string += "+---"
-			self.string += "+\n"
-			for column in range(self.columns):
-				if self.connections[row][column][Direction.LEFT]:
-					self.string += "    "
-				else:
-					self.string += "|   "
-			self.string += "|\n"
-		self.string += "+---" * self.columns + "+\n"
-		self.row_strings = self.string.split('\n')
+		self.string = render_maze(self.connections)
 		
-		self.visible = [None] * (2 * self.rows + 1)
-		self.visible[::2] = ["+---" * self.columns + '+'] * (self.rows + 1)
-		self.visible[1::2] = ["| X " * self.columns + '|'] * self.rows
-		self.update_visible()
-		row_offset = 2 * self.end_row + 1
-		column_offset = 4 * self.end_column + 2
-		self.visible[row_offset] = self.visible[row_offset][:column_offset] + 'E' + self.visible[row_offset][column_offset + 1:]
+		self.viewport = Viewport(self.connections)
+		self.viewport.reveal(self.row, self.column)
+		self.viewport.mark(self.row, self.column, 'I')
+		self.viewport.mark(self.end_row, self.end_column, 'E')
 	
 	def __repr__(self):
 		return self.string
@@ -105,7 +63,7 @@ class Maze:
 		# 			tuple(
 		# 				filter(
 		# 					None, (
-		# 						direction.name if self.connections[row][column][direction] else None
+		# 						direction.name if self.connections[row, column] & direction.bit else None
 		# 						for direction in Direction
 		# 					)
 		# 				)
@@ -118,7 +76,7 @@ class Maze:
 		# 	'\n'.join(
 		# 		"".join(
 		# 			"".join(
-		# 				direction.name[0] if self.connections[row][column][direction] else ""
+		# 				direction.name[0] if self.connections[row, column] & direction.bit else ""
 		# 				for direction in Direction
 		# 			).ljust(5, ' ') for column in range(self.columns)
 		# 		) for row in range(self.rows)
@@ -126,32 +84,14 @@ class Maze:
 		# )
 	
 	def __str__(self):
-		if self.rows <= 10 and self.columns <= 10:
-			return '\n'.join(self.visible)
-		start_row = self.row - self.row % 10
-		start_column = self.column - self.column % 10
-		visible = self.visible[2 * start_row:2 * start_row + 21]
-		for row_number, row in enumerate(visible):
-			visible[row_number] = row[4 * start_column:4 * start_column + 41]
-		return '\n'.join(visible)
-	
-	def update_visible(self):
-		row_offset = 2 * self.row
-		column_offset = 4 * self.column
-		for row in range(row_offset, row_offset + 3):
-			self.visible[row] = self.visible[row][:column_offset] + self.row_strings[row][column_offset:column_offset + 5] + self.visible[row][column_offset + 5:]
-		row_offset += 1
-		column_offset += 2
-		self.visible[row_offset] = self.visible[row_offset][:column_offset] + 'I' + self.visible[row_offset][column_offset + 1:]
+		return self.viewport.render(self.row, self.column)
 	
 	def move(self, direction):
 		'''Move inside the maze'''
-		if not isinstance(direction, Direction) or not self.connections[self.row][self.column][direction]:
+		if not isinstance(direction, Direction) or not self.connections[self.row, self.column] & direction.bit:
 			return False
 		
-		row_offset = 2 * self.row + 1
-		column_offset = 4 * self.column + 2
-		self.visible[row_offset] = self.visible[row_offset][:column_offset] + ' ' + self.visible[row_offset][column_offset + 1:]
+		self.viewport.mark(self.row, self.column, ' ')
 		if direction is Direction.UP:
 			self.row -= 1
 		elif direction is Direction.RIGHT:
@@ -163,7 +103,8 @@ class Maze:
 		
 		# self.visited[self.row][self.column] = True
 		self.move_counter += 1
-		self.update_visible()
+		self.viewport.reveal(self.row, self.column)
+		self.viewport.mark(self.row, self.column, 'I')
 		return True
 	
 	@property
@@ -189,18 +130,45 @@ class MazeCog(commands.Cog, name = "Maze"):
 		for task in self.tasks:
 			task.cancel()
 	
+	async def create_maze(self, ctx, height, width, random_start, random_end, algorithm, seed):
+		'''Generate maze in a worker process, as larger mazes can take a while, or reply with an error'''
+		rows = min(max(2, height), MAX_SIZE)
+		columns = min(max(2, width), MAX_SIZE)
+		algorithm = algorithm.lower()
+		if seed is None:
+			seed = random.randrange(2 ** 32)
+		try:
+			connections = await ctx.bot.process_pool.submit(generate_connections, rows, columns, algorithm, seed)
+		except UnitExecutionError as e:
+			await ctx.embed_reply(f":no_entry: Error: {e}")
+			return
+		except asyncio.TimeoutError:
+			await ctx.embed_reply(":no_entry: Maze generation exceeded time limit")
+			return
+		# Rendering the initial map is vectorized, but can still take a moment for larger mazes
+		return await ctx.bot.loop.run_in_executor(None, functools.partial(Maze, connections, random_start, random_end, 
+																			algorithm, seed))
+	
 	@commands.group(invoke_without_command = True, case_insensitive = True)
-	async def maze(self, ctx, height: int = 5, width: int = 5, random_start: bool = False, random_end: bool = False):
+	async def maze(self, ctx, height: int = 5, width: int = 5, random_start: bool = False, random_end: bool = False, 
+					algorithm: str = "backtracker", seed: int = None):
 		'''
 		Maze game
-		height: 2 - 100
-		width: 2 - 100
+		height: 2 - 250
+		width: 2 - 250
+		algorithm: backtracker, prim, kruskal, wilson, or eller
+		seed: Number to generate the same maze again
 		[w, a, s, d] or [up, left, down, right] to move
 		'''
 		# TODO: Add option to restrict to command invoker
 		if maze := self.mazes.get(ctx.channel.id):
 			return await ctx.embed_reply(ctx.bot.CODE_BLOCK.format(str(maze)))
-		self.mazes[ctx.channel.id] = maze = Maze(height, width, random_start = random_start, random_end = random_end)
+		if not (maze := await self.create_maze(ctx, height, width, random_start, random_end, algorithm, seed)):
+			return
+		if ctx.channel.id in self.mazes:
+			# Started while generating
+			return await ctx.embed_reply(ctx.bot.CODE_BLOCK.format(str(self.mazes[ctx.channel.id])))
+		self.mazes[ctx.channel.id] = maze
 		message = await ctx.embed_reply(ctx.bot.CODE_BLOCK.format(str(maze)), 
 										footer_text = f"Your current position: {maze.column + 1}, {maze.row + 1}")
 		reached_end = False
@@ -236,20 +204,33 @@ class MazeCog(commands.Cog, name = "Maze"):
 		'''Text file of the current maze game'''
 		if maze := self.mazes.get(ctx.channel.id):
 			await ctx.reply("Your maze is attached", 
-							file = discord.File(io.BytesIO(('\n'.join(maze.visible)).encode()), 
+							file = discord.File(io.BytesIO(maze.viewport.text.encode()), 
 												filename = "maze.txt"))
 		else:
 			await ctx.embed_reply(":no_entry: There's no maze game currently going on")
 	
+	@maze.command(aliases = ["png", "picture"])
+	async def image(self, ctx):
+		'''Image of the revealed map of the current maze game'''
+		if maze := self.mazes.get(ctx.channel.id):
+			await send_maze_image(ctx, maze)
+		else:
+			await ctx.embed_reply(":no_entry: There's no maze game currently going on")
+	
 	@maze.command(name = "menu", aliases = ['m', "menus", 'r', "reaction", "reactions"])
-	async def menu_command(self, ctx, height: int = 5, width: int = 5, random_start: bool = False, random_end: bool = False):
+	async def menu_command(self, ctx, height: int = 5, width: int = 5, random_start: bool = False, random_end: bool = False, 
+							algorithm: str = "backtracker", seed: int = None):
 		'''
 		Maze game menu
-		height: 2 - 100
-		width: 2 - 100
+		height: 2 - 250
+		width: 2 - 250
+		algorithm: backtracker, prim, kruskal, wilson, or eller
+		seed: Number to generate the same maze again
 		React with an arrow key to move
 		'''
-		menu = MazeMenu(height, width, random_start, random_end)
+		if not (maze := await self.create_maze(ctx, height, width, random_start, random_end, algorithm, seed)):
+			return
+		menu = MazeMenu(maze)
 		self.menus.append(menu)
 		await menu.start(ctx, wait = True)
 		self.menus.remove(menu)
@@ -258,9 +239,9 @@ class MazeCog(commands.Cog, name = "Maze"):
 
 class MazeMenu(Menu):
 	
-	def __init__(self, height, width, random_start, random_end):
+	def __init__(self, maze):
 		super().__init__(timeout = None, clear_reactions_after = True, check_embeds = True)
-		self.maze = Maze(height, width, random_start, random_end)
+		self.maze = maze
 		self.arrows = {'\N{LEFTWARDS BLACK ARROW}': Direction.LEFT, '\N{UPWARDS BLACK ARROW}': Direction.UP, 
 						'\N{DOWNWARDS BLACK ARROW}': Direction.DOWN, '\N{BLACK RIGHTWARDS ARROW}': Direction.RIGHT}
 		for number, emoji in enumerate(self.arrows.keys(), start = 1):
@@ -287,6 +268,22 @@ class MazeMenu(Menu):
 	@menus.button("\N{PRINTER}", position = menus.Last(), lock = False)
 	async def on_printer(self, payload):
 		await self.ctx.reply("Your maze is attached", 
-								file = discord.File(io.BytesIO(('\n'.join(self.maze.visible)).encode()), 
+								file = discord.File(io.BytesIO(self.maze.viewport.text.encode()), 
 													filename = "maze.txt"))
+	
+	@menus.button("\N{FRAME WITH PICTURE}", position = menus.Last(1), lock = False)
+	async def on_frame_with_picture(self, payload):
+		await send_maze_image(self.ctx, self.maze)
+
+def generate_connections(rows, columns, algorithm, seed):
+	'''Generate maze connections, for running in a worker process'''
+	# Defined here so that worker processes import units through this module
+	return generate_maze(rows, columns, algorithm, seed)
+
+async def send_maze_image(ctx, maze):
+	'''Render the revealed map of a maze in a thread, from a snapshot of its current state, and send it'''
+	render = functools.partial(render_maze_image, maze.connections, maze.viewport.revealed.copy(), 
+								(maze.row, maze.column), (maze.end_row, maze.end_column))
+	image = await ctx.bot.loop.run_in_executor(None, render)
+	await ctx.reply("Your maze is attached", file = discord.File(io.BytesIO(image), filename = "maze.png"))
 
@@ -3,6 +3,7 @@ import discord
 from discord.ext import commands
 
 import asyncio
+import collections
 import datetime
 import copy
 import ctypes
@@ -14,11 +15,9 @@ import subprocess
 import sys
 import traceback
 
-import chess.engine
 import git
 import psutil
 
-from cogs.chess import STOCKFISH_EXECUTABLE
 from utilities import checks
 
 sys.path.insert(0, "..")
@@ -92,7 +91,8 @@ class Meta(commands.Cog):
 			WHERE user_id = $1
 			""", 
 			ctx.author.id
-		)
+		) or 0
+		commands_invoked += ctx.bot.command_statistics.unflushed_user_commands_invoked(ctx.author.id)
 		await ctx.embed_reply(f"You have {commands_invoked} points")
 	
 	@commands.command()
@@ -131,6 +131,7 @@ class Meta(commands.Cog):
 				""", 
 				ctx.channel.id, prefixes
 			)
+			ctx.bot.command_prefixes.pop(("direct_message", ctx.channel.id))
 		else:
 			await ctx.bot.db.execute(
 				"""
@@ -141,6 +142,7 @@ class Meta(commands.Cog):
 				""", 
 				ctx.guild.id, prefixes
 			)
+			ctx.bot.command_prefixes.pop(("guild", ctx.guild.id))
 		await ctx.embed_reply("Prefix(es) set: " + ' '.join(f'`"{prefix}"`' for prefix in prefixes))
 	
 	@commands.group(aliases = ["shard"], invoke_without_command = True, case_insensitive = True)
@@ -223,12 +225,20 @@ class Meta(commands.Cog):
 			""", 
 			ctx.bot.online_time
 		)
+		# Commands with unflushed invokes can be outside the recorded top 10
+		unflushed_commands = list(ctx.bot.command_statistics.unflushed_command_invokes())
 		records = await ctx.bot.db.fetch(
 			"""
+			(
+				SELECT * FROM meta.commands_invoked
+				ORDER BY invokes DESC
+				LIMIT 10
+			)
+			UNION
 			SELECT * FROM meta.commands_invoked
-			ORDER BY invokes DESC
-			LIMIT 10
-			"""
+			WHERE command = ANY($1)
+			""", 
+			unflushed_commands
 		)
 		
 		channel_types = [type(c) for c in ctx.bot.get_all_channels()]
@@ -239,7 +249,11 @@ class Meta(commands.Cog):
 		total_members_online = sum(1 for m in ctx.bot.get_all_members() if m.status != discord.Status.offline)
 		unique_members = set(ctx.bot.get_all_members())
 		unique_members_online = sum(1 for m in unique_members if m.status != discord.Status.offline)
-		top_commands = [(record["command"], record["invokes"]) for record in records]
+		# Include unflushed command statistics, merged before ranking
+		commands_invoked = stats["commands_invoked"] + ctx.bot.command_statistics.unflushed_commands_invoked()
+		command_invokes = collections.Counter({record["command"]: record["invokes"] for record in records})
+		command_invokes.update(ctx.bot.command_statistics.unflushed_command_invokes())
+		top_commands = command_invokes.most_common(10)
 		session_top_5 = sorted(ctx.bot.session_commands_invoked.items(), key = lambda i: i[1], reverse = True)[:5]
 		
 		fields = [("Uptime", duration_to_string(datetime.datetime.now(datetime.timezone.utc) - ctx.bot.online_time, abbreviate = True)), 
@@ -247,7 +261,7 @@ class Meta(commands.Cog):
 					("Recorded Restarts", f"{stats['restarts']:,}"), 
 					("Commands", f"{len(ctx.bot.commands)} main\n{len(set(ctx.bot.walk_commands()))} total"), 
 					("Commands Invoked", f"{sum(ctx.bot.session_commands_invoked.values())} this session\n"
-											f"{stats['commands_invoked']:,} total recorded"), 
+											f"{commands_invoked:,} total recorded"), 
 					("Cogs Reloaded", f"{stats['cogs_reloaded']:,}"),  # TODO: cogs reloaded this session
 					("Servers", len(ctx.bot.guilds)), 
 					("Channels", f"{channel_types.count(discord.TextChannel)} text\n"
@@ -300,8 +314,13 @@ class Meta(commands.Cog):
 	
 	@version.command(name = "stockfish")
 	async def version_stockfish(self, ctx):
-		transport, engine = await chess.engine.popen_uci(f"bin/{STOCKFISH_EXECUTABLE}", creationflags = subprocess.CREATE_NO_WINDOW)
-		await ctx.embed_reply(engine.id["name"])
+		if not (cog := ctx.bot.get_cog("Chess")):
+			return await ctx.embed_reply(":no_entry: Error: Chess cog not loaded")
+		try:
+			engine_name = await cog.engine_pool.get_engine_name()
+		except RuntimeError as e:
+			return await ctx.embed_reply(f":no_entry: Error: {e}")
+		await ctx.embed_reply(engine_name)
 	
 	# Update Bot Stuff
 	
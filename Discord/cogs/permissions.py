@@ -51,6 +51,18 @@ class Permissions(commands.Cog):
 			)
 			"""
 		)
+		# Notify on changes, for permission resolver cache invalidation
+		for table in ("permissions.everyone", "permissions.roles", "permissions.users"):
+			async with self.bot.db.acquire() as connection:
+				async with connection.transaction():
+					await connection.execute(f"DROP TRIGGER IF EXISTS notify_change ON {table}")
+					await connection.execute(
+						f"""
+						CREATE TRIGGER notify_change
+						AFTER INSERT OR UPDATE OR DELETE ON {table}
+						FOR EACH ROW EXECUTE FUNCTION meta.notify_change('guild_permissions_changed', 'guild_id')
+						"""
+					)
 	
 	@commands.group(invoke_without_command = True, case_insensitive = True)
 	@checks.not_forbidden()
@@ -74,6 +86,7 @@ class Permissions(commands.Cog):
 			""", 
 			ctx.guild.id, self.bot.all_commands[permission].name, setting
 		)
+		ctx.bot.permission_resolver.invalidate(ctx.guild.id)
 		await ctx.embed_reply(f"{permission} set to {setting} for everyone", 
 								title = "Permission Updated")
 	
@@ -93,6 +106,7 @@ class Permissions(commands.Cog):
 			""", 
 			ctx.guild.id, role.id, self.bot.all_commands[permission].name, setting
 		)
+		ctx.bot.permission_resolver.invalidate(ctx.guild.id)
 		await ctx.embed_reply(f"{permission} set to {setting} for the role, {role.mention}", 
 								title = "Permission Updated")
 	
@@ -112,6 +126,7 @@ class Permissions(commands.Cog):
 			""", 
 			ctx.guild.id, user.id, self.bot.all_commands[permission].name, setting
 		)
+		ctx.bot.permission_resolver.invalidate(ctx.guild.id)
 		await ctx.embed_reply(f"{permission} set to {setting} for {user.mention}", 
 								title = "Permission Updated")
 	
@@ -2,10 +2,15 @@
 import discord
 from discord.ext import commands
 
+import asyncio
+import logging
+import time
 from typing import Optional
 
 from utilities import checks
 
+errors_logger = logging.getLogger("errors")
+
 def setup(bot):
 	bot.add_cog(Pinboard(bot))
 
@@ -16,7 +21,15 @@ class Pinboard(commands.Cog):
 		self.default_threshold = 3
 		self.pin_emotes = ("\N{PUSHPIN}", "\N{ROUND PUSHPIN}", 
 							"\N{WHITE MEDIUM STAR}", "\N{GLOWING STAR}", "\N{SHOOTING STAR}")
-		self.bot.loop.create_task(self.initialize_database(), name = "Initialize database")
+		self.backfill_jobs = {}
+		self.initialize_task = self.bot.loop.create_task(self.initialize_database(), name = "Initialize database")
+		self.bot.loop.create_task(self.load_backfill_jobs(), name = "Load pinboard backfill jobs")
+	
+	def cog_unload(self):
+		self.initialize_task.cancel()
+		for job in self.backfill_jobs.values():
+			if job.task:
+				job.task.cancel()
 	
 	async def initialize_database(self):
 		await self.bot.connect_to_database()
@@ -50,6 +63,45 @@ class Pinboard(commands.Cog):
 			)
 			"""
 		)
+		await self.bot.db.execute(
+			"""
+			CREATE TABLE IF NOT EXISTS pinboard.backfill_jobs (
+				guild_id			BIGINT PRIMARY KEY, 
+				channel_id			BIGINT, 
+				threshold			INT, 
+				private_channels	BOOL, 
+				state				TEXT, 
+				last_message_id		BIGINT DEFAULT 0, 
+				total				INT, 
+				processed			INT DEFAULT 0, 
+				posted				INT DEFAULT 0, 
+				status_channel_id	BIGINT, 
+				status_message_id	BIGINT, 
+				started_at			TIMESTAMPTZ DEFAULT NOW(), 
+				updated_at			TIMESTAMPTZ DEFAULT NOW()
+			)
+			"""
+		)
+	
+	async def load_backfill_jobs(self):
+		await self.initialize_task
+		await self.bot.wait_until_ready()
+		records = await self.bot.db.fetch(
+			"""
+			SELECT * FROM pinboard.backfill_jobs
+			WHERE state = 'running' OR state = 'paused'
+			"""
+		)
+		for record in records:
+			status_message = None
+			if status_channel := self.bot.get_channel(record["status_channel_id"]):
+				try:
+					status_message = await status_channel.fetch_message(record["status_message_id"])
+				except discord.HTTPException:
+					pass
+			job = self.backfill_jobs[record["guild_id"]] = BackfillJob(self, record, status_message)
+			if job.state == "running":
+				job.start()
 	
 	@commands.group(aliases = ["starboard"], invoke_without_command = True, case_insensitive = True)
 	@commands.is_owner()
@@ -61,14 +113,18 @@ class Pinboard(commands.Cog):
 		'''
 		await ctx.send_help(ctx.command)
 	
-	@pinboard.command()
+	@pinboard.group(invoke_without_command = True, case_insensitive = True)
 	@commands.check_any(checks.is_permitted(), checks.is_guild_owner())
 	@commands.guild_only()
 	async def backfill(self, ctx):
 		'''
 		Backfill pins into current pinboard channel
 		This can take a while depending on how many missing pinned messages there are
+		Backfills run in the background, with progress updated in the response message
+		Progress is saved, so backfills continue after restarts
 		'''
+		if (job := self.backfill_jobs.get(ctx.guild.id)) and job.state in ("running", "paused"):
+			return await ctx.embed_reply(f":no_entry: Error: A backfill is already {job.state}")
 		record = await ctx.bot.db.fetchrow(
 			"""
 			SELECT channel_id, threshold, private_channels
@@ -77,39 +133,72 @@ class Pinboard(commands.Cog):
 			""", 
 			ctx.guild.id
 		)
-		pinboard_channel_id = record["channel_id"]
-		threshold = record["threshold"] or self.default_threshold
-		private_channels_setting = record["private_channels"]
-		if not pinboard_channel_id:
+		if not record or not record["channel_id"]:
 			return await ctx.embed_reply(":no_entry: Error: Pinboard channel not set")
+		threshold = record["threshold"] or self.default_threshold
+		total = await ctx.bot.db.fetchval(
+			"""
+			SELECT COUNT(*) FROM (
+				SELECT message_id
+				FROM pinboard.pins
+				INNER JOIN pinboard.pinners USING (message_id)
+				WHERE pinboard.pins.guild_id = $1
+				GROUP BY message_id
+				HAVING COUNT(*) >= $2
+			) AS candidates
+			""", 
+			ctx.guild.id, threshold
+		)
 		response = await ctx.embed_reply("Backfilling...")
-		pinboard_channel = self.bot.get_channel(pinboard_channel_id)
-		async with ctx.bot.database_connection_pool.acquire() as connection:
-			async with connection.transaction():
-				# Postgres requires non-scrollable cursors to be created
-				# and used in a transaction.
-				async for record in connection.cursor("SELECT * FROM pinboard.pins WHERE guild_id = $1 ORDER BY message_id", 
-														ctx.guild.id):
-					try:
-						await pinboard_channel.fetch_message(record["pinboard_message_id"])
-					except (discord.NotFound, discord.HTTPException):
-						pin_count = await self.bot.db.fetchval("SELECT COUNT(*) FROM pinboard.pinners WHERE message_id = $1",
-																record["message_id"])
-						if pin_count < threshold:
-							continue
-						pinned_message_channel = self.bot.get_channel(record["channel_id"])
-						if not private_channels_setting and pinned_message_channel.overwrites_for(ctx.guild.default_role).read_messages == False:
-							continue
-						pinned_message = await pinned_message_channel.fetch_message(record["message_id"])
-						pinboard_message = await self.send_pinboard_message(pinboard_channel, pinned_message, pin_count)
-						await self.bot.db.execute("UPDATE pinboard.pins SET pinboard_message_id = $1 WHERE message_id = $2",
-													pinboard_message.id, record["message_id"])
-		if ctx.channel.id == pinboard_channel_id:
-			await ctx.bot.attempt_delete_message(response)
-		else:
-			embed = response.embeds[0]
-			embed.description = "Backfill complete"
-			await response.edit(embed = embed)
+		record = await ctx.bot.db.fetchrow(
+			"""
+			INSERT INTO pinboard.backfill_jobs (guild_id, channel_id, threshold, private_channels, state, 
+												total, status_channel_id, status_message_id)
+			VALUES ($1, $2, $3, $4, 'running', $5, $6, $7)
+			ON CONFLICT (guild_id) DO
+			UPDATE SET channel_id = $2, threshold = $3, private_channels = $4, state = 'running', 
+				last_message_id = 0, total = $5, processed = 0, posted = 0, 
+				status_channel_id = $6, status_message_id = $7, started_at = NOW(), updated_at = NOW()
+			RETURNING *
+			""", 
+			ctx.guild.id, record["channel_id"], threshold, record["private_channels"], total, 
+			ctx.channel.id, response.id
+		)
+		job = self.backfill_jobs[ctx.guild.id] = BackfillJob(self, record, response)
+		job.start()
+	
+	@backfill.command(name = "cancel", aliases = ["stop"])
+	@commands.check_any(checks.is_permitted(), checks.is_guild_owner())
+	@commands.guild_only()
+	async def backfill_cancel(self, ctx):
+		'''Cancel the current backfill'''
+		if not (job := self.backfill_jobs.get(ctx.guild.id)) or job.state not in ("running", "paused"):
+			return await ctx.embed_reply(":no_entry: Error: No backfill in progress")
+		await job.cancel()
+		await ctx.embed_reply("Cancelled backfill")
+	
+	@backfill.command(name = "pause")
+	@commands.check_any(checks.is_permitted(), checks.is_guild_owner())
+	@commands.guild_only()
+	async def backfill_pause(self, ctx):
+		'''
+		Pause the current backfill
+		The backfill stops once the pins currently being processed are done
+		'''
+		if not (job := self.backfill_jobs.get(ctx.guild.id)) or job.state != "running":
+			return await ctx.embed_reply(":no_entry: Error: No backfill running")
+		await job.pause()
+		await ctx.embed_reply("Paused backfill")
+	
+	@backfill.command(name = "resume", aliases = ["continue"])
+	@commands.check_any(checks.is_permitted(), checks.is_guild_owner())
+	@commands.guild_only()
+	async def backfill_resume(self, ctx):
+		'''Resume the current backfill'''
+		if not (job := self.backfill_jobs.get(ctx.guild.id)) or job.state != "paused":
+			return await ctx.embed_reply(":no_entry: Error: No backfill paused")
+		await job.resume()
+		await ctx.embed_reply("Resumed backfill")
 	
 	# TODO: pinboard off option
 	@pinboard.command()
@@ -321,3 +410,157 @@ class Pinboard(commands.Cog):
 		embed.set_footer(text = f"In #{pinned_message.channel}")
 		return await pinboard_channel.send(embed = embed)
 
+class BackfillJob:
+	
+	'''
+	Pinboard backfill for a guild, run in the background
+	Progress is checkpointed in the database after each page of pins, so jobs can be resumed
+	Pins in each page are checked with bounded concurrency, and missing ones are posted in order
+	Progress is reported by editing the status message, at most once per status interval
+	'''
+	
+	def __init__(self, cog, record, status_message = None, *, page_size = 50, max_concurrency = 5, 
+					status_interval = 5):
+		self.cog = cog
+		self.bot = cog.bot
+		self.guild_id = record["guild_id"]
+		self.channel_id = record["channel_id"]
+		self.threshold = record["threshold"]
+		self.private_channels = record["private_channels"]
+		self.state = record["state"]
+		self.last_message_id = record["last_message_id"]
+		self.total = record["total"]
+		self.processed = record["processed"]
+		self.posted = record["posted"]
+		self.status_message = status_message
+		self.page_size = page_size
+		self.semaphore = asyncio.Semaphore(max_concurrency)
+		self.status_interval = status_interval
+		self.status_updated = 0
+		self.error = None
+		self.task = None
+	
+	def start(self):
+		self.task = self.bot.loop.create_task(self.run(), name = f"Pinboard backfill for {self.guild_id}")
+	
+	async def pause(self):
+		# Checked between pages
+		self.state = "paused"
+		await self.save()
+	
+	async def resume(self):
+		self.state = "running"
+		await self.save()
+		if not self.task or self.task.done():
+			self.start()
+	
+	async def cancel(self):
+		self.state = "cancelled"
+		if self.task:
+			self.task.cancel()
+		await self.save()
+		await self.update_status(force = True)
+	
+	async def save(self):
+		await self.bot.db.execute(
+			"""
+			UPDATE pinboard.backfill_jobs
+			SET state = $2, last_message_id = $3, processed = $4, posted = $5, updated_at = NOW()
+			WHERE guild_id = $1
+			""", 
+			self.guild_id, self.state, self.last_message_id, self.processed, self.posted
+		)
+	
+	async def run(self):
+		while True:
+			try:
+				pinboard_channel = self.bot.get_channel(self.channel_id)
+				while self.state == "running":
+					records = await self.bot.db.fetch(
+						"""
+						SELECT pinboard.pins.message_id, channel_id, pinboard_message_id, COUNT(*) AS pin_count
+						FROM pinboard.pins
+						INNER JOIN pinboard.pinners USING (message_id)
+						WHERE pinboard.pins.guild_id = $1 AND pinboard.pins.message_id > $2
+						GROUP BY pinboard.pins.message_id
+						HAVING COUNT(*) >= $3
+						ORDER BY pinboard.pins.message_id
+						LIMIT $4
+						""", 
+						self.guild_id, self.last_message_id, self.threshold, self.page_size
+					)
+					if not records:
+						self.state = "completed"
+						break
+					pinned_messages = await asyncio.gather(*(self.get_missing_pin(pinboard_channel, record) 
+																for record in records))
+					for record, pinned_message in zip(records, pinned_messages):
+						if pinned_message:
+							pinboard_message = await self.cog.send_pinboard_message(pinboard_channel, pinned_message, 
+																					record["pin_count"])
+							await self.bot.db.execute(
+								"""
+								UPDATE pinboard.pins
+								SET pinboard_message_id = $1
+								WHERE message_id = $2
+								""", 
+								pinboard_message.id, record["message_id"]
+							)
+							self.posted += 1
+						self.processed += 1
+					self.last_message_id = records[-1]["message_id"]
+					await self.save()
+					await self.update_status()
+			except asyncio.CancelledError:
+				# Cancelled or unloaded, with progress saved after the last page
+				raise
+			except Exception as e:
+				self.state = "failed"
+				self.error = f"{type(e).__name__}: {e}"
+				errors_logger.error(f"Pinboard backfill for {self.guild_id} failed\n", 
+									exc_info = (type(e), e, e.__traceback__))
+			await self.save()
+			await self.update_status(force = True)
+			# Resumed while the final save or status update was pending, after the loop had already exited
+			if self.state != "running":
+				break
+	
+	async def get_missing_pin(self, pinboard_channel, record):
+		'''Get the pinned message for a pin if it's missing from the pinboard and should be posted'''
+		async with self.semaphore:
+			if record["pinboard_message_id"]:
+				try:
+					await pinboard_channel.fetch_message(record["pinboard_message_id"])
+					return None
+				except (discord.NotFound, discord.HTTPException):
+					pass
+			if not (pinned_message_channel := self.bot.get_channel(record["channel_id"])):
+				return None
+			if not self.private_channels and pinned_message_channel.overwrites_for(pinned_message_channel.guild.default_role).read_messages == False:
+				return None
+			try:
+				return await pinned_message_channel.fetch_message(record["message_id"])
+			except (discord.NotFound, discord.Forbidden):
+				return None
+	
+	async def update_status(self, *, force = False):
+		if not self.status_message or not force and time.monotonic() < self.status_updated + self.status_interval:
+			return
+		self.status_updated = time.monotonic()
+		progress = f"{self.processed:,}/{self.total:,} pins checked, {self.posted:,} posted"
+		if self.state == "completed" and self.status_message.channel.id == self.channel_id:
+			await self.bot.attempt_delete_message(self.status_message)
+			self.status_message = None
+			return
+		descriptions = {"running": f"Backfilling...\n{progress}", "paused": f"Backfill paused\n{progress}", 
+						"cancelled": f"Backfill cancelled\n{progress}", 
+						"completed": f"Backfill complete\n{progress}", 
+						"failed": f"Backfill failed: {self.error}\n{progress}"}
+		embed = self.status_message.embeds[0]
+		embed.description = descriptions[self.state]
+		try:
+			await self.status_message.edit(embed = embed)
+		except discord.NotFound:
+			# Status message deleted
+			self.status_message = None
+
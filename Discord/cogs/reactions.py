@@ -92,9 +92,7 @@ class PlayingMenu(Menu):
 		return str(payload.emoji) in self.buttons
 	
 	async def is_permitted(self, command, user_id):
-		while ((permitted := await self.ctx.get_permission(command.name, id = user_id)) is None
-				and command.parent is not None):
-			command = command.parent
+		permitted = await self.ctx.get_command_permission(command, id = user_id)
 		return permitted or user_id in (self.ctx.guild.owner.id, self.bot.owner_id)
 	
 	@menus.button('\N{BLACK RIGHT-POINTING TRIANGLE WITH DOUBLE VERTICAL BAR}', position = 1)
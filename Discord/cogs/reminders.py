@@ -3,7 +3,12 @@ import discord
 from discord.ext import commands, menus, tasks
 
 import asyncio
+import contextlib
 import datetime
+import heapq
+import logging
+import sys
+import traceback
 from typing import Optional
 
 from parsedatetime import Calendar, VERSION_CONTEXT_STYLE
@@ -11,6 +16,8 @@ from parsedatetime import Calendar, VERSION_CONTEXT_STYLE
 from utilities import checks
 from utilities.menu import Menu
 
+errors_logger = logging.getLogger("errors")
+
 def setup(bot):
 	bot.add_cog(Reminders(bot))
 
@@ -29,15 +36,18 @@ class Reminders(commands.Cog):
 		
 		self.menus = []
 		
-		self.current_timer = None
-		self.new_reminder = asyncio.Event()
-		self.restarting_timer = False
+		self.scheduler = ReminderScheduler()
+		self.dispatch_semaphore = asyncio.Semaphore(10)
+		self.dispatch_tasks = set()
 		self.timer.start().set_name("Reminders")
 	
 	def cog_unload(self):
 		for menu in self.menus:
 			menu.stop()
 		self.timer.cancel()
+		# Undelivered reminders are loaded again when the cog is reloaded
+		for task in self.dispatch_tasks:
+			task.cancel()
 	
 	async def initialize_database(self):
 		await self.bot.connect_to_database()
@@ -58,6 +68,19 @@ class Reminders(commands.Cog):
 			)
 			"""
 		)
+		await self.bot.db.execute(
+			"""
+			ALTER TABLE reminders.reminders
+			ADD COLUMN IF NOT EXISTS missed BOOL DEFAULT FALSE
+			"""
+		)
+		await self.bot.db.execute(
+			"""
+			CREATE INDEX IF NOT EXISTS reminders_pending_remind_time_index
+			ON reminders.reminders (remind_time)
+			WHERE reminded = FALSE AND cancelled = FALSE AND failed = FALSE AND missed = FALSE
+			"""
+		)
 	
 	async def cog_check(self, ctx):
 		return await checks.not_forbidden().predicate(ctx)
@@ -108,20 +131,16 @@ class Reminders(commands.Cog):
 											timestamp = parsed_datetime)
 		# Insert into database
 		created_time = ctx.message.created_at.replace(tzinfo = datetime.timezone.utc)
-		await self.bot.db.execute(
+		record = await self.bot.db.fetchrow(
 			"""
 			INSERT INTO reminders.reminders (user_id, channel_id, message_id, created_time, remind_time, reminder)
 			VALUES ($1, $2, $3, $4, $5, $6)
+			RETURNING *
 			""", 
 			ctx.author.id, ctx.channel.id, response.id, created_time, parsed_datetime, reminder
 		)
-		# Update timer
-		if self.current_timer and parsed_datetime < self.current_timer["remind_time"]:
-			self.restarting_timer = True
-			self.timer.restart()
-			self.timer.get_task().set_name("Reminders")
-		else:
-			self.new_reminder.set()
+		# Schedule
+		self.scheduler.add(record)
 	
 	@reminder_command.command(aliases = ["delete", "remove"])
 	async def cancel(self, ctx, reminder_id: int):
@@ -130,17 +149,14 @@ class Reminders(commands.Cog):
 			"""
 			UPDATE reminders.reminders
 			SET cancelled = TRUE
-			WHERE id = $1 AND user_id = $2 AND reminded = FALSE AND failed = FALSE
+			WHERE id = $1 AND user_id = $2 AND reminded = FALSE AND failed = FALSE AND missed = FALSE
 			RETURNING *
 			""", 
 			reminder_id, ctx.author.id
 		)
 		if not cancelled:
 			return await ctx.embed_reply(f"{ctx.bot.error_emoji} Error: Unable to find and cancel reminder")
-		if self.current_timer and self.current_timer["id"] == reminder_id:
-			self.restarting_timer = True
-			self.timer.restart()
-			self.timer.get_task().set_name("Reminders")
+		self.scheduler.cancel(reminder_id)
 		await ctx.embed_reply(fields = (("Cancelled Reminder", cancelled["reminder"] or ctx.bot.ZWS),), 
 								footer_text = f"Set for {cancelled['remind_time'].isoformat(timespec = 'seconds').replace('+00:00', 'Z')}", 
 								timestamp = cancelled["remind_time"])
@@ -155,7 +171,7 @@ class Reminders(commands.Cog):
 			"""
 			SELECT id, channel_id, message_id, remind_time, reminder
 			FROM reminders.reminders
-			WHERE user_id = $1 AND reminded = FALSE AND cancelled = FALSE AND failed = FALSE
+			WHERE user_id = $1 AND reminded = FALSE AND cancelled = FALSE AND failed = FALSE AND missed = FALSE
 			ORDER BY remind_time
 			LIMIT $2 OFFSET $3
 			""", 
@@ -186,7 +202,7 @@ class Reminders(commands.Cog):
 			"""
 			SELECT id, channel_id, message_id, remind_time, reminder
 			FROM reminders.reminders
-			WHERE user_id = $1 AND reminded = FALSE AND cancelled = FALSE AND failed = FALSE
+			WHERE user_id = $1 AND reminded = FALSE AND cancelled = FALSE AND failed = FALSE AND missed = FALSE
 			ORDER BY remind_time
 			""", 
 			ctx.author.id
@@ -201,40 +217,68 @@ class Reminders(commands.Cog):
 	# R/PT0S
 	@tasks.loop()
 	async def timer(self):
-		record = await self.bot.db.fetchrow(
+		now = datetime.datetime.now(datetime.timezone.utc)
+		if self.scheduler.window_expired(now):
+			await self.load_reminders(now)
+		for record in self.scheduler.pop_due(now):
+			self.dispatch(record)
+		await self.scheduler.wait()
+	
+	async def load_reminders(self, now):
+		records = await self.bot.db.fetch(
 			"""
 			SELECT * FROM reminders.reminders
-			WHERE reminded = FALSE AND cancelled = FALSE AND failed = FALSE
-			ORDER BY remind_time
-			LIMIT 1
-			"""
+			WHERE reminded = FALSE AND cancelled = FALSE AND failed = FALSE AND missed = FALSE AND 
+				remind_time <= $1
+			""", 
+			self.scheduler.extend_window(now)
 		)
-		if not record:
-			self.new_reminder.clear()
-			return await self.new_reminder.wait()
-		self.current_timer = record
-		await discord.utils.sleep_until(record["remind_time"])
-		if not (channel := self.bot.get_channel(record["channel_id"])):
-			# TODO: Attempt to fetch channel?
-			return await self.bot.db.execute("UPDATE reminders.reminders SET failed = TRUE WHERE id = $1", record["id"])
-		user = self.bot.get_user(record["user_id"]) or await self.bot.fetch_user(record["user_id"])
-		# TODO: Handle user not found?
-		embed = discord.Embed(color = self.bot.bot_color)
-		try:
-			message = await channel.fetch_message(record["message_id"])
-			embed.description = f"[{record['reminder'] or 'Reminder'}]({message.jump_url})"
-		except discord.NotFound:
-			embed.description = record["reminder"] or "Reminder"
-		embed.set_footer(text = "Reminder set")
-		embed.timestamp = record["created_time"]
+		missed = self.scheduler.load(records)
+		if missed:
+			await self.bot.db.execute(
+				"""
+				UPDATE reminders.reminders
+				SET missed = TRUE
+				WHERE id = ANY($1)
+				""", 
+				[record["id"] for record in missed]
+			)
+	
+	def dispatch(self, record):
+		task = self.bot.loop.create_task(self.send_reminder(record), name = f"Reminder {record['id']}")
+		self.dispatch_tasks.add(task)
+		task.add_done_callback(self.dispatch_tasks.discard)
+	
+	async def send_reminder(self, record):
 		try:
-			await channel.send(user.mention, embed = embed)
-		except discord.Forbidden:
-			# TODO: Attempt to send without embed
-			# TODO: Fall back to DM
-			await self.bot.db.execute("UPDATE reminders.reminders SET failed = TRUE WHERE id = $1", record["id"])
-		else:
-			await self.bot.db.execute("UPDATE reminders.reminders SET reminded = TRUE WHERE id = $1", record["id"])
+			async with self.dispatch_semaphore:
+				if not (channel := self.bot.get_channel(record["channel_id"])):
+					# TODO: Attempt to fetch channel?
+					return await self.bot.db.execute("UPDATE reminders.reminders SET failed = TRUE WHERE id = $1", record["id"])
+				user = self.bot.get_user(record["user_id"]) or await self.bot.fetch_user(record["user_id"])
+				# TODO: Handle user not found?
+				embed = discord.Embed(color = self.bot.bot_color)
+				try:
+					message = await channel.fetch_message(record["message_id"])
+					embed.description = f"[{record['reminder'] or 'Reminder'}]({message.jump_url})"
+				except discord.NotFound:
+					embed.description = record["reminder"] or "Reminder"
+				embed.set_footer(text = "Reminder set")
+				embed.timestamp = record["created_time"]
+				try:
+					await channel.send(user.mention, embed = embed)
+				except discord.Forbidden:
+					# TODO: Attempt to send without embed
+					# TODO: Fall back to DM
+					await self.bot.db.execute("UPDATE reminders.reminders SET failed = TRUE WHERE id = $1", record["id"])
+				else:
+					await self.bot.db.execute("UPDATE reminders.reminders SET reminded = TRUE WHERE id = $1", record["id"])
+		except Exception as e:
+			print(f"Exception sending reminder {record['id']}", file = sys.stderr)
+			traceback.print_exception(type(e), e, e.__traceback__, file = sys.stderr)
+			errors_logger.error("Uncaught reminder exception\n", exc_info = (type(e), e, e.__traceback__))
+		finally:
+			self.scheduler.dispatched(record["id"])
 	
 	@timer.before_loop
 	async def before_timer(self):
@@ -243,10 +287,7 @@ class Reminders(commands.Cog):
 	
 	@timer.after_loop
 	async def after_timer(self):
-		if self.restarting_timer:
-			self.restarting_timer = False
-		else:
-			self.bot.print("Reminders task cancelled")
+		self.bot.print("Reminders task cancelled")
 
 class RemindersMenu(Menu, menus.MenuPages):
 	
@@ -291,3 +332,94 @@ class RemindersSource(menus.ListPageSource):
 			return embed.set_footer(text = f"In response to: {menu.ctx.message.clean_content}")
 		return {"content": f"In response to: `{menu.ctx.message.clean_content}`", "embed": embed}
 
+class ReminderScheduler:
+	
+	'''
+	Min-heap of upcoming reminders
+	Reminders are loaded in windows of the next window duration
+	Cancelled reminders are removed lazily, when they reach the top of the heap
+	catch_up_policy determines how reminders missed while offline are handled:
+	"send_all" sends them all, "skip_all" marks them all missed, and
+	"send_recent" sends those missed by at most catch_up_window and marks the rest missed
+	'''
+	
+	catch_up_policies = ("send_all", "skip_all", "send_recent")
+	
+	def __init__(self, *, window = datetime.timedelta(minutes = 10), 
+					catch_up_policy = "send_all", catch_up_window = datetime.timedelta(hours = 1)):
+		if catch_up_policy not in self.catch_up_policies:
+			raise ValueError(f"Invalid catch up policy: {catch_up_policy}")
+		self.window = window
+		self.catch_up_policy = catch_up_policy
+		self.catch_up_window = catch_up_window
+		self.heap = []
+		self.scheduled = {}
+		self.dispatching = set()
+		self.loaded_until = None
+		self.started_at = datetime.datetime.now(datetime.timezone.utc)
+		self.caught_up = False
+		self.wake = asyncio.Event()
+	
+	def __len__(self):
+		return len(self.scheduled)
+	
+	def window_expired(self, now):
+		return self.loaded_until is None or now >= self.loaded_until
+	
+	def extend_window(self, now):
+		# Extended before loading, so reminders added while loading are scheduled
+		self.loaded_until = now + self.window
+		return self.loaded_until
+	
+	def load(self, records):
+		'''Schedule loaded reminders and return those missed, per the catch up policy'''
+		missed = []
+		for record in records:
+			if record["id"] in self.scheduled or record["id"] in self.dispatching:
+				continue
+			if not self.caught_up and record["remind_time"] < self.started_at:
+				if (self.catch_up_policy == "skip_all" or 
+					self.catch_up_policy == "send_recent" and 
+					record["remind_time"] < self.started_at - self.catch_up_window):
+					missed.append(record)
+					continue
+			self.push(record)
+		self.caught_up = True
+		return missed
+	
+	def push(self, record):
+		self.scheduled[record["id"]] = record
+		heapq.heappush(self.heap, (record["remind_time"], record["id"]))
+		if self.heap[0][1] == record["id"]:
+			self.wake.set()
+	
+	def add(self, record):
+		# Reminders beyond the loaded window are loaded with a later window
+		if self.loaded_until and record["remind_time"] <= self.loaded_until:
+			self.push(record)
+	
+	def cancel(self, reminder_id):
+		return self.scheduled.pop(reminder_id, None)
+	
+	def pop_due(self, now):
+		due = []
+		while self.heap and self.heap[0][0] <= now:
+			_, reminder_id = heapq.heappop(self.heap)
+			if (record := self.scheduled.pop(reminder_id, None)) is not None:
+				self.dispatching.add(reminder_id)
+				due.append(record)
+		return due
+	
+	def dispatched(self, reminder_id):
+		self.dispatching.discard(reminder_id)
+	
+	async def wait(self):
+		'''Wait until the next reminder is due, the window expires, or a new earliest reminder is added'''
+		now = datetime.datetime.now(datetime.timezone.utc)
+		next_time = self.loaded_until
+		if self.heap:
+			next_time = min(next_time, self.heap[0][0])
+		self.wake.clear()
+		with contextlib.suppress(asyncio.TimeoutError):
+			await asyncio.wait_for(self.wake.wait(), max((next_time - now).total_seconds(), 0))
+
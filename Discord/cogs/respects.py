@@ -2,16 +2,26 @@
 import discord
 from discord.ext import commands
 
+import asyncio
+import collections
+import contextlib
 import io
+import logging
 import math
 
 ## import astropy.modeling
 import matplotlib
+import matplotlib.figure
+import matplotlib.ticker
 import numpy
 ## import scipy
 
 from utilities import checks
 
+errors_logger = logging.getLogger("errors")
+
+INITIALIZE_ATTEMPTS = 5
+
 def setup(bot):
 	bot.add_cog(Respects(bot))
 
@@ -19,7 +29,42 @@ class Respects(commands.Cog):
 	
 	def __init__(self, bot):
 		self.bot = bot
-		self.bot.loop.create_task(self.initialize_database(), name = "Initialize database")
+		self.counter = RespectsCounter(bot)
+		self.initialize_task = self.bot.loop.create_task(self.initialize(), name = "Initialize respects")
+	
+	def cog_unload(self):
+		self.initialize_task.cancel()
+		# Flush remaining deltas
+		self.bot.loop.create_task(self.counter.stop(), name = "Stop respects counter")
+	
+	async def initialize(self):
+		for attempt in range(1, INITIALIZE_ATTEMPTS + 1):
+			try:
+				await self.initialize_database()
+				await self.counter.load()
+			except Exception as e:
+				errors_logger.error(f"Failed to initialize respects (attempt {attempt} of {INITIALIZE_ATTEMPTS})\n", 
+									exc_info = (type(e), e, e.__traceback__))
+				if attempt < INITIALIZE_ATTEMPTS:
+					await asyncio.sleep(2 ** attempt)
+			else:
+				self.counter.start()
+				return
+	
+	async def wait_until_loaded(self, ctx):
+		'''
+		Wait for respects to be loaded
+		If initialization failed, reply with an error, retry it in the background, and return False
+		'''
+		if self.counter.loaded.is_set():
+			return True
+		await asyncio.wait((self.initialize_task,))
+		if self.counter.loaded.is_set():
+			return True
+		await ctx.embed_reply(":no_entry: Error: Failed to load respects\nPlease try again later")
+		if self.initialize_task.done():
+			self.initialize_task = self.bot.loop.create_task(self.initialize(), name = "Initialize respects")
+		return False
 	
 	async def initialize_database(self):
 		await self.bot.connect_to_database()
@@ -74,12 +119,12 @@ class Respects(commands.Cog):
 		Record of respects paid by each user began on 2016-12-20
 		Record of respects paid by each server began on 2018-09-04
 		'''
-		user_respects = await ctx.bot.db.fetchval("SELECT respects FROM respects.users WHERE user_id = $1", 
-													ctx.author.id) or 0
+		if not await self.wait_until_loaded(ctx):
+			return
+		user_respects = self.counter.users[ctx.author.id]
 		if ctx.guild:
-			guild_respects = await ctx.bot.db.fetchval("SELECT respects FROM respects.guilds WHERE guild_id = $1", 
-														ctx.guild.id) or 0
-		total_respects = await ctx.bot.db.fetchval("SELECT value FROM respects.stats WHERE stat = 'total'")
+			guild_respects = self.counter.guilds[ctx.guild.id]
+		total_respects = self.counter.total
 		response = f"You have paid {user_respects:,} respects\n"
 		if ctx.guild:
 			response += f"This server has paid {guild_respects:,} respects\n"
@@ -92,35 +137,9 @@ class Respects(commands.Cog):
 		Pay Respects
 		Can also be triggered with 'f' or 'F'
 		'''
-		total_respects = await ctx.bot.db.fetchval(
-			"""
-			UPDATE respects.stats
-			SET value = value + 1
-			WHERE stat = 'total'
-			RETURNING value
-			"""
-		)
-		if ctx.guild:
-			guild_respects = await ctx.bot.db.fetchval(
-				"""
-				INSERT INTO respects.guilds (guild_id, respects)
-				VALUES ($1, 1)
-				ON CONFLICT (guild_id) DO
-				UPDATE SET respects = guilds.respects + 1
-				RETURNING respects
-				""", 
-				ctx.guild.id
-			)
-		user_respects = await ctx.bot.db.fetchval(
-			"""
-			INSERT INTO respects.users (user_id, respects)
-			VALUES ($1, 1)
-			ON CONFLICT (user_id) DO
-			UPDATE SET respects = users.respects + 1
-			RETURNING respects
-			""", 
-			ctx.author.id
-		)
+		if not await self.wait_until_loaded(ctx):
+			return
+		total_respects, guild_respects, user_respects = self.counter.pay(ctx.author, ctx.guild)
 		suffix = ctx.bot.inflect_engine.ordinal(user_respects)[len(str(user_respects)):]
 		response = f"{ctx.author.mention} has paid their respects for the {user_respects:,}{suffix} time\n"
 		if ctx.guild:
@@ -131,43 +150,12 @@ class Respects(commands.Cog):
 	@respects.command(aliases = ["statistics"])
 	async def stats(self, ctx):
 		'''Statistics'''
-		total_respects = await ctx.bot.db.fetchval("SELECT value FROM respects.stats WHERE stat = 'total'")
-		respects_paid = []
-		async with ctx.bot.database_connection_pool.acquire() as connection:
-			async with connection.transaction():
-				# Postgres requires non-scrollable cursors to be created
-				# and used in a transaction.
-				async for record in connection.cursor("SELECT * FROM respects.users"):
-					respects_paid.append(record["respects"])
-		# TODO: Optimize
-		# TODO: Fit curve
-		## n, bins, _ = matplotlib.pyplot.hist(respects_paid, log = True, 
-		figure = matplotlib.figure.Figure()
-		axes = figure.add_subplot(xscale = "log", xlabel = "Respects Paid", ylabel = "People")
-		last_power_of_10 = math.ceil(numpy.log10(max(respects_paid)))
-		bins = (10 ** numpy.arange(last_power_of_10))[:, numpy.newaxis] * numpy.arange(1, 10)
-		axes.hist(respects_paid, bins = bins.flatten(), log = True, ec = "black")
-		## bin_centers = bins[:-1] + numpy.diff(bins) / 2
-		## def func(x, a, b, c):
-		##	return a * numpy.exp(-b * x) + c
-		## popt, _ = scipy.optimize.curve_fit(func, bin_centers[1:], n[1:], p0 = (1000, 1, 1), maxfev = 100000)
-		## t_init = astropy.modeling.models.Gaussian1D()
-		## fit_t = astropy.modeling.fitting.LevMarLSQFitter()
-		## t = fit_t(t_init, bin_centers, n)
-		## x_interval_for_fit = numpy.linspace(bins[0], bins[-1], 10000)
-		## matplotlib.pyplot.plot(x_interval_for_fit, func(x_interval_for_fit, *popt), color = "red")
-		## axes.set_ylim(0.8)
-		formatter = matplotlib.ticker.ScalarFormatter()
-		formatter.set_scientific(False)
-		axes.get_xaxis().set_major_formatter(formatter)
-		axes.get_yaxis().set_major_formatter(formatter)
-		# Remove minor ticks < 1
-		axes.set_xticks([tick for tick in axes.get_xticks(minor = True) if tick >= 1], minor = True)
-		axes.set_yticks([tick for tick in axes.get_yticks(minor = True) if tick >= 1], minor = True)
-		axes.autoscale(enable = True)
-		buffer = io.BytesIO()
-		figure.savefig(buffer, format = "PNG")
-		buffer.seek(0)
+		if not await self.wait_until_loaded(ctx):
+			return
+		total_respects = self.counter.total
+		respects_paid = list(self.counter.users.values())
+		histogram = await ctx.bot.process_pool.submit(plot_respects_histogram, respects_paid)
+		buffer = io.BytesIO(histogram)
 		await ctx.embed_reply(fields = (("Total respects paid", f"{total_respects:,}"), 
 										("People who paid respects", f"{len(respects_paid):,}")),
 								image_url = "attachment://respects.png", 
@@ -178,15 +166,182 @@ class Respects(commands.Cog):
 		'''Top respects paid'''
 		if number > 10:
 			number = 10
-		fields = []
-		async with ctx.bot.database_connection_pool.acquire() as connection:
+		if not await self.wait_until_loaded(ctx):
+			return
+		fields = [(self.counter.user_names.get(user_id, str(user_id)), f"{respects:,}")
+					for user_id, respects in self.counter.top[:number]]
+		await ctx.embed_reply(title = "Top Respects Paid", fields = fields)
+
+def plot_respects_histogram(respects_paid):
+	'''Plot histogram of respects paid as PNG, for running in a worker process'''
+	# TODO: Fit curve
+	## n, bins, _ = matplotlib.pyplot.hist(respects_paid, log = True, 
+	figure = matplotlib.figure.Figure()
+	axes = figure.add_subplot(xscale = "log", xlabel = "Respects Paid", ylabel = "People")
+	last_power_of_10 = math.ceil(numpy.log10(max(respects_paid)))
+	bins = (10 ** numpy.arange(last_power_of_10))[:, numpy.newaxis] * numpy.arange(1, 10)
+	axes.hist(respects_paid, bins = bins.flatten(), log = True, ec = "black")
+	## bin_centers = bins[:-1] + numpy.diff(bins) / 2
+	## def func(x, a, b, c):
+	##	return a * numpy.exp(-b * x) + c
+	## popt, _ = scipy.optimize.curve_fit(func, bin_centers[1:], n[1:], p0 = (1000, 1, 1), maxfev = 100000)
+	## t_init = astropy.modeling.models.Gaussian1D()
+	## fit_t = astropy.modeling.fitting.LevMarLSQFitter()
+	## t = fit_t(t_init, bin_centers, n)
+	## x_interval_for_fit = numpy.linspace(bins[0], bins[-1], 10000)
+	## matplotlib.pyplot.plot(x_interval_for_fit, func(x_interval_for_fit, *popt), color = "red")
+	## axes.set_ylim(0.8)
+	formatter = matplotlib.ticker.ScalarFormatter()
+	formatter.set_scientific(False)
+	axes.get_xaxis().set_major_formatter(formatter)
+	axes.get_yaxis().set_major_formatter(formatter)
+	# Remove minor ticks < 1
+	axes.set_xticks([tick for tick in axes.get_xticks(minor = True) if tick >= 1], minor = True)
+	axes.set_yticks([tick for tick in axes.get_yticks(minor = True) if tick >= 1], minor = True)
+	axes.autoscale(enable = True)
+	buffer = io.BytesIO()
+	figure.savefig(buffer, format = "PNG")
+	return buffer.getvalue()
+
+class RespectsCounter:
+	
+	'''
+	Respects paid, kept in memory and authoritative once loaded
+	Deltas are flushed in a single transaction every flush_interval seconds
+	The top top_size users are maintained as respects are paid, with their names
+	'''
+	
+	def __init__(self, bot, *, flush_interval = 60, top_size = 10):
+		self.bot = bot
+		self.flush_interval = flush_interval
+		self.top_size = top_size
+		self.total = 0
+		self.guilds = collections.Counter()
+		self.users = collections.Counter()
+		# (user_id, respects), in descending order of respects
+		self.top = []
+		self.user_names = {}
+		self.total_delta = 0
+		self.guild_deltas = collections.Counter()
+		self.user_deltas = collections.Counter()
+		self.loaded = asyncio.Event()
+		self.lock = asyncio.Lock()
+		self.flusher = None
+	
+	async def load(self):
+		# Cleared in case of a retry after a failed load
+		self.guilds.clear()
+		self.users.clear()
+		async with self.bot.database_connection_pool.acquire() as connection:
 			async with connection.transaction():
+				self.total = await connection.fetchval("SELECT value FROM respects.stats WHERE stat = 'total'")
 				# Postgres requires non-scrollable cursors to be created
 				# and used in a transaction.
-				async for record in connection.cursor("SELECT * FROM respects.users ORDER BY respects DESC LIMIT $1", number):
-					user = ctx.bot.get_user(record["user_id"])
-					if not user:
-						user = await ctx.bot.fetch_user(record["user_id"])
-					fields.append((str(user), f"{record['respects']:,}"))
-		await ctx.embed_reply(title = "Top Respects Paid", fields = fields)
+				async for record in connection.cursor("SELECT * FROM respects.guilds"):
+					self.guilds[record["guild_id"]] = record["respects"]
+				async for record in connection.cursor("SELECT * FROM respects.users"):
+					self.users[record["user_id"]] = record["respects"]
+		self.top = [(user_id, respects) for user_id, respects in self.users.most_common(self.top_size)]
+		for user_id, _ in self.top:
+			if not (user := self.bot.get_user(user_id)):
+				try:
+					user = await self.bot.fetch_user(user_id)
+				except discord.HTTPException:
+					continue
+			self.user_names[user_id] = str(user)
+		self.loaded.set()
+	
+	def start(self):
+		if not self.flusher or self.flusher.done():
+			self.flusher = self.bot.loop.create_task(self.flusher_task(), name = "Respects flusher")
+	
+	def pay(self, user, guild = None):
+		'''Record respects paid and return the new total, guild, and user respects'''
+		self.total += 1
+		self.total_delta += 1
+		guild_respects = None
+		if guild:
+			self.guilds[guild.id] += 1
+			self.guild_deltas[guild.id] += 1
+			guild_respects = self.guilds[guild.id]
+		self.users[user.id] += 1
+		self.user_deltas[user.id] += 1
+		self.update_top(user, self.users[user.id])
+		return self.total, guild_respects, self.users[user.id]
+	
+	def update_top(self, user, respects):
+		# Respects only increase, so users can only enter the top from below
+		for index, (user_id, _) in enumerate(self.top):
+			if user_id == user.id:
+				self.top[index] = (user.id, respects)
+				break
+		else:
+			if len(self.top) >= self.top_size and respects <= self.top[-1][1]:
+				return
+			self.top.append((user.id, respects))
+		self.user_names[user.id] = str(user)
+		self.top.sort(key = lambda entry: entry[1], reverse = True)
+		for user_id, _ in self.top[self.top_size:]:
+			self.user_names.pop(user_id, None)
+		del self.top[self.top_size:]
+	
+	async def flusher_task(self):
+		while True:
+			await asyncio.sleep(self.flush_interval)
+			# Shield so that deltas taken for a flush are always written
+			await asyncio.shield(self.flush())
+	
+	async def flush(self):
+		async with self.lock:
+			if not self.total_delta:
+				return
+			total_delta, self.total_delta = self.total_delta, 0
+			guild_deltas, self.guild_deltas = self.guild_deltas, collections.Counter()
+			user_deltas, self.user_deltas = self.user_deltas, collections.Counter()
+			try:
+				async with self.bot.database_connection_pool.acquire() as connection:
+					async with connection.transaction():
+						await connection.execute(
+							"""
+							UPDATE respects.stats
+							SET value = value + $1
+							WHERE stat = 'total'
+							""", 
+							total_delta
+						)
+						if guild_deltas:
+							await connection.execute(
+								"""
+								INSERT INTO respects.guilds (guild_id, respects)
+								SELECT * FROM UNNEST($1::BIGINT[], $2::BIGINT[])
+								ON CONFLICT (guild_id) DO
+								UPDATE SET respects = guilds.respects + EXCLUDED.respects
+								""", 
+								list(guild_deltas.keys()), list(guild_deltas.values())
+							)
+						await connection.execute(
+							"""
+							INSERT INTO respects.users (user_id, respects)
+							SELECT * FROM UNNEST($1::BIGINT[], $2::BIGINT[])
+							ON CONFLICT (user_id) DO
+							UPDATE SET respects = users.respects + EXCLUDED.respects
+							""", 
+							list(user_deltas.keys()), list(user_deltas.values())
+						)
+			except Exception as e:
+				# Restore deltas to retry on next flush
+				self.total_delta += total_delta
+				self.guild_deltas.update(guild_deltas)
+				self.user_deltas.update(user_deltas)
+				errors_logger.error("Failed to flush respects\n", 
+									exc_info = (type(e), e, e.__traceback__))
+	
+	async def stop(self):
+		'''Stop the flusher and flush remaining deltas'''
+		if self.flusher:
+			self.flusher.cancel()
+			with contextlib.suppress(asyncio.CancelledError):
+				await self.flusher
+			self.flusher = None
+		await self.flush()
 
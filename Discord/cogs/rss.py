@@ -3,16 +3,20 @@ import discord
 from discord.ext import commands, tasks
 
 import asyncio
+import calendar
 import datetime
 import functools
 import html
 import io
 import logging
+import random
 import re
+import statistics
 import sys
 import time
 import textwrap
 import traceback
+from typing import Optional
 import urllib
 
 import aiohttp
@@ -34,15 +38,10 @@ class RSS(commands.Cog):
 	def __init__(self, bot):
 		self.bot = bot
 		
-		# Generate tzinfos
-		self.tzinfos = {}
-		for timezone_abbreviation in ("EDT", "EST"):
-			matching_timezones = list(filter(lambda t: datetime.datetime.now(pytz.timezone(t)).strftime("%Z") == timezone_abbreviation, pytz.common_timezones))
-			matching_utc_offsets = set(datetime.datetime.now(pytz.timezone(t)).strftime("%z") for t in matching_timezones)
-			if len(matching_utc_offsets) == 1:
-				self.tzinfos[timezone_abbreviation] = dateutil.tz.gettz(matching_timezones[0])
-		
 		self.new_feed = asyncio.Event()
+		self.fetcher = FeedFetcher(bot)
+		self.scheduler = FeedScheduler()
+		self.dispatcher = FeedDispatcher(bot)
 		self.check_feeds.start().set_name("RSS")
 	
 	def cog_unload(self):
@@ -62,6 +61,34 @@ class RSS(commands.Cog):
 			)
 			"""
 		)
+		await self.bot.db.execute(
+			"""
+			ALTER TABLE rss.feeds
+			ADD COLUMN IF NOT EXISTS etag			TEXT, 
+			ADD COLUMN IF NOT EXISTS last_modified	TEXT
+			"""
+		)
+		await self.bot.db.execute(
+			"""
+			CREATE TABLE IF NOT EXISTS rss.channels (
+				channel_id			BIGINT PRIMARY KEY, 
+				digest_threshold	INT
+			)
+			"""
+		)
+		await self.bot.db.execute(
+			"""
+			CREATE TABLE IF NOT EXISTS rss.schedules (
+				feed				TEXT PRIMARY KEY, 
+				next_check			TIMESTAMPTZ, 
+				interval			INT, 
+				declared_interval	INT, 
+				publish_interval	INT, 
+				consecutive_errors	INT DEFAULT 0, 
+				quarantined_until	TIMESTAMPTZ
+			)
+			"""
+		)
 		await self.bot.db.execute(
 			"""
 			CREATE TABLE IF NOT EXISTS rss.entries (
@@ -106,23 +133,20 @@ class RSS(commands.Cog):
 		async with ctx.bot.aiohttp_session.get(url) as resp:
 			feed_text = await resp.text()
 		# TODO: Handle issues getting URL
-		partial = functools.partial(feedparser.parse, io.BytesIO(feed_text.encode("UTF-8")), 
-																	response_headers = {"Content-Location": url})
-		feed_info = await self.bot.loop.run_in_executor(None, partial)
-		# Still necessary to run in executor?
+		feed_metadata, entries, _ = await ctx.bot.process_pool.submit(parse_feed, feed_text, url, timeout = 30)
 		# TODO: Handle if feed already being followed elsewhere
 		ttl = None
-		if "ttl" in feed_info.feed:
-			ttl = int(feed_info.feed.ttl)
-		for entry in feed_info.entries:
-			await ctx.bot.db.execute(
-				"""
-				INSERT INTO rss.entries (entry, feed)
-				VALUES ($1, $2)
-				ON CONFLICT (entry, feed) DO NOTHING
-				""", 
-				entry.id, url
-			)
+		if "ttl" in feed_metadata:
+			ttl = int(feed_metadata.ttl)
+		await ctx.bot.db.execute(
+			"""
+			INSERT INTO rss.entries (entry, feed)
+			SELECT entry, $2
+			FROM UNNEST($1::TEXT[]) AS entry
+			ON CONFLICT (entry, feed) DO NOTHING
+			""", 
+			[entry.id for entry in entries if "id" in entry], url
+		)
 		await ctx.bot.db.execute(
 			"""
 			INSERT INTO rss.feeds (channel_id, feed, last_checked, ttl)
@@ -157,169 +181,203 @@ class RSS(commands.Cog):
 		await ctx.embed_reply('\n'.join(record["feed"] for record in records), 
 								title = "RSS feeds being followed in this channel")
 	
-	# R/PT60S
-	@tasks.loop(seconds = 60)
+	@rss.command()
+	@commands.check_any(checks.is_permitted(), checks.is_guild_owner())
+	async def digest(self, ctx, threshold: Optional[int]):
+		'''
+		Collapse bursts of new feed entries into a single message in this channel
+		New entries are sent as a digest when a feed has at least threshold of them at once
+		Use 0 to disable
+		'''
+		if threshold is None:
+			threshold = await ctx.bot.db.fetchval("SELECT digest_threshold FROM rss.channels WHERE channel_id = $1", 
+													ctx.channel.id)
+			if not threshold:
+				return await ctx.embed_reply("Digests are disabled in this channel")
+			return await ctx.embed_reply(f"Digests are sent in this channel for {threshold} or more new entries")
+		await ctx.bot.db.execute(
+			"""
+			INSERT INTO rss.channels (channel_id, digest_threshold)
+			VALUES ($1, $2)
+			ON CONFLICT (channel_id) DO
+			UPDATE SET digest_threshold = $2
+			""", 
+			ctx.channel.id, threshold if threshold > 0 else None
+		)
+		if threshold > 0:
+			await ctx.embed_reply(f"Digests will be sent in this channel for {threshold} or more new entries")
+		else:
+			await ctx.embed_reply("Digests have been disabled in this channel")
+	
+	# R/PT0S
+	@tasks.loop()
 	async def check_feeds(self):
 		records = await self.bot.db.fetch(
 			"""
-			SELECT DISTINCT ON (feed) feed, last_checked, ttl
+			SELECT DISTINCT ON (feeds.feed) feeds.feed, etag, last_modified, 
+				next_check, interval, declared_interval, publish_interval, consecutive_errors
 			FROM rss.feeds
-			ORDER BY feed, last_checked
+			LEFT JOIN rss.schedules ON schedules.feed = feeds.feed
+			ORDER BY feeds.feed, last_checked
 			"""
 		)
 		if not records:
 			self.new_feed.clear()
-			await self.new_feed.wait()
-		for record in records:
-			feed = record["feed"]
-			if record["ttl"] and datetime.datetime.now(datetime.timezone.utc) < record["last_checked"] + datetime.timedelta(minutes = record["ttl"]):
-				continue
-			try:
-				async with self.bot.aiohttp_session.get(feed) as resp:
-					feed_text = await resp.text()
-				feed_info = await self.bot.loop.run_in_executor(None, functools.partial(feedparser.parse, io.BytesIO(feed_text.encode("UTF-8")), response_headers = {"Content-Location": feed}))
-				# Still necessary to run in executor?
-				ttl = None
-				if "ttl" in feed_info.feed:
-					ttl = int(feed_info.feed.ttl)
+			return await self.new_feed.wait()
+		now = datetime.datetime.now(datetime.timezone.utc)
+		# Fetch concurrently, limited by FeedFetcher
+		await asyncio.gather(*(self.check_feed(record) for record in records 
+								if not record["next_check"] or record["next_check"] <= now))
+		# Wait until the next feed is due or a feed is added
+		next_check = await self.bot.db.fetchval(
+			"""
+			SELECT MIN(next_check)
+			FROM rss.schedules
+			WHERE feed IN (SELECT feed FROM rss.feeds)
+			"""
+		)
+		timeout = self.scheduler.min_interval
+		if next_check:
+			timeout = (next_check - datetime.datetime.now(datetime.timezone.utc)).total_seconds()
+		self.new_feed.clear()
+		try:
+			await asyncio.wait_for(self.new_feed.wait(), timeout = max(timeout, 1))
+		except asyncio.TimeoutError:
+			pass
+	
+	async def schedule_check(self, record, *, declared_interval = None, publish_interval = None):
+		interval = self.scheduler.get_interval(declared_interval, publish_interval)
+		await self.bot.db.execute(
+			"""
+			INSERT INTO rss.schedules (feed, next_check, interval, declared_interval, publish_interval, 
+										consecutive_errors, quarantined_until)
+			VALUES ($1, $2, $3, $4, $5, 0, NULL)
+			ON CONFLICT (feed) DO
+			UPDATE SET next_check = EXCLUDED.next_check, 
+				interval = EXCLUDED.interval, 
+				declared_interval = EXCLUDED.declared_interval, 
+				publish_interval = EXCLUDED.publish_interval, 
+				consecutive_errors = 0, 
+				quarantined_until = NULL
+			""", 
+			record["feed"], self.scheduler.get_next_check(interval), interval, 
+			declared_interval, publish_interval
+		)
+	
+	async def schedule_retry(self, record):
+		consecutive_errors = (record["consecutive_errors"] or 0) + 1
+		next_check = self.scheduler.get_next_check(
+			self.scheduler.get_backoff(record["interval"], consecutive_errors)
+		)
+		quarantined_until = None
+		if self.scheduler.is_quarantined(consecutive_errors):
+			next_check = quarantined_until = self.scheduler.get_next_check(self.scheduler.quarantine_duration)
+			if consecutive_errors == self.scheduler.quarantine_threshold:
+				self.bot.print(f"RSS feed quarantined after {consecutive_errors} consecutive errors: {record['feed']}")
+		await self.bot.db.execute(
+			"""
+			INSERT INTO rss.schedules (feed, next_check, consecutive_errors, quarantined_until)
+			VALUES ($1, $2, $3, $4)
+			ON CONFLICT (feed) DO
+			UPDATE SET next_check = EXCLUDED.next_check, 
+				consecutive_errors = EXCLUDED.consecutive_errors, 
+				quarantined_until = EXCLUDED.quarantined_until
+			""", 
+			record["feed"], next_check, consecutive_errors, quarantined_until
+		)
+	
+	async def record_error(self, record, error_type, message):
+		await self.bot.db.execute(
+			"""
+			INSERT INTO rss.errors (feed, type, message)
+			VALUES ($1, $2, $3)
+			""", 
+			record["feed"], error_type, message
+		)
+		await self.schedule_retry(record)
+	
+	async def check_feed(self, record):
+		feed = record["feed"]
+		try:
+			response = await self.fetcher.fetch(feed, etag = record["etag"], 
+													last_modified = record["last_modified"])
+			if response.not_modified:
 				await self.bot.db.execute(
 					"""
 					UPDATE rss.feeds
-					SET last_checked = NOW(), 
-						ttl = $1
-					WHERE feed = $2
+					SET last_checked = NOW()
+					WHERE feed = $1
 					""", 
-					ttl, feed
+					feed
 				)
-				for entry in feed_info.entries:
-					if "id" not in entry:
-						continue
-					inserted = await self.bot.db.fetchrow(
-						"""
-						INSERT INTO rss.entries (entry, feed)
-						VALUES ($1, $2)
-						ON CONFLICT DO NOTHING
-						RETURNING *
-						""", 
-						entry.id, feed
-					)
-					if not inserted:
-						continue
-					# Get timestamp
-					## if "published_parsed" in entry:
-					##  timestamp = datetime.datetime.fromtimestamp(time.mktime(entry.published_parsed))
-					### inaccurate
-					if "published" in entry and entry.published:
-						timestamp = dateutil.parser.parse(entry.published, tzinfos = self.tzinfos)
-					elif "updated" in entry:  # and entry.updated necessary?; check updated first?
-						timestamp = dateutil.parser.parse(entry.updated, tzinfos = self.tzinfos)
-					else:
-						timestamp = discord.Embed.Empty
-					# Get and set description, title, url + set timestamp
-					if not (description := entry.get("summary")) and "content" in entry:
-						description = entry["content"][0].get("value")
-					if description:
-						description = BeautifulSoup(description, "lxml").get_text(separator = '\n')
-						description = re.sub(r"\n\s*\n", '\n', description)
-						if len(description) > self.bot.EMBED_DESCRIPTION_CHARACTER_LIMIT:
-							space_index = description.rfind(' ', 0, self.bot.EDCL - 3)
-							# EDCL: Embed Description Character Limit
-							description = description[:space_index] + "..."
-					title = textwrap.shorten(entry.get("title"), width = self.bot.ETiCL, placeholder = "...")
-					# ETiCL: Embed Title Character Limit
-					embed = discord.Embed(title = html.unescape(title), 
-											url = entry.link, 
-											description = description, 
-											timestamp = timestamp, 
-											color = self.bot.rss_color)
-					# Get and set thumbnail url
-					thumbnail_url = (
-						(media_thumbnail := entry.get("media_thumbnail")) and media_thumbnail[0].get("url") or 
-						(
-							(media_content := entry.get("media_content")) and 
-							(media_image := discord.utils.find(lambda c: "image" in c.get("medium", ""), media_content)) and 
-							media_image.get("url")
-						) or 
-						(
-							(links := entry.get("links")) and 
-							(image_link := discord.utils.find(lambda l: "image" in l.get("type", ""), links)) and 
-							image_link.get("href")
-						 ) or 
-						(
-							(content := entry.get("content")) and (content_value := content[0].get("value")) and 
-							(content_img := getattr(BeautifulSoup(content_value, "lxml"), "img")) and 
-							content_img.get("src")
-						) or 
-						(
-							(media_content := entry.get("media_content")) and 
-							(media_content := discord.utils.find(lambda c: "url" in c, media_content)) and 
-							media_content["url"]
-						) or 
-						(
-							(description := entry.get("description")) and 
-							(description_img := getattr(BeautifulSoup(description, "lxml"), "img")) and 
-							description_img.get("src")
-						)
-					)
-					if thumbnail_url:
-						if not urllib.parse.urlparse(thumbnail_url).netloc:
-							thumbnail_url = feed_info.feed.link + thumbnail_url
-						embed.set_thumbnail(url = thumbnail_url)
-					# Get and set footer icon url
-					footer_icon_url = (
-						feed_info.feed.get("icon") or feed_info.feed.get("logo") or 
-						(feed_image := feed_info.feed.get("image")) and feed_image.get("href") or 
-						(parsed_image := BeautifulSoup(feed_text, "lxml").image) and next(iter(parsed_image.attrs.values()), None) or 
-						discord.Embed.Empty
-					)
-					embed.set_footer(text = feed_info.feed.title, icon_url = footer_icon_url)
-					# Send embed(s)
-					channel_records = await self.bot.db.fetch("SELECT channel_id FROM rss.feeds WHERE feed = $1", feed)
-					for record in channel_records:
-						if text_channel := self.bot.get_channel(record["channel_id"]):
-							try:
-								await text_channel.send(embed = embed)
-							except discord.Forbidden:
-								pass
-							except discord.HTTPException as e:
-								if e.status == 400 and e.code == 50035:
-									if "In embed.url: Not a well formed URL." in e.text:
-										embed.url = discord.Embed.Empty
-									if ("In embed.thumbnail.url: Not a well formed URL." in e.text or 
-										("In embed.thumbnail.url: Scheme" in e.text and 
-											"is not supported. Scheme must be one of ('http', 'https')." in e.text)):
-										embed.set_thumbnail(url = "")
-									if ("In embed.footer.icon_url: Not a well formed URL." in e.text or 
-										("In embed.footer.icon_url: Scheme" in e.text and 
-											"is not supported. Scheme must be one of ('http', 'https')." in e.text)):
-										embed.set_footer(text = feed_info.feed.title)
-									await text_channel.send(embed = embed)
-								else:
-									raise
-						# TODO: Remove text channel data if now non-existent
-			except (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError, 
-					aiohttp.TooManyRedirects, asyncio.TimeoutError, 
-					UnicodeDecodeError) as e:
-				await self.bot.db.execute(
-					"""
-					INSERT INTO rss.errors (feed, type, message)
-					VALUES ($1, $2, $3)
-					""", 
-					feed, type(e).__name__, str(e)
-				)
-				# Print error?
-				await asyncio.sleep(10)
-				# TODO: Add variable for sleep time
-				# TODO: Remove persistently erroring feed or exponentially backoff?
-			except discord.DiscordServerError as e:
-				self.bot.print(f"RSS Task Discord Server Error: {e}")
-				await asyncio.sleep(60)
-			except Exception as e:
-				print("Exception in RSS Task", file = sys.stderr)
-				traceback.print_exception(type(e), e, e.__traceback__, file = sys.stderr)
-				errors_logger.error("Uncaught RSS Task exception\n", exc_info = (type(e), e, e.__traceback__))
-				print(f" (feed: {feed})")
-				await asyncio.sleep(60)
+				await self.schedule_check(record, declared_interval = record["declared_interval"], 
+											publish_interval = record["publish_interval"])
+				return
+			if response.status >= 400:
+				return await self.record_error(record, "HTTPError", f"{response.status}")
+			# Parse off the event loop, with feed metadata parsed once per fetch
+			feed_metadata, entries, footer_icon_url = await self.bot.process_pool.submit(
+				parse_feed, response.text, feed, timeout = 30
+			)
+			ttl = None
+			if "ttl" in feed_metadata:
+				ttl = int(feed_metadata.ttl)
+			await self.bot.db.execute(
+				"""
+				UPDATE rss.feeds
+				SET last_checked = NOW(), 
+					ttl = $1, 
+					etag = $2, 
+					last_modified = $3
+				WHERE feed = $4
+				""", 
+				ttl, response.etag, response.last_modified, feed
+			)
+			await self.schedule_check(
+				record, declared_interval = self.scheduler.get_declared_interval(feed_metadata), 
+				publish_interval = self.scheduler.get_publish_interval(entries, 
+																		record["publish_interval"])
+			)
+			# Deduplicate entries in a single statement
+			entries_by_id = {}
+			for entry in entries:
+				if "id" in entry:
+					entries_by_id.setdefault(entry.id, entry)
+			inserted = await self.bot.db.fetch(
+				"""
+				INSERT INTO rss.entries (entry, feed)
+				SELECT entry, $2
+				FROM UNNEST($1::TEXT[]) AS entry
+				ON CONFLICT DO NOTHING
+				RETURNING entry
+				""", 
+				list(entries_by_id), feed
+			)
+			if not inserted:
+				return
+			new_entries = {record["entry"] for record in inserted}
+			# Sanitize and build embeds off the event loop
+			payloads = await self.bot.process_pool.submit(
+				render_entries, [entry for entry_id, entry in entries_by_id.items() if entry_id in new_entries], 
+				feed_metadata, footer_icon_url, color = self.bot.rss_color, 
+				title_limit = self.bot.ETiCL, description_limit = self.bot.EDCL, timeout = 30
+			)
+			embeds = [discord.Embed.from_dict(payload) for payload in payloads]
+			await self.dispatcher.dispatch(feed, embeds, feed_metadata.title)
+		except (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError, 
+				aiohttp.TooManyRedirects, asyncio.TimeoutError, 
+				UnicodeDecodeError) as e:
+			# Print error?
+			await self.record_error(record, type(e).__name__, str(e))
+		except discord.DiscordServerError as e:
+			self.bot.print(f"RSS Task Discord Server Error: {e}")
+			await self.schedule_retry(record)
+		except Exception as e:
+			print("Exception in RSS Task", file = sys.stderr)
+			traceback.print_exception(type(e), e, e.__traceback__, file = sys.stderr)
+			errors_logger.error("Uncaught RSS Task exception\n", exc_info = (type(e), e, e.__traceback__))
+			print(f" (feed: {feed})")
+			await self.schedule_retry(record)
 	
 	@check_feeds.before_loop
 	async def before_check_feeds(self):
@@ -330,3 +388,280 @@ class RSS(commands.Cog):
 	async def after_check_feeds(self):
 		self.bot.print("RSS task cancelled")
 
+class FeedResponse:
+	
+	def __init__(self, status, text = None, etag = None, last_modified = None):
+		self.status = status
+		self.text = text
+		self.etag = etag
+		self.last_modified = last_modified
+	
+	@property
+	def not_modified(self):
+		return self.status == 304
+
+class FeedFetcher:
+	
+	'''
+	Fetches feeds with conditional GET requests
+	Concurrency is bounded globally and per host, and each request has its own timeout
+	'''
+	
+	def __init__(self, bot, *, max_concurrency = 20, max_concurrency_per_host = 2, timeout = 30):
+		self.bot = bot
+		self.semaphore = asyncio.Semaphore(max_concurrency)
+		self.max_concurrency_per_host = max_concurrency_per_host
+		self.host_semaphores = {}
+		self.timeout = aiohttp.ClientTimeout(total = timeout)
+	
+	async def fetch(self, url, *, etag = None, last_modified = None):
+		headers = {}
+		if etag:
+			headers["If-None-Match"] = etag
+		if last_modified:
+			headers["If-Modified-Since"] = last_modified
+		host = urllib.parse.urlparse(url).netloc
+		host_semaphore = self.host_semaphores.setdefault(host, asyncio.Semaphore(self.max_concurrency_per_host))
+		async with self.semaphore, host_semaphore:
+			async with self.bot.aiohttp_session.get(url, headers = headers, timeout = self.timeout) as resp:
+				if resp.status == 304:
+					return FeedResponse(304, etag = etag, last_modified = last_modified)
+				text = await resp.text()
+				return FeedResponse(resp.status, text, 
+									etag = resp.headers.get("ETag"), 
+									last_modified = resp.headers.get("Last-Modified"))
+
+class FeedScheduler:
+	
+	'''
+	Computes when feeds are next due to be checked
+	Checks are scheduled from the feed's declared TTL or sy:updatePeriod and its observed publish interval
+	Failed checks back off exponentially with jitter, and feeds are quarantined after repeated errors
+	Intervals are in seconds
+	'''
+	
+	update_periods = {"hourly": 3600, "daily": 86400, "weekly": 604800, "monthly": 2592000, "yearly": 31536000}
+	
+	def __init__(self, *, min_interval = 60, default_interval = 600, max_interval = 21600, 
+					max_backoff = 21600, quarantine_threshold = 10, quarantine_duration = 86400):
+		self.min_interval = min_interval
+		self.default_interval = default_interval
+		self.max_interval = max_interval
+		self.max_backoff = max_backoff
+		self.quarantine_threshold = quarantine_threshold
+		self.quarantine_duration = quarantine_duration
+	
+	def get_declared_interval(self, feed):
+		try:
+			if "ttl" in feed:
+				return int(feed.ttl) * 60
+			if period := self.update_periods.get(feed.get("sy_updateperiod", "").strip().lower()):
+				return period // max(int(feed.get("sy_updatefrequency") or 1), 1)
+		except ValueError:
+			pass
+	
+	@staticmethod
+	def get_publish_interval(entries, previous = None):
+		'''Median interval between entries, smoothed with the previously observed interval'''
+		timestamps = sorted(calendar.timegm(timestamp) for entry in entries 
+							if (timestamp := entry.get("published_parsed") or entry.get("updated_parsed")))
+		if not (intervals := [later - earlier for earlier, later in zip(timestamps, timestamps[1:]) 
+								if later > earlier]):
+			return previous
+		observed = statistics.median(intervals)
+		if previous:
+			observed = (observed + previous) / 2
+		return int(observed)
+	
+	def get_interval(self, declared_interval = None, publish_interval = None):
+		# Check about twice per publish interval
+		interval = publish_interval / 2 if publish_interval else self.default_interval
+		interval = min(max(interval, self.min_interval), self.max_interval)
+		# Feeds shouldn't be checked more often than they declare
+		if declared_interval:
+			interval = max(interval, declared_interval)
+		return int(interval)
+	
+	def get_backoff(self, interval, consecutive_errors):
+		backoff = min((interval or self.default_interval) * 2 ** (consecutive_errors - 1), self.max_backoff)
+		# Jitter spreads out retries of feeds that failed together
+		return random.uniform(backoff / 2, backoff)
+	
+	def is_quarantined(self, consecutive_errors):
+		return consecutive_errors >= self.quarantine_threshold
+	
+	@staticmethod
+	def get_next_check(interval):
+		return datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds = interval)
+
+class FeedDispatcher:
+	
+	'''
+	Sends new feed entries to the channels following the feed
+	Channels are sent to concurrently, with each channel's entries sent in order
+	Channels with a digest threshold receive a single digest for bursts of new entries
+	'''
+	
+	def __init__(self, bot, *, max_concurrency = 10):
+		self.bot = bot
+		# discord.py handles rate limits per route; this bounds requests in flight
+		self.semaphore = asyncio.Semaphore(max_concurrency)
+	
+	async def dispatch(self, feed, embeds, feed_title):
+		records = await self.bot.db.fetch(
+			"""
+			SELECT feeds.channel_id, channels.digest_threshold
+			FROM rss.feeds
+			LEFT JOIN rss.channels ON channels.channel_id = feeds.channel_id
+			WHERE feed = $1
+			""", 
+			feed
+		)
+		tasks = []
+		for record in records:
+			if not (text_channel := self.bot.get_channel(record["channel_id"])):
+				# TODO: Remove text channel data if now non-existent
+				continue
+			if record["digest_threshold"] and len(embeds) >= record["digest_threshold"]:
+				channel_embeds = [self.build_digest_embed(embeds, feed_title)]
+			else:
+				channel_embeds = embeds
+			tasks.append(self.send_to_channel(text_channel, channel_embeds, feed_title))
+		# Raise the first error after every channel has been sent to
+		for result in await asyncio.gather(*tasks, return_exceptions = True):
+			if isinstance(result, BaseException):
+				raise result
+	
+	async def send_to_channel(self, text_channel, embeds, feed_title):
+		for embed in embeds:
+			async with self.semaphore:
+				try:
+					await text_channel.send(embed = embed)
+				except discord.Forbidden:
+					return
+				except discord.HTTPException as e:
+					if e.status == 400 and e.code == 50035:
+						embed = embed.copy()
+						if "In embed.url: Not a well formed URL." in e.text:
+							embed.url = discord.Embed.Empty
+						if ("In embed.thumbnail.url: Not a well formed URL." in e.text or 
+							("In embed.thumbnail.url: Scheme" in e.text and 
+								"is not supported. Scheme must be one of ('http', 'https')." in e.text)):
+							embed.set_thumbnail(url = "")
+						if ("In embed.footer.icon_url: Not a well formed URL." in e.text or 
+							("In embed.footer.icon_url: Scheme" in e.text and 
+								"is not supported. Scheme must be one of ('http', 'https')." in e.text)):
+							embed.set_footer(text = feed_title)
+						await text_channel.send(embed = embed)
+					else:
+						raise
+	
+	def build_digest_embed(self, embeds, feed_title):
+		lines = []
+		length = 0
+		for index, embed in enumerate(embeds):
+			line = f"[{embed.title}]({embed.url})" if embed.url else embed.title
+			if length + len(line) + 1 > self.bot.EDCL - 20:
+				lines.append(f"and {len(embeds) - index} more")
+				break
+			lines.append(line)
+			length += len(line) + 1
+		# Feeds generally list newest entries first
+		digest = discord.Embed(title = f"{len(embeds)} new entries", description = '\n'.join(lines), 
+								timestamp = embeds[0].timestamp, color = self.bot.rss_color)
+		digest.set_footer(text = feed_title, icon_url = embeds[0].footer.icon_url)
+		return digest
+
+@functools.lru_cache(maxsize = None)
+def get_tzinfos():
+	'''Timezone abbreviations with unambiguous UTC offsets'''
+	tzinfos = {}
+	for timezone_abbreviation in ("EDT", "EST"):
+		matching_timezones = list(filter(lambda t: datetime.datetime.now(pytz.timezone(t)).strftime("%Z") == timezone_abbreviation, pytz.common_timezones))
+		matching_utc_offsets = set(datetime.datetime.now(pytz.timezone(t)).strftime("%z") for t in matching_timezones)
+		if len(matching_utc_offsets) == 1:
+			tzinfos[timezone_abbreviation] = dateutil.tz.gettz(matching_timezones[0])
+	return tzinfos
+
+def parse_feed(feed_text, url):
+	'''
+	Parse feed, for running in a worker process
+	Returns feed metadata, entries, and footer icon url
+	'''
+	feed_info = feedparser.parse(io.BytesIO(feed_text.encode("UTF-8")), response_headers = {"Content-Location": url})
+	# Get footer icon url
+	footer_icon_url = (
+		feed_info.feed.get("icon") or feed_info.feed.get("logo") or 
+		(feed_image := feed_info.feed.get("image")) and feed_image.get("href") or 
+		(parsed_image := BeautifulSoup(feed_text, "lxml").image) and next(iter(parsed_image.attrs.values()), None)
+	)
+	return feed_info.feed, feed_info.entries, footer_icon_url
+
+def render_entries(entries, feed, footer_icon_url, *, color, title_limit, description_limit):
+	'''Build embed payloads for feed entries, for running in a worker process'''
+	return [render_entry(entry, feed, footer_icon_url, color = color, title_limit = title_limit, 
+							description_limit = description_limit).to_dict() 
+			for entry in entries]
+
+def render_entry(entry, feed, footer_icon_url, *, color, title_limit, description_limit):
+	# Get timestamp
+	## if "published_parsed" in entry:
+	##  timestamp = datetime.datetime.fromtimestamp(time.mktime(entry.published_parsed))
+	### inaccurate
+	if "published" in entry and entry.published:
+		timestamp = dateutil.parser.parse(entry.published, tzinfos = get_tzinfos())
+	elif "updated" in entry:  # and entry.updated necessary?; check updated first?
+		timestamp = dateutil.parser.parse(entry.updated, tzinfos = get_tzinfos())
+	else:
+		timestamp = discord.Embed.Empty
+	# Get and set description, title, url + set timestamp
+	if not (description := entry.get("summary")) and "content" in entry:
+		description = entry["content"][0].get("value")
+	if description:
+		description = BeautifulSoup(description, "lxml").get_text(separator = '\n')
+		description = re.sub(r"\n\s*\n", '\n', description)
+		if len(description) > description_limit:
+			space_index = description.rfind(' ', 0, description_limit - 3)
+			description = description[:space_index] + "..."
+	title = textwrap.shorten(entry.get("title"), width = title_limit, placeholder = "...")
+	embed = discord.Embed(title = html.unescape(title), 
+							url = entry.link, 
+							description = description, 
+							timestamp = timestamp, 
+							color = color)
+	# Get and set thumbnail url
+	thumbnail_url = (
+		(media_thumbnail := entry.get("media_thumbnail")) and media_thumbnail[0].get("url") or 
+		(
+			(media_content := entry.get("media_content")) and 
+			(media_image := discord.utils.find(lambda c: "image" in c.get("medium", ""), media_content)) and 
+			media_image.get("url")
+		) or 
+		(
+			(links := entry.get("links")) and 
+			(image_link := discord.utils.find(lambda l: "image" in l.get("type", ""), links)) and 
+			image_link.get("href")
+		 ) or 
+		(
+			(content := entry.get("content")) and (content_value := content[0].get("value")) and 
+			(content_img := getattr(BeautifulSoup(content_value, "lxml"), "img")) and 
+			content_img.get("src")
+		) or 
+		(
+			(media_content := entry.get("media_content")) and 
+			(media_content := discord.utils.find(lambda c: "url" in c, media_content)) and 
+			media_content["url"]
+		) or 
+		(
+			(description := entry.get("description")) and 
+			(description_img := getattr(BeautifulSoup(description, "lxml"), "img")) and 
+			description_img.get("src")
+		)
+	)
+	if thumbnail_url:
+		if not urllib.parse.urlparse(thumbnail_url).netloc:
+			thumbnail_url = feed.link + thumbnail_url
+		embed.set_thumbnail(url = thumbnail_url)
+	embed.set_footer(text = feed.title, icon_url = footer_icon_url or discord.Embed.Empty)
+	return embed
+
@@ -2,29 +2,50 @@
 import discord
 from discord.ext import commands
 
-import difflib
+import asyncio
+import hashlib
 import io
 import re
+import statistics
+import sys
 import textwrap
+import time
 
 import imageio
-import matplotlib
-import numexpr
-import numpy
-import pandas
 from PIL import Image, ImageDraw, ImageFont
 import seaborn
 
 from utilities import checks
+from utilities.cache import TTLCache
 from utilities.paginator import Paginator
 
+sys.path.insert(0, "..")
+from units.arithmetic import evaluate, UnitOutputError
+from units.graphing import normalize_graph, parse_jointplot_arguments, render_graph, UnitExecutionError
+sys.path.pop(0)
+
 def setup(bot):
 	bot.add_cog(Tools(bot))
 
+class GraphLimit(commands.Converter):
+	async def convert(self, ctx, argument):
+		try:
+			limit = await ctx.bot.process_pool.submit(evaluate_expression, argument)
+		except (UnitExecutionError, UnitOutputError) as e:
+			raise commands.BadArgument(f"Invalid limit: {e}")
+		except asyncio.TimeoutError:
+			raise commands.BadArgument("Invalid limit: Evaluation exceeded time limit")
+		if not isinstance(limit, (int, float)) or not -1e15 < limit < 1e15:
+			raise commands.BadArgument(f"Invalid limit: {argument}")
+		return float(limit)
+
 class Tools(commands.Cog):
 	
 	def __init__(self, bot):
 		self.bot = bot
+		self.tag_lookup = TagLookup(self.bot.db)
+		# Graph PNGs, by normalized expressions and limits
+		self.graph_cache = TTLCache(max_size = 256)
 		self.bot.loop.create_task(self.initialize_database(), name = "Initialize database")
 	
 	async def initialize_database(self):
@@ -51,51 +72,83 @@ class Tools(commands.Cog):
 			)
 			"""
 		)
+		await self.bot.db.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+		await self.bot.db.execute(
+			"""
+			CREATE INDEX IF NOT EXISTS global_tag_trgm_index
+			ON tags.global USING GIN (tag gin_trgm_ops)
+			"""
+		)
+		await self.bot.db.execute(
+			"""
+			CREATE INDEX IF NOT EXISTS individual_tag_trgm_index
+			ON tags.individual USING GIN (tag gin_trgm_ops)
+			"""
+		)
 	
 	@commands.group(aliases = ["plot"], invoke_without_command = True, case_insensitive = True)
 	@checks.not_forbidden()
-	async def graph(self, ctx, lower_limit : int, upper_limit : int, *, equation : str):
-		'''WIP'''
-		try:
-			equation = self.string_to_equation(equation)
-		except SyntaxError as e:
-			return await ctx.embed_reply(f":no_entry: Error: {e}")
-		x = numpy.linspace(lower_limit, upper_limit, 250)
-		try:
-			y = numexpr.evaluate(equation)
-		except Exception as e:
-			return await ctx.reply(ctx.bot.PY_CODE_BLOCK.format(f"{type(e).__name__}: {e}"))
-		figure = matplotlib.figure.Figure()
-		axes = figure.add_subplot()
+	async def graph(self, ctx, lower_limit : GraphLimit, upper_limit : GraphLimit, *, equations : str):
+		'''
+		Graph equations of x
+		Separate multiple equations with ;
+		Limits can be expressions, e.g. -2*pi
+		'''
+		await self.send_graph(ctx, "cartesian", lower_limit, upper_limit, equations)
+	
+	@graph.command(name = "parametric")
+	async def graph_parametric(self, ctx, lower_limit : GraphLimit, upper_limit : GraphLimit, *, equations : str):
+		'''
+		Graph parametric equations of t
+		Each equation is a pair of x and y expressions, e.g. cos(t), sin(t)
+		Separate multiple equations with ;
+		'''
+		await self.send_graph(ctx, "parametric", lower_limit, upper_limit, equations)
+	
+	@graph.command(name = "polar")
+	async def graph_polar(self, ctx, lower_limit : GraphLimit, upper_limit : GraphLimit, *, equations : str):
+		'''
+		Graph polar equations of theta
+		Separate multiple equations with ;
+		'''
+		await self.send_graph(ctx, "polar", lower_limit, upper_limit, equations)
+	
+	async def send_graph(self, ctx, mode, lower_limit, upper_limit, equations):
+		expressions = [expression.strip() for expression in equations.strip('`').split(';') if expression.strip()]
 		try:
-			axes.plot(x, y)
-		except ValueError as e:
+			key = (normalize_graph(mode, expressions), lower_limit, upper_limit)
+		except UnitExecutionError as e:
 			return await ctx.embed_reply(f":no_entry: Error: {e}")
-		buffer = io.BytesIO()
-		figure.savefig(buffer, format = "PNG")
-		buffer.seek(0)
+		if not (graph := self.graph_cache.get(key)):
+			try:
+				graph = await ctx.bot.process_pool.submit(plot_graph, mode, expressions, lower_limit, upper_limit)
+			except UnitExecutionError as e:
+				return await ctx.embed_reply(f":no_entry: Error: {e}")
+			except asyncio.TimeoutError:
+				return await ctx.embed_reply(":no_entry: Graphing exceeded time limit")
+			self.graph_cache[key] = graph
 		await ctx.embed_reply(image_url = "attachment://graph.png", 
-								file = discord.File(buffer, filename = "graph.png"))
-	
-	def string_to_equation(self, string):
-		replacements = {'^': "**"}
-		allowed_words = ('x', "sin", "cos", "tan", "arcsin", "arccos", "arctan", "arctan2", "sinh", "cosh", "tanh", "arcsinh", "arccosh", "arctanh", "log", "log10", "log1p", "exp", "expm1", "sqrt", "abs", "conj", "complex")
-		for word in re.findall("[a-zA-Z_]+", string):
-			if word not in allowed_words:
-				raise SyntaxError("`{}` is not supported".format(word))
-		for old, new in replacements.items():
-			string = string.replace(old, new)
-		return string
+								file = discord.File(io.BytesIO(graph), filename = "graph.png"))
 	
 	@graph.command(name = "alternative", aliases = ["alt", "complex"])
 	@commands.is_owner()
-	async def graph_alternative(self, ctx, *, data : str):
-		'''WIP'''
-		buffer = io.BytesIO()
-		seaborn.jointplot(**eval(data)).savefig(buffer, format = "PNG")
-		buffer.seek(0)
+	async def graph_alternative(self, ctx, *, arguments : str):
+		'''
+		Joint plot
+		Arguments are key=value pairs, e.g. x=1,2,3 y=4,5,6 kind=hex
+		x and y are comma-separated numbers
+		kind is scatter, kde, hist, hex, reg, or resid
+		height is a number and color is a color name or hex code
+		'''
+		try:
+			arguments = parse_jointplot_arguments(arguments)
+			graph = await ctx.bot.process_pool.submit(plot_jointplot, arguments)
+		except UnitExecutionError as e:
+			return await ctx.embed_reply(f":no_entry: Error: {e}")
+		except asyncio.TimeoutError:
+			return await ctx.embed_reply(":no_entry: Graphing exceeded time limit")
 		await ctx.embed_reply(image_url = "attachment://graph.png", 
-								file = discord.File(buffer, filename = "graph.png"))
+								file = discord.File(io.BytesIO(graph), filename = "graph.png"))
 	
 	@commands.command(aliases = ["spoil"], hidden = True)
 	@checks.not_forbidden()
@@ -174,44 +227,10 @@ class Tools(commands.Cog):
 		if not tag:
 			await ctx.embed_reply("Add a tag with `{0}tag add [tag] [content]`\nUse `{0}tag [tag]` to trigger the tag you added\n`{0}tag edit [tag] [content]` to edit it and `{0}tag delete [tag]` to delete it".format(ctx.prefix))
 			return
-		content = await ctx.bot.db.fetchval(
-			"""
-			SELECT content FROM tags.individual
-			WHERE user_id = $1 AND tag = $2
-			""", 
-			ctx.author.id, tag
-		)
+		content = await self.tag_lookup.get(ctx.author.id, tag)
 		if content:
 			return await ctx.reply(content)
-		content = await ctx.bot.db.fetchval(
-			"""
-			SELECT content FROM tags.global
-			WHERE tag = $1
-			""", 
-			tag
-		)
-		if content:
-			await ctx.reply(content)
-			await ctx.bot.db.execute(
-				"""
-				UPDATE tags.global SET uses = uses + 1
-				WHERE tag = $1
-				""", 
-				tag
-			)
-			# TODO: Optimize into single query
-			return
-		individual_records = await ctx.bot.db.fetch(
-			"""
-			SELECT tag FROM tags.individual
-			WHERE user_id = $1
-			""", 
-			ctx.author.id
-		)
-		global_records = await ctx.bot.db.fetch("SELECT tag FROM tags.global")
-		# TODO Optimize into single query?
-		tags = [record["tag"] for record in individual_records] + [record["tag"] for record in global_records]
-		close_matches = difflib.get_close_matches(tag, tags)
+		close_matches = await self.tag_lookup.suggest(ctx.author.id, tag)
 		close_matches = "\nDid you mean:\n{}".format('\n'.join(close_matches)) if close_matches else ""
 		await ctx.embed_reply("Tag not found{}".format(close_matches))
 	
@@ -299,21 +318,63 @@ class Tools(commands.Cog):
 			return
 		await ctx.embed_reply(":ok_hand::skin-tone-2: {}'s tag has been deleted".format(owner.mention))
 	
+	@tag.command(name = "benchmark", hidden = True)
+	@commands.is_owner()
+	async def tag_benchmark(self, ctx, *counts: int):
+		'''
+		Benchmark tag lookups and suggestions as the number of global tags grows
+		Uses temporary copies of the tag tables, dropped afterwards
+		'''
+		counts = sorted(counts) or [1_000, 10_000, 100_000]
+		# Benchmark global tags are MD5 hashes of their numbers
+		tag = hashlib.md5(b"1").hexdigest()
+		misspelled_tag = tag[:-1] + ('0' if tag[-1] != '0' else '1')
+		benchmarks = (("get", (ctx.author.id, tag)), ("get (miss)", (ctx.author.id, "\N{NO ENTRY}")), 
+						("suggest", (ctx.author.id, misspelled_tag)))
+		lines = ["{:>10}".format("Tags") + "".join(f"{name:>14}" for name, _ in benchmarks)]
+		async with ctx.bot.database_connection_pool.acquire() as connection:
+			async with connection.transaction():
+				for table in ("global", "individual"):
+					await connection.execute(
+						f"""
+						CREATE TEMPORARY TABLE benchmark_{table}_tags (LIKE tags.{table} INCLUDING ALL)
+						ON COMMIT DROP
+						"""
+					)
+				tag_lookup = TagLookup(connection, global_table = "benchmark_global_tags", 
+										individual_table = "benchmark_individual_tags")
+				tag_count = 0
+				for count in counts:
+					await connection.execute(
+						"""
+						INSERT INTO benchmark_global_tags (tag, content, created_at, owner_id, uses)
+						SELECT MD5(number::TEXT), 'content', NOW(), $3, 0
+						FROM GENERATE_SERIES($1 + 1, $2) AS number
+						""", 
+						tag_count, count, ctx.author.id
+					)
+					tag_count = max(tag_count, count)
+					await connection.execute("ANALYZE benchmark_global_tags")
+					line = f"{tag_count:>10,}"
+					for name, args in benchmarks:
+						method = getattr(tag_lookup, name.split()[0])
+						durations = []
+						for _ in range(5):
+							start = time.perf_counter()
+							await method(*args)
+							durations.append(time.perf_counter() - start)
+						line += f"{statistics.median(durations) * 1000:>11.2f} ms"
+					lines.append(line)
+		await ctx.embed_reply(ctx.bot.CODE_BLOCK.format('\n'.join(lines)), 
+								title = "Tag query durations (median of 5)")
+	
 	@tag.command(name = "search", aliases = ["contains", "find"])
 	async def tag_search(self, ctx, *, search: str):
 		'''Search your tags'''
 		if (await self.check_no_tags(ctx)): return
-		records = await ctx.bot.db.fetch(
-			"""
-			SELECT tag FROM tags.individual
-			WHERE user_id = $1
-			""", 
-			ctx.author.id
-		)
-		tags = [record["tag"] for record in records]
-		if results := [tag for tag in tags if search in tag]:
+		if results := await self.tag_lookup.search(ctx.author.id, search):
 			return await ctx.embed_reply(f"{len(results)} tags found: {', '.join(results)}")
-		close_matches = difflib.get_close_matches(search, tags)
+		close_matches = await self.tag_lookup.suggest(ctx.author.id, search, include_global = False)
 		close_matches = "\nDid you mean:\n" + '\n'.join(close_matches) if close_matches else ""
 		await ctx.embed_reply(f"No tags found{close_matches}")
 	
@@ -448,15 +509,7 @@ class Tools(commands.Cog):
 			ctx.author.id, tag
 		)
 		if not exists:
-			records = await ctx.bot.db.fetch(
-				"""
-				SELECT tag FROM tags.individual
-				WHERE user_id = $1
-				""", 
-				ctx.author.id
-			)
-			tags = [record["tag"] for record in records]
-			close_matches = difflib.get_close_matches(tag, tags)
+			close_matches = await self.tag_lookup.suggest(ctx.author.id, tag, include_global = False)
 			close_matches = "\nDid you mean:\n{}".format('\n'.join(close_matches)) if close_matches else ""
 			await ctx.embed_reply("You don't have that tag{}".format(close_matches))
 		return not exists
@@ -471,3 +524,87 @@ class Tools(commands.Cog):
 		'''
 		await ctx.embed_reply("See https://imgur.com/vidgif")
 
+class TagLookup:
+	
+	'''
+	Tag lookups, suggestions, and searches, each in a single query
+	Similarity and substring matching use pg_trgm GIN indexes on tag
+	'''
+	
+	def __init__(self, database, *, global_table = "tags.global", individual_table = "tags.individual"):
+		self.database = database
+		self.global_table = global_table
+		self.individual_table = individual_table
+	
+	async def get(self, user_id, tag):
+		'''
+		Get the content of the user's tag or, if they don't have it, the global tag
+		Uses of the global tag are incremented in the same statement
+		'''
+		return await self.database.fetchval(
+			f"""
+			WITH individual_tag AS (
+				SELECT content FROM {self.individual_table}
+				WHERE user_id = $1 AND tag = $2
+			), global_tag AS (
+				UPDATE {self.global_table} SET uses = uses + 1
+				WHERE tag = $2 AND NOT EXISTS (SELECT FROM individual_tag)
+				RETURNING content
+			)
+			SELECT content FROM individual_tag
+			UNION ALL
+			SELECT content FROM global_tag
+			""", 
+			user_id, tag
+		)
+	
+	async def suggest(self, user_id, tag, *, include_global = True, limit = 3):
+		'''Get the user's tags, and global tags, most similar to tag'''
+		global_matches = f"""
+			UNION
+			SELECT tag, similarity(tag, $2) FROM {self.global_table}
+			WHERE tag % $2
+		""" if include_global else ""
+		records = await self.database.fetch(
+			f"""
+			SELECT tag FROM (
+				SELECT tag, similarity(tag, $2) FROM {self.individual_table}
+				WHERE user_id = $1 AND tag % $2
+				{global_matches}
+			) AS matches (tag, similarity)
+			ORDER BY similarity DESC, tag
+			LIMIT $3
+			""", 
+			user_id, tag, limit
+		)
+		return [record["tag"] for record in records]
+	
+	async def search(self, user_id, search):
+		'''Get the user's tags containing search'''
+		pattern = '%' + re.sub(r"([\\%_])", r"\\\1", search) + '%'
+		records = await self.database.fetch(
+			f"""
+			SELECT tag FROM {self.individual_table}
+			WHERE user_id = $1 AND tag LIKE $2
+			ORDER BY tag
+			""", 
+			user_id, pattern
+		)
+		return [record["tag"] for record in records]
+
+def evaluate_expression(expression):
+	'''Evaluate arithmetic expression, for running in a worker process'''
+	# Defined here so that worker processes import units through this module
+	return evaluate(expression)
+
+def plot_graph(mode, expressions, lower_limit, upper_limit):
+	'''Plot graph as PNG, for running in a worker process'''
+	# Defined here so that worker processes import units through this module
+	return render_graph(mode, expressions, lower_limit, upper_limit)
+
+def plot_jointplot(arguments):
+	'''Plot joint plot as PNG, for running in a worker process'''
+	buffer = io.BytesIO()
+	seaborn.jointplot(**arguments).savefig(buffer, format = "PNG")
+	return buffer.getvalue()
+
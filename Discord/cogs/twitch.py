@@ -13,6 +13,10 @@ import dateutil.parser
 
 from utilities import checks
 
+sys.path.insert(0, "..")
+from units.twitch import HelixClient, StreamPoller, UnitOutputError
+sys.path.pop(0)
+
 errors_logger = logging.getLogger("errors")
 
 def setup(bot):
@@ -22,6 +26,14 @@ class Twitch(commands.Cog):
 	
 	def __init__(self, bot):
 		self.bot = bot
+		self.helix = HelixClient(bot.TWITCH_CLIENT_ID, bot.TWITCH_CLIENT_SECRET, bot.aiohttp_session)
+		self.poller = StreamPoller(self.helix)
+		self.poller.subscribe("go_live", self.announce_streams)
+		self.poller.subscribe("go_offline", self.update_offline_streams)
+		# Loaded each poll
+		self.follows = {"channels": {}, "games": {}, "keywords": {}}
+		self.filters = {}
+		self.reconciled = False
 		self.check_streams.start().set_name("Twitch")
 	
 	def cog_unload(self):
@@ -95,11 +107,8 @@ class Twitch(commands.Cog):
 	@commands.check_any(checks.is_permitted(), checks.is_guild_owner())
 	async def add_channel(self, ctx, username: str):
 		'''Add a Twitch channel to follow'''
-		url = "https://api.twitch.tv/kraken/users"
-		headers = {"Accept": "application/vnd.twitchtv.v5+json"}
-		params = {"login": username, "client_id": ctx.bot.TWITCH_CLIENT_ID}
-		async with ctx.bot.aiohttp_session.get(url, headers = headers, params = params) as resp:
-			users_data = await resp.json()
+		if not (users := await self.helix.get_users(logins = [username])):
+			return await ctx.embed_reply(f"{ctx.bot.error_emoji} Twitch channel not found")
 		inserted = await ctx.bot.db.fetchrow(
 			"""
 			INSERT INTO twitch_notifications.channels (channel_id, user_name, user_id)
@@ -107,7 +116,7 @@ class Twitch(commands.Cog):
 			ON CONFLICT DO NOTHING
 			RETURNING *
 			""", 
-			ctx.channel.id, username, users_data["users"][0]["_id"]
+			ctx.channel.id, username, users[0]["id"]
 		)
 		if not inserted:
 			return await ctx.embed_reply(f"This text channel is already following the channel, `{username}`")
@@ -181,16 +190,14 @@ class Twitch(commands.Cog):
 			""", 
 			ctx.channel.id
 		)
+		users = {user["id"]: user for user in await self.helix.get_users(ids = [record["user_id"] for record in records])}
 		description = ""
 		for record in records:
-			url = f"https://api.twitch.tv/kraken/users/{record['user_id']}"
-			headers = {"Accept": "application/vnd.twitchtv.v5+json"}
-			params = {"client_id": self.bot.TWITCH_CLIENT_ID}
-			async with self.bot.aiohttp_session.get(url, headers = headers, params = params) as resp:
-				user_data = await resp.json()
+			if not (user := users.get(record["user_id"])):
+				continue
 			# TODO: Add note about name change to response
-			#       user_data["name"] != record["user_name"]
-			link = f"[{user_data['display_name']}](https://www.twitch.tv/{user_data['display_name']})"
+			#       user["login"] != record["user_name"]
+			link = f"[{user['display_name']}](https://www.twitch.tv/{user['login']})"
 			if len(description + link) > self.bot.EMBED_DESCRIPTION_CHARACTER_LIMIT:
 				await ctx.embed_reply(description[:-1], title = "Twitch channels being followed in this text channel")
 				description = ""
@@ -249,18 +256,15 @@ class Twitch(commands.Cog):
 	@commands.check_any(checks.is_permitted(), checks.is_guild_owner())
 	async def remove_channel(self, ctx, username: str):
 		'''Remove a Twitch channel being followed'''
-		url = "https://api.twitch.tv/kraken/users"
-		headers = {"Accept": "application/vnd.twitchtv.v5+json"}
-		params = {"login": username, "client_id": ctx.bot.TWITCH_CLIENT_ID}
-		async with ctx.bot.aiohttp_session.get(url, headers = headers, params = params) as resp:
-			users_data = await resp.json()
+		if not (users := await self.helix.get_users(logins = [username])):
+			return await ctx.embed_reply(f"{ctx.bot.error_emoji} Twitch channel not found")
 		deleted = await ctx.bot.db.fetchval(
 			"""
 			DELETE FROM twitch_notifications.channels
 			WHERE channel_id = $1 AND user_id = $2
 			RETURNING *
 			""", 
-			ctx.channel.id, users_data["users"][0]["_id"]
+			ctx.channel.id, users[0]["id"]
 		)
 		if not deleted:
 			return await ctx.embed_reply(f"{ctx.bot.error_emoji} This text channel isn't following that Twitch channel")
@@ -317,84 +321,45 @@ class Twitch(commands.Cog):
 	# R/PT60S
 	@tasks.loop(seconds = 60)
 	async def check_streams(self):
-		headers = {"Accept": "application/vnd.twitchtv.v5+json"}  # Use Twitch API v5
 		try:
-			stream_ids = []
-			# Games
-			records = await self.bot.db.fetch("SELECT DISTINCT game FROM twitch_notifications.games")
-			url = "https://api.twitch.tv/kraken/streams"
-			for record in records:
-				game = record["game"]
-				params = {"game": game, "client_id": self.bot.TWITCH_CLIENT_ID, "limit": 100}
-				async with self.bot.aiohttp_session.get(url, params = params, headers = headers) as resp:
-					if resp.status in (421, 502, 503, 504):
-						continue
-					games_data = await resp.json()
-				streams = games_data.get("streams", [])
-				stream_ids += [str(stream["_id"]) for stream in streams]
-				await self.process_streams(streams, "games", match = game)
-				await asyncio.sleep(1)
-			# Keywords
-			records = await self.bot.db.fetch("SELECT DISTINCT keyword FROM twitch_notifications.keywords")
-			url = "https://api.twitch.tv/kraken/search/streams"
-			for record in records:
-				keyword = record["keyword"]
-				params = {"query": keyword, "client_id": self.bot.TWITCH_CLIENT_ID, "limit": 100}
-				async with self.bot.aiohttp_session.get(url, params = params, headers = headers) as resp:
-					keywords_data = await resp.json()
-				streams = keywords_data.get("streams", [])
-				stream_ids += [str(stream["_id"]) for stream in streams]
-				await self.process_streams(streams, "keywords", match = keyword)
-				await asyncio.sleep(1)
-			# Streams
-			streams_data = {}
-			records = await self.bot.db.fetch("SELECT DISTINCT user_id FROM twitch_notifications.channels")
-			if records:
-				url = "https://api.twitch.tv/kraken/streams"
-				params = {"channel": ','.join(record["user_id"] for record in records), 
-							"client_id": self.bot.TWITCH_CLIENT_ID, "limit": 100}
-				async with self.bot.aiohttp_session.get(url, params = params, headers = headers) as resp:
-					if resp.status not in (502, 503, 504):
-						streams_data = await resp.json()
-					# TODO: Handle >100 streams
-				streams = streams_data.get("streams", [])
-				stream_ids += [str(stream["_id"]) for stream in streams]
-				await self.process_streams(streams, "streams")
-			# Update streams notified
+			# Load follows and filters in one query each
 			records = await self.bot.db.fetch(
 				"""
-				SELECT stream_id, channel_id, message_id
-				FROM twitch_notifications.notifications
-				WHERE live = TRUE
+				SELECT 'channels' AS type, channel_id, user_id AS match FROM twitch_notifications.channels
+				UNION ALL
+				SELECT 'games', channel_id, game FROM twitch_notifications.games
+				UNION ALL
+				SELECT 'keywords', channel_id, keyword FROM twitch_notifications.keywords
 				"""
 			)
+			follows = {"channels": {}, "games": {}, "keywords": {}}
 			for record in records:
-				if record["stream_id"] not in stream_ids:
-					text_channel = self.bot.get_channel(record["channel_id"])
-					# TODO: Handle text channel not existing anymore
-					try:
-						message = await text_channel.fetch_message(record["message_id"])
-					except discord.NotFound:
-						# Notification was deleted
-						continue
-					embed = message.embeds[0]
-					embed.set_author(name = embed.author.name.replace("just went", "was"), 
-										url = embed.author.url, icon_url = embed.author.icon_url)
-					try:
-						await message.edit(embed = embed)
-					except discord.Forbidden:
-						# Missing permission to edit?
-						pass
-					await self.bot.db.execute(
-						"""
-						UPDATE twitch_notifications.notifications
-						SET live = FALSE
-						WHERE stream_id = $1 AND channel_id = $2
-						""", 
-						record["stream_id"], record["channel_id"]
-					)
-				# TODO: Handle no longer being followed?
-		except aiohttp.ClientConnectionError as e:
+				follows[record["type"]].setdefault(record["match"], []).append(record["channel_id"])
+			records = await self.bot.db.fetch(
+				"""
+				SELECT channel_id, ARRAY_AGG(filter) AS filters
+				FROM twitch_notifications.filters
+				GROUP BY channel_id
+				"""
+			)
+			self.follows = follows
+			self.filters = {record["channel_id"]: record["filters"] for record in records}
+			# Batched Helix requests, with announcements made by the event handlers
+			await self.poller.poll(user_ids = follows["channels"], games = follows["games"], 
+									keywords = follows["keywords"])
+			if not self.reconciled:
+				# Update notifications for streams that ended while not being polled
+				records = await self.bot.db.fetch(
+					"""
+					SELECT DISTINCT stream_id
+					FROM twitch_notifications.notifications
+					WHERE live = TRUE
+					"""
+				)
+				await self.mark_offline([record["stream_id"] for record in records 
+											if record["stream_id"] not in self.poller.live])
+				self.reconciled = True
+		except (aiohttp.ClientConnectionError, UnitOutputError) as e:
 			self.bot.print(f"Twitch Task Connection Error: {type(e).__name__}: {e}")
 			await asyncio.sleep(10)
 		except discord.DiscordServerError as e:
@@ -415,130 +380,154 @@ class Twitch(commands.Cog):
 	async def after_check_streams(self):
 		self.bot.print("Twitch task cancelled")
 	
-	async def process_streams(self, streams, type, match = None):
-		# TODO: use textwrap
-		for stream in streams:
-			records = await self.bot.db.fetch(
+	async def announce_streams(self, streams):
+		# Load announcements for all streams that went live in one query
+		records = await self.bot.db.fetch(
+			"""
+			SELECT stream_id, channel_id, message_id, live
+			FROM twitch_notifications.notifications
+			WHERE stream_id = ANY($1)
+			""", 
+			[stream.id for stream in streams]
+		)
+		# TODO: Handle streams notified already, but followed by new channel
+		notified = {record["stream_id"] for record in records}
+		if relive := [record for record in records if not record["live"]]:
+			await self.bot.db.execute(
 				"""
-				SELECT channel_id, message_id, live
-				FROM twitch_notifications.notifications
-				WHERE stream_id = $1
+				UPDATE twitch_notifications.notifications
+				SET live = TRUE
+				WHERE stream_id = ANY($1)
 				""", 
-				str(stream["_id"])
+				list({record["stream_id"] for record in relive})
 			)
-			# TODO: Handle streams notified already, but followed by new channel
-			for record in records:
-				if not record["live"]:
-					text_channel = self.bot.get_channel(record["channel_id"])
-					# TODO: Handle text channel not existing anymore
-					try:
-						message = await text_channel.fetch_message(record["message_id"])
-					except discord.NotFound:
-						# Notification was deleted
-						continue
-					embed = message.embeds[0]
-					embed.set_author(name = embed.author.name.replace("was", "just went"), 
-										url = embed.author.url, icon_url = embed.author.icon_url)
-					await message.edit(embed = embed)
+			for record in relive:
+				await self.edit_notification(record, "was", "just went")
+		if not (streams := [stream for stream in streams if stream.id not in notified]):
+			return
+		users = {user["id"]: user for user in await self.helix.get_users(ids = [stream.user_id for stream in streams])}
+		notifications = []
+		for stream in streams:
+			embed = self.build_embed(stream, users.get(stream.user_id))
+			for channel_id, (type, match) in self.get_notification_channels(stream).items():
+				if message := await self.send_notification(channel_id, embed, stream, type, match):
+					notifications.append((stream.id, channel_id, message.id))
+		await self.bot.db.executemany(
+			"""
+			INSERT INTO twitch_notifications.notifications (stream_id, channel_id, message_id, live)
+			VALUES ($1, $2, $3, TRUE)
+			ON CONFLICT DO NOTHING
+			""", 
+			notifications
+		)
+	
+	async def update_offline_streams(self, streams):
+		await self.mark_offline([stream.id for stream in streams])
+	
+	async def mark_offline(self, stream_ids):
+		if not stream_ids:
+			return
+		records = await self.bot.db.fetch(
+			"""
+			UPDATE twitch_notifications.notifications
+			SET live = FALSE
+			WHERE stream_id = ANY($1) AND live = TRUE
+			RETURNING stream_id, channel_id, message_id
+			""", 
+			stream_ids
+		)
+		for record in records:
+			await self.edit_notification(record, "just went", "was")
+	
+	async def edit_notification(self, record, old, new):
+		if not (text_channel := self.bot.get_channel(record["channel_id"])):
+			# TODO: Remove text channel data if now non-existent
+			return
+		try:
+			message = await text_channel.fetch_message(record["message_id"])
+		except discord.NotFound:
+			# Notification was deleted
+			return
+		embed = message.embeds[0]
+		embed.set_author(name = embed.author.name.replace(old, new), 
+							url = embed.author.url, icon_url = embed.author.icon_url)
+		try:
+			await message.edit(embed = embed)
+		except discord.Forbidden:
+			# Missing permission to edit?
+			pass
+	
+	def get_notification_channels(self, stream):
+		'''Get text channels to notify for a stream, with the type and value of the follow each matched'''
+		channels = {}
+		for keyword in stream.keywords:
+			for channel_id in self.follows["keywords"].get(keyword, ()):
+				channels[channel_id] = ("keywords", keyword)
+		for game in stream.games:
+			for channel_id in self.follows["games"].get(game, ()):
+				channels[channel_id] = ("games", game)
+		if stream.user:
+			for channel_id in self.follows["channels"].get(stream.user_id, ()):
+				channels[channel_id] = ("channels", stream.user_id)
+		# TODO: Make filter case-insensitive?
+		return {channel_id: follow for channel_id, follow in channels.items() 
+				if all(filter in stream.data["title"] for filter in self.filters.get(channel_id, ()))}
+	
+	def build_embed(self, stream, user):
+		# TODO: use textwrap
+		data = stream.data
+		if len(data["title"]) <= 256:
+			title = data["title"]
+		else:
+			title = data["title"][:253] + "..."
+		if data.get("game_name"):
+			description = f"{data['user_name']} is playing {data['game_name']}"
+		else:
+			description = discord.Embed.Empty
+		embed = discord.Embed(title = title, url = f"https://www.twitch.tv/{data['user_login']}", 
+								description = description, 
+								timestamp = dateutil.parser.parse(data["started_at"]).replace(tzinfo = None), 
+								color = self.bot.twitch_color)
+		embed.set_author(name = f"{data['user_name']} just went live on Twitch", 
+							icon_url = self.bot.twitch_icon_url)
+		if user and user.get("profile_image_url"):
+			embed.set_thumbnail(url = user["profile_image_url"])
+		embed.add_field(name = "Viewers", value = f"{data['viewer_count']:,}")
+		if user and "view_count" in user:
+			embed.add_field(name = "Views", value = f"{user['view_count']:,}")
+		return embed
+	
+	async def send_notification(self, channel_id, embed, stream, type, match):
+		if not (text_channel := self.bot.get_channel(channel_id)):
+			# TODO: Remove text channel data if now non-existent
+			return
+		try:
+			return await text_channel.send(embed = embed)
+		except discord.Forbidden:
+			if not (permissions := text_channel.permissions_for(text_channel.guild.me)).embed_links and permissions.send_messages:
+				if type == "channels":
 					await self.bot.db.execute(
 						"""
-						UPDATE twitch_notifications.notifications
-						SET live = TRUE
-						WHERE stream_id = $1 AND channel_id = $2
+						DELETE FROM twitch_notifications.channels
+						WHERE channel_id = $1 AND user_id = $2
 						""", 
-						str(stream["_id"]), record["channel_id"]
+						channel_id, match
 					)
-			if not records:
-				# Construct embed
-				if len(stream["channel"]["status"]) <= 256:
-					title = stream["channel"]["status"]
-				else:
-					title = stream["channel"]["status"][:253] + "..."
-				if stream["channel"]["game"]:
-					description = f"{stream['channel']['display_name']} is playing {stream['game']}"
+					await text_channel.send("I am unable to send the embed notification in this text channel for "
+											f"{stream.data['user_name']} going live on Twitch, "
+											"so this text channel is no longer following that Twitch channel.")
 				else:
-					description = discord.Embed.Empty
-				embed = discord.Embed(title = title, url = stream["channel"]["url"], 
-										description = description, 
-										timestamp = dateutil.parser.parse(stream["created_at"]).replace(tzinfo = None), 
-										color = self.bot.twitch_color)
-				embed.set_author(name = f"{stream['channel']['display_name']} just went live on Twitch", 
-									icon_url = self.bot.twitch_icon_url)
-				if stream["channel"]["logo"]:
-					embed.set_thumbnail(url = stream["channel"]["logo"])
-				embed.add_field(name = "Followers", value = f"{stream['channel']['followers']:,}")
-				embed.add_field(name = "Views", value = f"{stream['channel']['views']:,}")
-				# Get text channel IDs
-				if not match:
-					records = await self.bot.db.fetch(
-						"""
-						SELECT channel_id FROM twitch_notifications.channels
-						WHERE user_id = $1
-						""", 
-						str(stream["channel"]["_id"])
-					)
-				else:
-					records = await self.bot.db.fetch(
-						f"""
-						SELECT channel_id FROM twitch_notifications.{type}
-						WHERE {type[:-1]} = $1
-						""", 
-						match
-					)
-				channel_ids = [record["channel_id"] for record in records]
-				for channel_id in channel_ids.copy():
-					records = await self.bot.db.fetch(
-						"""
-						SELECT filter FROM twitch_notifications.filters
-						WHERE channel_id = $1
-						""", 
-						channel_id
-					)
-					for record in records:
-						# TODO: Make filter case-insensitive?
-						if record["filter"] not in stream["channel"]["status"]:
-							channel_ids.remove(channel_id)
-							break
-				# Send notifications
-				for channel_id in channel_ids:
-					if not (text_channel := self.bot.get_channel(channel_id)):
-						# TODO: Remove text channel data if now non-existent
-						continue
-					try:
-						message = await text_channel.send(embed = embed)
-					except discord.Forbidden:
-						if not (permissions := text_channel.permissions_for(text_channel.guild.me)).embed_links and permissions.send_messages:
-							if not match:
-								await self.bot.db.execute(
-									"""
-									DELETE FROM twitch_notifications.channels
-									WHERE channel_id = $1 AND user_id = $2
-									""", 
-									channel_id, str(stream["channel"]["_id"])
-								)
-								await text_channel.send("I am unable to send the embed notification in this text channel for "
-														f"{stream['channel']['display_name']} going live on Twitch, "
-														"so this text channel is no longer following that Twitch channel.")
-							else:
-								await self.bot.db.execute(
-									f"""
-									DELETE FROM twitch_notifications.{type}
-									WHERE channel_id = $1 AND {type[:-1]} = $2
-									""", 
-									channel_id, match
-								)
-								await text_channel.send("I am unable to send the embed notification in this text channel for "
-														f"a stream going live on Twitch matching the {type[:-1]}, {match}, "
-														f"so this text channel is no longer following that {type[:-1]} for Twitch streams.")
-						else:
-							# TODO: Handle no longer able to send messages in text channel
-							print(f"Twitch Task: Missing permissions to send message in #{text_channel.name} in {text_channel.guild.name}")
-						continue
 					await self.bot.db.execute(
-						"""
-						INSERT INTO twitch_notifications.notifications (stream_id, channel_id, message_id, live)
-						VALUES ($1, $2, $3, TRUE)
+						f"""
+						DELETE FROM twitch_notifications.{type}
+						WHERE channel_id = $1 AND {type[:-1]} = $2
 						""", 
-						str(stream["_id"]), channel_id, message.id
+						channel_id, match
 					)
+					await text_channel.send("I am unable to send the embed notification in this text channel for "
+											f"a stream going live on Twitch matching the {type[:-1]}, {match}, "
+											f"so this text channel is no longer following that {type[:-1]} for Twitch streams.")
+			else:
+				# TODO: Handle no longer able to send messages in text channel
+				print(f"Twitch Task: Missing permissions to send message in #{text_channel.name} in {text_channel.guild.name}")
 
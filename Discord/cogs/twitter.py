@@ -5,12 +5,16 @@ from discord.ext import commands
 import asyncio
 import functools
 import html
+import json
 import logging
 import sys
+import time
 import traceback
+import urllib.parse
 
+import aiohttp
+import oauthlib.oauth1
 import tweepy
-import urllib3
 
 from utilities import checks
 
@@ -19,79 +23,228 @@ errors_logger = logging.getLogger("errors")
 def setup(bot):
 	bot.add_cog(Twitter(bot))
 
-class TwitterStreamListener(tweepy.StreamListener):
+class TwitterStream:
 	
-	def __init__(self, bot):
-		super().__init__()
+	'''
+	Twitter filter stream for followed users, read with aiohttp on the event loop
+	Tweets are handed off to send workers through a bounded queue, dropping Tweets when full
+	Tweets are routed through an index of user IDs to text channels
+	Reconnects back off as recommended by Twitter:
+	linearly for network errors, and exponentially for HTTP errors and rate limiting
+	'''
+	
+	url = "https://stream.twitter.com/1.1/statuses/filter.json"
+	# Twitter rate limits connections
+	min_reconnect_interval = 120
+	
+	def __init__(self, bot, *, queue_size = 1000, workers = 4):
 		self.bot = bot
-		self.stream = None
-		self.feeds = {}
-		self.unique_feeds = set()
-		self.reconnect_ready = asyncio.Event()
-		self.reconnect_ready.set()
-		self.reconnecting = False
+		self.oauth_client = oauthlib.oauth1.Client(bot.TWITTER_CONSUMER_KEY, 
+													client_secret = bot.TWITTER_CONSUMER_SECRET, 
+													resource_owner_key = bot.TWITTER_ACCESS_TOKEN, 
+													resource_owner_secret = bot.TWITTER_ACCESS_TOKEN_SECRET)
+		self.channels = {}  # user ID: text channel IDs
+		self.user_ids = {}  # lowercase handle: user ID
+		self.queue = asyncio.Queue(maxsize = queue_size)
+		self.workers = workers
+		self.tasks = []
+		self.follows_changed = asyncio.Event()
+		self.connected_at = 0
+		self.tweets_received = self.tweets_dropped = self.lines_skipped = 0
+	
+	def start(self):
+		self.tasks = [self.bot.loop.create_task(self.run(), name = "Twitter Stream")]
+		self.tasks += [self.bot.loop.create_task(self.send_worker(), name = f"Twitter Stream send worker {number}") 
+						for number in range(self.workers)]
 	
-	def __del__(self):
-		if self.stream:
-			self.stream.disconnect()
+	def stop(self):
+		for task in self.tasks:
+			task.cancel()
 	
-	async def start_feeds(self, *, feeds = None):
-		if self.reconnecting:
-			return await self.reconnect_ready.wait()
-		self.reconnecting = True
-		await self.reconnect_ready.wait()
-		self.reconnect_ready.clear()
-		if feeds:
-			self.feeds = feeds
-			self.unique_feeds = set(id for feeds in self.feeds.values() for id in feeds)
-		if self.stream:
-			self.stream.disconnect()
-		self.stream = tweepy.Stream(auth = self.bot.twitter_api.auth, listener = self)
-		if self.feeds:
-			self.stream.filter(follow = self.unique_feeds, is_async = True)
-		self.bot.loop.call_later(120, self.reconnect_ready.set)
-		self.reconnecting = False
+	async def resolve(self, handles):
+		'''Resolve handles to user IDs, with batched lookups for uncached handles'''
+		handles = {handle.lower().lstrip('@') for handle in handles}
+		unresolved = list(handles - set(self.user_ids))
+		for index in range(0, len(unresolved), 100):
+			partial = functools.partial(self.bot.twitter_api.lookup_users, screen_names = unresolved[index:index + 100])
+			try:
+				users = await self.bot.loop.run_in_executor(None, partial)
+			except tweepy.error.TweepError as e:
+				# TODO: Handle rate limit
+				if e.api_code == 17:
+					# No users found
+					continue
+				raise
+			for user in users:
+				self.user_ids[user.screen_name.lower()] = user.id_str
+		return {handle: self.user_ids[handle] for handle in handles if handle in self.user_ids}
+	
+	def set_feeds(self, feeds):
+		'''Set followed handles from (text channel ID, handle) pairs, for handles already resolved'''
+		channels = {}
+		for channel_id, handle in feeds:
+			if user_id := self.user_ids.get(handle.lower().lstrip('@')):
+				channels.setdefault(user_id, set()).add(channel_id)
+		self.channels = channels
+		self.follows_changed.set()
 	
 	async def add_feed(self, channel, handle):
-		user_id = self.bot.twitter_api.get_user(handle).id_str
-		self.feeds[channel.id] = self.feeds.get(channel.id, []) + [user_id]
-		if user_id not in self.unique_feeds:
-			self.unique_feeds.add(user_id)
-			await self.start_feeds()
+		'''Add handle to channel, returning False if the handle wasn't found'''
+		if not (user_id := (await self.resolve([handle])).get(handle.lower().lstrip('@'))):
+			return False
+		if user_id not in self.channels:
+			self.follows_changed.set()
+		self.channels.setdefault(user_id, set()).add(channel.id)
+		return True
 	
 	async def remove_feed(self, channel, handle):
-		self.feeds[channel.id].remove(self.bot.twitter_api.get_user(handle).id_str)
-		self.unique_feeds = set(id for feeds in self.feeds.values() for id in feeds)
-		await self.start_feeds()  # Necessary?
+		if not (user_id := (await self.resolve([handle])).get(handle.lower().lstrip('@'))):
+			return
+		channel_ids = self.channels.get(user_id, set())
+		channel_ids.discard(channel.id)
+		if not channel_ids:
+			self.channels.pop(user_id, None)
+			self.follows_changed.set()
+	
+	async def run(self):
+		network_delay = 0
+		http_delay = None
+		while True:
+			if not self.channels:
+				self.follows_changed.clear()
+				await self.follows_changed.wait()
+			self.follows_changed.clear()
+			self.connected_at = time.monotonic()
+			try:
+				status = await self.stream()
+			except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+				status = f"{type(e).__name__}: {e}"
+			except Exception as e:
+				# e.g. ValueError for a line too long to read
+				# Reconnect with the network error backoff, rather than ending the stream
+				errors_logger.error("Uncaught Twitter Stream exception\n", 
+									exc_info = (type(e), e, e.__traceback__))
+				status = f"{type(e).__name__}: {e}"
+			if status is None:
+				# Follows changed
+				network_delay = 0
+				http_delay = None
+				continue
+			if not isinstance(status, int) or status == 200:
+				# Network error, or disconnected after connecting successfully
+				network_delay = 0.25 if status == 200 else min(network_delay + 0.25, 16)
+				http_delay = None
+				self.bot.print(f"Twitter stream disconnected: {status} | Reconnecting in {network_delay}s")
+				await asyncio.sleep(network_delay)
+				continue
+			network_delay = 0
+			if status in (420, 429):
+				# Rate limited
+				http_delay = 60 if http_delay is None else min(http_delay * 2, 960)
+			else:
+				http_delay = 5 if http_delay is None else min(http_delay * 2, 320)
+			self.bot.print(f"Twitter stream HTTP error {status} | Reconnecting in {http_delay}s")
+			await asyncio.sleep(http_delay)
+	
+	async def stream(self):
+		'''
+		Connect and read Tweets until disconnected or follows change
+		Returns the HTTP status if the connection failed or ended, or None if follows changed
+		'''
+		body = urllib.parse.urlencode({"follow": ','.join(self.channels), "stall_warnings": "true"})
+		url, headers, body = self.oauth_client.sign(self.url, http_method = "POST", body = body, 
+													headers = {"Content-Type": "application/x-www-form-urlencoded"})
+		# Keep-alive newlines are sent every 30 seconds
+		timeout = aiohttp.ClientTimeout(total = None, sock_connect = 30, sock_read = 90)
+		async with self.bot.aiohttp_session.post(url, data = body, headers = headers, timeout = timeout) as resp:
+			if resp.status != 200:
+				return resp.status
+			reader = asyncio.ensure_future(self.read(resp))
+			changed = asyncio.ensure_future(self.follows_changed.wait())
+			try:
+				done, _ = await asyncio.wait((reader, changed), return_when = asyncio.FIRST_COMPLETED)
+				if reader not in done:
+					# Keep reading until reconnecting is allowed, so follow changes are batched
+					done, _ = await asyncio.wait((reader,), timeout = max(0, self.connected_at + 
+																			self.min_reconnect_interval - 
+																			time.monotonic()))
+			finally:
+				reader.cancel()
+				changed.cancel()
+			if reader in done:
+				reader.result()
+				return resp.status
+	
+	async def read(self, resp):
+		async for line in resp.content:
+			if not (line := line.strip()):
+				# Keep-alive
+				continue
+			try:
+				data = json.loads(line)
+			except json.JSONDecodeError as e:
+				# Truncated or garbled line
+				self.lines_skipped += 1
+				self.bot.print(f"Twitter stream skipped invalid line: {e}")
+				continue
+			if not isinstance(data, dict):
+				self.lines_skipped += 1
+				continue
+			if "warning" in data:
+				self.bot.print(f"Twitter stream warning: {data['warning'].get('message')}")
+			if "user" not in data or "id" not in data:
+				# Not a Tweet
+				continue
+			self.tweets_received += 1
+			try:
+				self.queue.put_nowait(data)
+			except asyncio.QueueFull:
+				self.tweets_dropped += 1
+	
+	async def send_worker(self):
+		while True:
+			data = await self.queue.get()
+			try:
+				await self.process_status(tweepy.models.Status.parse(self.bot.twitter_api, data))
+			except Exception as e:
+				print("Exception in Twitter Stream send worker", file = sys.stderr)
+				traceback.print_exception(type(e), e, e.__traceback__, file = sys.stderr)
+				errors_logger.error("Uncaught Twitter Stream send worker exception\n", 
+									exc_info = (type(e), e, e.__traceback__))
+			finally:
+				self.queue.task_done()
 	
-	def on_status(self, status):
+	async def process_status(self, status):
 		if status.in_reply_to_status_id:
 			# Ignore replies
 			return
-		if status.user.id_str in self.unique_feeds:
-			# TODO: Settings for including replies, retweets, etc.
-			for channel_id, channel_feeds in self.feeds.items():
-				if status.user.id_str in channel_feeds:
-					channel = self.bot.get_channel(channel_id)
-					if channel:
-						if hasattr(status, "extended_tweet"):
-							text = status.extended_tweet["full_text"]
-							entities = status.extended_tweet["entities"]
-							extended_entities = status.extended_tweet.get("extended_entities")
-						else:
-							text = status.text
-							entities = status.entities
-							extended_entities = getattr(status, "extended_entities", None)
-						embed = discord.Embed(title = '@' + status.user.screen_name, 
-												url = f"https://twitter.com/{status.user.screen_name}/status/{status.id}", 
-												description = self.bot.cogs["Twitter"].process_tweet_text(text, entities), 
-												timestamp = status.created_at, color = self.bot.twitter_color)
-						embed.set_author(name = status.user.name, icon_url = status.user.profile_image_url)
-						if extended_entities and extended_entities["media"][0]["type"] == "photo":
-							embed.set_image(url = extended_entities["media"][0]["media_url_https"])
-							embed.description = embed.description.replace(extended_entities["media"][0]["url"], "")
-						embed.set_footer(text = "Twitter", icon_url = self.bot.twitter_icon_url)
-						self.bot.loop.create_task(self.send_embed(channel, embed), name = "Send embed for Tweet")
+		# TODO: Settings for including replies, retweets, etc.
+		if not (channel_ids := self.channels.get(status.user.id_str)):
+			return
+		embed = self.build_embed(status)
+		for channel_id in channel_ids.copy():
+			if channel := self.bot.get_channel(channel_id):
+				await self.send_embed(channel, embed)
+	
+	def build_embed(self, status):
+		if hasattr(status, "extended_tweet"):
+			text = status.extended_tweet["full_text"]
+			entities = status.extended_tweet["entities"]
+			extended_entities = status.extended_tweet.get("extended_entities")
+		else:
+			text = status.text
+			entities = status.entities
+			extended_entities = getattr(status, "extended_entities", None)
+		embed = discord.Embed(title = '@' + status.user.screen_name, 
+								url = f"https://twitter.com/{status.user.screen_name}/status/{status.id}", 
+								description = self.bot.cogs["Twitter"].process_tweet_text(text, entities), 
+								timestamp = status.created_at, color = self.bot.twitter_color)
+		embed.set_author(name = status.user.name, icon_url = status.user.profile_image_url)
+		if extended_entities and extended_entities["media"][0]["type"] == "photo":
+			embed.set_image(url = extended_entities["media"][0]["media_url_https"])
+			embed.description = embed.description.replace(extended_entities["media"][0]["url"], "")
+		embed.set_footer(text = "Twitter", icon_url = self.bot.twitter_icon_url)
+		return embed
 	
 	@staticmethod
 	async def send_embed(channel, embed):
@@ -99,44 +252,18 @@ class TwitterStreamListener(tweepy.StreamListener):
 			await channel.send(embed = embed)
 		except discord.Forbidden:
 			# TODO: Handle unable to send embeds/messages in text channel
-			print(f"Twitter Stream Listener: Missing permissions to send embed in #{channel.name} in {channel.guild.name}")
-	
-	def on_error(self, status_code):
-		self.bot.print(f"Twitter Error: {status_code}")
-		return False
-	
-	def on_exception(self, exception):
-		if isinstance(exception, urllib3.exceptions.ReadTimeoutError):
-			self.bot.print("Twitter stream timed out | Recreating stream..")
-			self.bot.loop.create_task(self.start_feeds(), name = "Restart Twitter Stream")
-		elif isinstance(exception, urllib3.exceptions.ProtocolError):
-			self.bot.print("Twitter stream Incomplete Read error | Recreating stream..")
-			self.bot.loop.create_task(self.start_feeds(), name = "Restart Twitter Stream")
+			print(f"Twitter Stream: Missing permissions to send embed in #{channel.name} in {channel.guild.name}")
 
 class Twitter(commands.Cog):
 	
 	def __init__(self, bot):
 		self.bot = bot
 		self.blacklisted_handles = []
-		try:
-			twitter_account = self.bot.twitter_api.verify_credentials()
-			if twitter_account.protected:
-				self.blacklisted_handles.append(twitter_account.screen_name.lower())
-			# TODO: Handle more than 5000 friends/following
-			twitter_friends = self.bot.twitter_api.friends_ids(screen_name = twitter_account.screen_name)
-			for interval in range(0, len(twitter_friends), 100):
-				some_friends = self.bot.twitter_api.lookup_users(twitter_friends[interval:interval + 100])
-				for friend in some_friends:
-					if friend.protected:
-						self.blacklisted_handles.append(friend.screen_name.lower())
-		except tweepy.error.TweepError as e:
-			self.bot.print(f"Failed to initialize Twitter cog blacklist: {e}")
-		self.stream_listener = TwitterStreamListener(bot)
+		self.stream = TwitterStream(bot)
 		self.task = self.bot.loop.create_task(self.start_twitter_feeds(), name = "Start Twitter Stream")
 	
 	def cog_unload(self):
-		if self.stream_listener.stream:
-			self.stream_listener.stream.disconnect()
+		self.stream.stop()
 		self.task.cancel()
 	
 	async def initialize_database(self):
@@ -215,10 +342,13 @@ class Twitter(commands.Cog):
 		message = await ctx.embed_reply(":hourglass: Please wait")
 		embed = message.embeds[0]
 		try:
-			await self.stream_listener.add_feed(ctx.channel, handle)
+			found = await self.stream.add_feed(ctx.channel, handle)
 		except tweepy.error.TweepError as e:
 			embed.description = f":no_entry: Error: {e}"
 			return await message.edit(embed = embed)
+		if not found:
+			embed.description = f":no_entry: Error: @{handle} not found"
+			return await message.edit(embed = embed)
 		await ctx.bot.db.execute(
 			"""
 			INSERT INTO twitter.handles (channel_id, handle)
@@ -247,7 +377,7 @@ class Twitter(commands.Cog):
 		if not deleted:
 			return await ctx.embed_reply(":no_entry: This text channel isn't following that Twitter handle")
 		message = await ctx.embed_reply(":hourglass: Please wait")
-		await self.stream_listener.remove_feed(ctx.channel, handle)
+		await self.stream.remove_feed(ctx.channel, handle)
 		embed = message.embeds[0]
 		embed.description = f"Removed the Twitter handle, [`{handle}`](https://twitter.com/{handle}), from this text channel."
 		await message.edit(embed = embed)
@@ -284,26 +414,33 @@ class Twitter(commands.Cog):
 		# Unescape HTML entities (&gt;, &lt;, &amp;, etc.)
 		return html.unescape(text.replace('\uFE0F', ""))
 	
+	def get_protected_handles(self):
+		handles = []
+		twitter_account = self.bot.twitter_api.verify_credentials()
+		if twitter_account.protected:
+			handles.append(twitter_account.screen_name.lower())
+		# TODO: Handle more than 5000 friends/following
+		twitter_friends = self.bot.twitter_api.friends_ids(screen_name = twitter_account.screen_name)
+		for interval in range(0, len(twitter_friends), 100):
+			some_friends = self.bot.twitter_api.lookup_users(twitter_friends[interval:interval + 100])
+			for friend in some_friends:
+				if friend.protected:
+					handles.append(friend.screen_name.lower())
+		return handles
+	
 	async def start_twitter_feeds(self):
+		try:
+			self.blacklisted_handles = await self.bot.loop.run_in_executor(None, self.get_protected_handles)
+		except tweepy.error.TweepError as e:
+			self.bot.print(f"Failed to initialize Twitter cog blacklist: {e}")
 		await self.initialize_database()
 		await self.bot.wait_until_ready()
-		feeds = {}
 		try:
-			async with self.bot.database_connection_pool.acquire() as connection:
-				async with connection.transaction():
-					# Postgres requires non-scrollable cursors to be created and used in a transaction.
-					async for record in connection.cursor("SELECT * FROM twitter.handles"):
-						try:
-							partial = functools.partial(self.bot.twitter_api.get_user, record["handle"])
-							user = await self.bot.loop.run_in_executor(None, partial)
-							feeds[record["channel_id"]] = feeds.get(record["channel_id"], []) + [user.id_str]
-						except tweepy.error.TweepError as e:
-							# TODO: Handle rate limit
-							if e.api_code in (50, 63):
-								# User not found (50) or suspended (63)
-								continue
-							raise e
-			await self.stream_listener.start_feeds(feeds = feeds)
+			records = await self.bot.db.fetch("SELECT channel_id, handle FROM twitter.handles")
+			# Users not found or suspended aren't resolved
+			await self.stream.resolve(record["handle"] for record in records)
+			self.stream.set_feeds((record["channel_id"], record["handle"]) for record in records)
+			self.stream.start()
 		except Exception as e:
 			print("Exception in Twitter Task", file = sys.stderr)
 			traceback.print_exception(type(e), e, e.__traceback__, file = sys.stderr)
@@ -3,9 +3,12 @@ import discord
 from discord.ext import commands, tasks
 
 import asyncio
+import contextlib
 import datetime
 import json
 import logging
+import os
+import random
 import sys
 import traceback
 
@@ -14,8 +17,8 @@ import dateutil.parser
 import feedparser
 import isodate
 
-import clients
 from utilities import checks
+from utilities.cache import TTLCache
 
 sys.path.insert(0, "..")
 from units.time import duration_to_string
@@ -39,7 +42,8 @@ class YouTube(commands.Cog):
 	
 	def __init__(self, bot):
 		self.bot = bot
-		self.uploads_processed = []
+		self.uploads_processed = UploadStore(bot)
+		self.subscription_leases = SubscriptionLeaseManager(bot)
 		# Add youtube (audio) streams and uploads subcommands and their corresponding subcommands
 		streams_command = commands.Group(self.streams, aliases = ["stream"], 
 											invoke_without_command = True, case_insensitive = True, 
@@ -59,6 +63,8 @@ class YouTube(commands.Cog):
 														checks = [commands.check_any(checks.is_permitted(), checks.is_guild_owner()).predicate]))
 		uploads_command.add_command(commands.Command(self.uploads_channels, name = "channels", aliases = ["uploads", "videos"], 
 														checks = [checks.not_forbidden().predicate]))
+		uploads_command.add_command(commands.Command(self.uploads_health, name = "health", aliases = ["subscriptions"], 
+														checks = [checks.not_forbidden().predicate]))
 		if (cog := self.bot.get_cog("Audio")) and (parent := getattr(cog, "audio")):
 			parent.add_command(streams_command)
 			parent.add_command(uploads_command)
@@ -70,21 +76,22 @@ class YouTube(commands.Cog):
 			command.add_command(uploads_command)
 			self.bot.add_command(command)
 		
+		self.initialize_task = self.bot.loop.create_task(self.initialize_database(), 
+															name = "Initialize YouTube database")
 		self.streams_task = self.check_streams.start()
 		self.streams_task.set_name("YouTube streams")
-		
-		clients.create_file("youtube_uploads", content = {})
-		with open(self.bot.data_path + "/youtube_uploads.json", 'r') as uploads_file:
-			self.uploads_info = json.load(uploads_file)
-		self.uploads_following = set(channel_id for channels in self.uploads_info.values() for channel_id in channels)
-		self.renew_uploads_task = self.bot.loop.create_task(self.renew_upload_supscriptions(), name = "Renew YouTube upload subscriptions")
+		self.prune_uploads_processed.start().set_name("Prune YouTube uploads processed")
+		self.renew_upload_subscriptions.start().set_name("Renew YouTube upload subscriptions")
 	
 	def cog_unload(self):
 		if (cog := self.bot.get_cog("Audio")) and (parent := getattr(cog, "audio")):
 			parent.remove_command("streams")
 			parent.remove_command("uploads")
+		self.initialize_task.cancel()
 		self.check_streams.cancel()
-		self.renew_uploads_task.cancel()
+		self.prune_uploads_processed.cancel()
+		self.renew_upload_subscriptions.cancel()
+		self.subscription_leases.cancel_renewals()
 	
 	async def initialize_database(self):
 		await self.bot.connect_to_database()
@@ -119,19 +126,71 @@ class YouTube(commands.Cog):
 			)
 			"""
 		)
+		await self.bot.db.execute(
+			"""
+			CREATE TABLE IF NOT EXISTS youtube.uploads (
+				discord_channel_id	BIGINT, 
+				youtube_channel_id	TEXT, 
+				PRIMARY KEY			(discord_channel_id, youtube_channel_id)
+			)
+			"""
+		)
+		await self.bot.db.execute(
+			"""
+			CREATE TABLE IF NOT EXISTS youtube.uploads_processed (
+				video_id		TEXT PRIMARY KEY, 
+				processed_at	TIMESTAMPTZ DEFAULT NOW()
+			)
+			"""
+		)
+		await self.bot.db.execute(
+			"""
+			CREATE TABLE IF NOT EXISTS youtube.upload_subscriptions (
+				youtube_channel_id	TEXT PRIMARY KEY, 
+				lease_expires		TIMESTAMPTZ, 
+				requested_at		TIMESTAMPTZ, 
+				verified_at			TIMESTAMPTZ, 
+				next_renewal		TIMESTAMPTZ, 
+				failures			INT DEFAULT 0, 
+				last_error			TEXT
+			)
+			"""
+		)
+		await self.bot.db.execute(
+			"""
+			CREATE INDEX IF NOT EXISTS uploads_processed_processed_at_index
+			ON youtube.uploads_processed (processed_at)
+			"""
+		)
+		# Migrate from JSON file
+		if os.path.isfile(uploads_path := self.bot.data_path + "/youtube_uploads.json"):
+			with open(uploads_path, 'r') as uploads_file:
+				uploads_info = json.load(uploads_file)
+			await self.bot.db.executemany(
+				"""
+				INSERT INTO youtube.uploads (discord_channel_id, youtube_channel_id)
+				VALUES ($1, $2)
+				ON CONFLICT DO NOTHING
+				""", 
+				[(int(text_channel_id), channel_id) 
+				 for text_channel_id, channel_ids in uploads_info.items() for channel_id in channel_ids]
+			)
+			os.replace(uploads_path, uploads_path + ".migrated")
+		records = await self.bot.db.fetch("SELECT DISTINCT youtube_channel_id FROM youtube.uploads")
+		await self.subscription_leases.load(record["youtube_channel_id"] for record in records)
+	
+	@property
+	def uploads_following(self):
+		return self.subscription_leases.leases.keys()
 	
-	# TODO: renew after hub.lease_seconds?
-	async def renew_upload_supscriptions(self):
-		for channel_id in self.uploads_following:
-			url = "https://pubsubhubbub.appspot.com/"
-			headers = {"content-type": "application/x-www-form-urlencoded"}
-			data = {"hub.callback": self.bot.HTTP_SERVER_CALLBACK_URL, "hub.mode": "subscribe", 
-					"hub.topic": "https://www.youtube.com/xml/feeds/videos.xml?channel_id=" + channel_id}
-			async with self.bot.aiohttp_session.post(url, headers = headers, data = data) as resp:
-				if resp.status not in (202, 204):
-					error_description = await resp.text()
-					self.bot.print(f"Google PubSubHubbub Error {resp.status} re-subscribing to {channel_id}: {error_description}")
-			await asyncio.sleep(5)  # Google PubSubHubbub rate limit?
+	@tasks.loop()
+	async def renew_upload_subscriptions(self):
+		self.subscription_leases.renew_due()
+		await self.subscription_leases.wait()
+	
+	@renew_upload_subscriptions.before_loop
+	async def before_renew_upload_subscriptions(self):
+		await self.initialize_task
 	
 	async def youtube(self, ctx):
 		'''YouTube'''
@@ -311,13 +370,21 @@ class YouTube(commands.Cog):
 	
 	@check_streams.before_loop
 	async def before_check_streams(self):
-		await self.initialize_database()
+		await self.initialize_task
 		await self.bot.wait_until_ready()
 	
 	@check_streams.after_loop
 	async def after_check_streams(self):
 		self.bot.print("YouTube streams task cancelled")
 	
+	@tasks.loop(hours = 24)
+	async def prune_uploads_processed(self):
+		await self.uploads_processed.prune()
+	
+	@prune_uploads_processed.before_loop
+	async def before_prune_uploads_processed(self):
+		await self.initialize_task
+	
 	# TODO: Follow channels/new video uploads
 	
 	async def uploads(self, ctx):
@@ -329,27 +396,30 @@ class YouTube(commands.Cog):
 		channel_id = await self.get_channel_id(channel)
 		if not channel_id:
 			return await ctx.embed_reply(":no_entry: Error: YouTube channel not found")
-		channels = self.uploads_info.get(str(ctx.channel.id))
-		if channels:
-			if channel_id in channels:
-				return await ctx.embed_reply(":no_entry: This text channel is already following that YouTube channel")
-			channels.append(channel_id)
-		else:
-			self.uploads_info[str(ctx.channel.id)] = [channel_id]
-		url = "https://pubsubhubbub.appspot.com/"
-		headers = {"content-type": "application/x-www-form-urlencoded"}
-		data = {"hub.callback": ctx.bot.HTTP_SERVER_CALLBACK_URL, "hub.mode": "subscribe", 
-				"hub.topic": "https://www.youtube.com/xml/feeds/videos.xml?channel_id=" + channel_id}
-		async with ctx.bot.aiohttp_session.post(url, headers = headers, data = data) as resp:
-			# TODO: unique callback url for each subscription?
-			if resp.status not in (202, 204):
-				error_description = await resp.text()
-				await ctx.embed_reply(f":no_entry: Error {resp.status}: {error_description}")
-				self.uploads_info[str(ctx.channel.id)].remove(channel_id)
-				return
-		self.uploads_following.add(channel_id)
-		with open(ctx.bot.data_path + "/youtube_uploads.json", 'w') as uploads_file:
-			json.dump(self.uploads_info, uploads_file, indent = 4)
+		following = await ctx.bot.db.fetchval(
+			"""
+			SELECT EXISTS (
+				SELECT FROM youtube.uploads
+				WHERE discord_channel_id = $1 AND youtube_channel_id = $2
+			)
+			""", 
+			ctx.channel.id, channel_id
+		)
+		if following:
+			return await ctx.embed_reply(":no_entry: This text channel is already following that YouTube channel")
+		# TODO: unique callback url for each subscription?
+		try:
+			await self.subscription_leases.subscribe(channel_id)
+		except HubRequestError as e:
+			return await ctx.embed_reply(f":no_entry: Error {e.status}: {e.description}")
+		await ctx.bot.db.execute(
+			"""
+			INSERT INTO youtube.uploads (discord_channel_id, youtube_channel_id)
+			VALUES ($1, $2)
+			ON CONFLICT DO NOTHING
+			""", 
+			ctx.channel.id, channel_id
+		)
 		await ctx.embed_reply(f"Added the YouTube channel, "
 								f"[`{channel_id}`](https://www.youtube.com/channel/{channel_id}), "
 								"to this text channel\n"
@@ -357,37 +427,75 @@ class YouTube(commands.Cog):
 	
 	async def uploads_remove(self, ctx, channel_id : str):
 		'''Remove YouTube channel being followed'''
-		channels = self.uploads_info.get(str(ctx.channel.id))
-		if not channels or channel_id not in channels:
+		records = await ctx.bot.db.fetch(
+			"""
+			SELECT discord_channel_id
+			FROM youtube.uploads
+			WHERE youtube_channel_id = $1
+			""", 
+			channel_id
+		)
+		text_channel_ids = [record["discord_channel_id"] for record in records]
+		if ctx.channel.id not in text_channel_ids:
 			return await ctx.embed_reply(":no_entry: This text channel isn't following that YouTube channel")
-		channels.remove(channel_id)
-		self.uploads_following = set(channel_id for channels in self.uploads_info.values() for channel_id in channels)
-		url = "https://pubsubhubbub.appspot.com/"
-		headers = {"content-type": "application/x-www-form-urlencoded"}
-		data = {"hub.callback": ctx.bot.HTTP_SERVER_CALLBACK_URL, "hub.mode": "unsubscribe", 
-				"hub.topic": "https://www.youtube.com/xml/feeds/videos.xml?channel_id=" + channel_id}
-		async with ctx.bot.aiohttp_session.post(url, headers = headers, data = data) as resp:
-			if resp.status not in (202, 204):
-				error_description = await resp.text()
-				await ctx.embed_reply(f":no_entry: Error {resp.status}: {error_description}")
-				self.uploads_info[str(ctx.channel.id)].append(channel_id)
-				self.uploads_following.add(channel_id)
-				return
-		with open(ctx.bot.data_path + "/youtube_uploads.json", 'w') as uploads_file:
-			json.dump(self.uploads_info, uploads_file, indent = 4)
+		if len(text_channel_ids) == 1:
+			# Unsubscribe once no text channels are following
+			try:
+				await self.subscription_leases.unsubscribe(channel_id)
+			except HubRequestError as e:
+				return await ctx.embed_reply(f":no_entry: Error {e.status}: {e.description}")
+		await ctx.bot.db.execute(
+			"""
+			DELETE FROM youtube.uploads
+			WHERE discord_channel_id = $1 AND youtube_channel_id = $2
+			""", 
+			ctx.channel.id, channel_id
+		)
 		await ctx.embed_reply("Removed the YouTube channel, "
 								f"[`{channel_id}`](https://www.youtube.com/channel/{channel_id}), "
 								"from this text channel")
 	
 	async def uploads_channels(self, ctx):
 		'''Show YouTube channels being followed in this text channel'''
-		await ctx.embed_reply(ctx.bot.CODE_BLOCK.format('\n'.join(self.uploads_info.get(str(ctx.channel.id), []))))
+		records = await ctx.bot.db.fetch(
+			"""
+			SELECT youtube_channel_id
+			FROM youtube.uploads
+			WHERE discord_channel_id = $1
+			""", 
+			ctx.channel.id
+		)
+		await ctx.embed_reply(ctx.bot.CODE_BLOCK.format('\n'.join(record["youtube_channel_id"] for record in records)))
+	
+	async def uploads_health(self, ctx):
+		'''Show upload notification subscription health for YouTube channels followed in this text channel'''
+		records = await ctx.bot.db.fetch(
+			"""
+			SELECT youtube_channel_id
+			FROM youtube.uploads
+			WHERE discord_channel_id = $1
+			""", 
+			ctx.channel.id
+		)
+		lines = []
+		for record in records:
+			if not (lease := self.subscription_leases.leases.get(record["youtube_channel_id"])):
+				continue
+			line = f"`{lease.channel_id}`: {lease.status}"
+			if lease.lease_expires:
+				line += f", lease expires {lease.lease_expires:%Y-%m-%d %H:%M} UTC"
+			if lease.next_renewal:
+				line += f", renewing {lease.next_renewal:%Y-%m-%d %H:%M} UTC"
+			if lease.failures:
+				line += f"\n{lease.failures} failed attempts, last error: {lease.last_error}"
+			lines.append(line)
+		await ctx.embed_reply('\n'.join(lines) or "This text channel isn't following any YouTube channels", 
+								title = "YouTube upload subscriptions")
 	
 	async def process_upload(self, channel_id, request_content):
 		request_info = await self.bot.loop.run_in_executor(None, feedparser.parse, request_content) # Necessary to run in executor?
-		if request_info.entries and not request_info.entries[0].yt_videoid in self.uploads_processed:
+		if request_info.entries and await self.uploads_processed.add(request_info.entries[0].yt_videoid):
 			video_data = request_info.entries[0]
-			self.uploads_processed.append(video_data.yt_videoid)
 			time_published = dateutil.parser.parse(video_data.published)
 			# Don't process videos published more than an hour ago
 			if time_published < datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(hours = 1): return
@@ -406,12 +514,19 @@ class YouTube(commands.Cog):
 			if thumbnail_url: embed.set_thumbnail(url = thumbnail_url)
 			duration = data.get("contentDetails", {}).get("duration")
 			if duration: embed.description += f"\nLength: {duration_to_string(isodate.parse_duration(duration), abbreviate = True)}"
-			for text_channel_id, yt_channels in self.uploads_info.items():
-				if channel_id in yt_channels:
-					text_channel = self.bot.get_channel(int(text_channel_id))
-					if text_channel:
-						await text_channel.send(embed = embed)
-					# TODO: Remove text channel data if now non-existent
+			records = await self.bot.db.fetch(
+				"""
+				SELECT discord_channel_id
+				FROM youtube.uploads
+				WHERE youtube_channel_id = $1
+				""", 
+				channel_id
+			)
+			for record in records:
+				text_channel = self.bot.get_channel(record["discord_channel_id"])
+				if text_channel:
+					await text_channel.send(embed = embed)
+				# TODO: Remove text channel data if now non-existent
 	
 	async def get_channel_id(self, id_or_username):
 		url = "https://www.googleapis.com/youtube/v3/channels"
@@ -423,3 +538,257 @@ class YouTube(commands.Cog):
 				return data["items"][0]["id"]
 		return ""
 
+class UploadStore:
+	
+	'''
+	Processed YouTube uploads, for deduplicating PubSubHubbub notifications
+	Recently processed video IDs are kept in a bounded LRU cache in front of the database
+	'''
+	
+	def __init__(self, bot, *, max_size = 10000, retention = datetime.timedelta(days = 7)):
+		self.bot = bot
+		self.recent = TTLCache(max_size = max_size)
+		# Uploads published more than an hour ago aren't announced, so records are only needed briefly
+		self.retention = retention
+	
+	async def add(self, video_id):
+		'''Record video as processed, returning False if it already was'''
+		if video_id in self.recent:
+			return False
+		# Cache before inserting, so concurrent notifications are deduplicated
+		self.recent[video_id] = True
+		try:
+			inserted = await self.bot.db.fetchval(
+				"""
+				INSERT INTO youtube.uploads_processed (video_id)
+				VALUES ($1)
+				ON CONFLICT DO NOTHING
+				RETURNING video_id
+				""", 
+				video_id
+			)
+		except BaseException:
+			self.recent.pop(video_id)
+			raise
+		return inserted is not None
+	
+	async def prune(self):
+		await self.bot.db.execute(
+			"""
+			DELETE FROM youtube.uploads_processed
+			WHERE processed_at < NOW() - $1::INTERVAL
+			""", 
+			self.retention
+		)
+
+class HubRequestError(Exception):
+	
+	def __init__(self, status, description):
+		super().__init__(f"{status}: {description}")
+		self.status = status
+		self.description = description
+
+class SubscriptionLease:
+	
+	'''PubSubHubbub subscription lease for a YouTube channel's uploads'''
+	
+	def __init__(self, channel_id, record = None):
+		self.channel_id = channel_id
+		self.lease_expires = record and record["lease_expires"]
+		self.requested_at = record and record["requested_at"]
+		self.verified_at = record and record["verified_at"]
+		self.next_renewal = record and record["next_renewal"]
+		self.failures = record["failures"] if record else 0
+		self.last_error = record and record["last_error"]
+	
+	@property
+	def pending(self):
+		'''Whether the latest subscription request hasn't been verified by the hub'''
+		return bool(self.requested_at and (not self.verified_at or self.verified_at < self.requested_at))
+	
+	@property
+	def status(self):
+		if self.failures:
+			return "failing"
+		if self.lease_expires and self.lease_expires > datetime.datetime.now(datetime.timezone.utc):
+			return "active"
+		if self.pending:
+			return "pending"
+		return "expired"
+
+class SubscriptionLeaseManager:
+	
+	'''
+	PubSubHubbub subscription leases for YouTube upload notifications
+	Lease expiry is recorded from the hub's verification requests
+	Leases are renewed at a random point in the last 10-20% of the lease, with bounded concurrency
+	Failed requests, and requests the hub doesn't verify, are retried with exponential backoff
+	'''
+	
+	# Lease assumed if the hub doesn't report one
+	default_lease_seconds = 432000
+	
+	def __init__(self, bot, *, max_concurrency = 5, retry_delay = 60, max_retry_delay = 6 * 3600, 
+					verification_timeout = 3600):
+		self.bot = bot
+		self.max_concurrency = max_concurrency
+		self.retry_delay = retry_delay
+		self.max_retry_delay = max_retry_delay
+		self.verification_timeout = verification_timeout
+		self.leases = {}
+		self.renewing = set()
+		self.renewal_tasks = set()
+		self.semaphore = asyncio.Semaphore(max_concurrency)
+		self.wake = asyncio.Event()
+	
+	async def load(self, channel_ids):
+		records = await self.bot.db.fetch("SELECT * FROM youtube.upload_subscriptions")
+		records = {record["youtube_channel_id"]: record for record in records}
+		now = datetime.datetime.now(datetime.timezone.utc)
+		for channel_id in channel_ids:
+			lease = SubscriptionLease(channel_id, records.get(channel_id))
+			if not lease.next_renewal:
+				lease.next_renewal = now
+			self.leases[channel_id] = lease
+		self.wake.set()
+	
+	async def save(self, lease):
+		await self.bot.db.execute(
+			"""
+			INSERT INTO youtube.upload_subscriptions (youtube_channel_id, lease_expires, requested_at, 
+														verified_at, next_renewal, failures, last_error)
+			VALUES ($1, $2, $3, $4, $5, $6, $7)
+			ON CONFLICT (youtube_channel_id) DO
+			UPDATE SET lease_expires = $2, requested_at = $3, verified_at = $4, 
+				next_renewal = $5, failures = $6, last_error = $7
+			""", 
+			lease.channel_id, lease.lease_expires, lease.requested_at, lease.verified_at, 
+			lease.next_renewal, lease.failures, lease.last_error
+		)
+	
+	async def request(self, channel_id, mode):
+		headers = {"content-type": "application/x-www-form-urlencoded"}
+		data = {"hub.callback": self.bot.HTTP_SERVER_CALLBACK_URL, "hub.mode": mode, 
+				"hub.topic": "https://www.youtube.com/xml/feeds/videos.xml?channel_id=" + channel_id}
+		async with self.bot.aiohttp_session.post(self.bot.pubsubhubbub_hub_url, headers = headers, 
+													data = data) as resp:
+			if resp.status not in (202, 204):
+				raise HubRequestError(resp.status, await resp.text())
+	
+	async def subscribe(self, channel_id):
+		'''Subscribe to uploads from channel, raising HubRequestError if the hub rejects the request'''
+		# Added before requesting, for the hub's verification request
+		if added := channel_id not in self.leases:
+			self.leases[channel_id] = SubscriptionLease(channel_id)
+		lease = self.leases[channel_id]
+		requested_at = datetime.datetime.now(datetime.timezone.utc)
+		try:
+			await self.request(channel_id, "subscribe")
+		except BaseException:
+			if added:
+				del self.leases[channel_id]
+			raise
+		await self.requested(lease, requested_at)
+	
+	async def unsubscribe(self, channel_id):
+		'''Unsubscribe from uploads from channel, raising HubRequestError if the hub rejects the request'''
+		# Removed before requesting, for the hub's verification request
+		lease = self.leases.pop(channel_id, None)
+		try:
+			await self.request(channel_id, "unsubscribe")
+		except BaseException:
+			if lease:
+				self.leases[channel_id] = lease
+			raise
+		await self.bot.db.execute(
+			"""
+			DELETE FROM youtube.upload_subscriptions
+			WHERE youtube_channel_id = $1
+			""", 
+			channel_id
+		)
+	
+	async def requested(self, lease, requested_at):
+		# Verification can be received before the request completes
+		lease.requested_at = requested_at
+		if lease.pending:
+			# Renewed again if the hub doesn't verify the subscription
+			lease.next_renewal = lease.requested_at + datetime.timedelta(seconds = self.verification_timeout)
+		await self.save(lease)
+		self.wake.set()
+	
+	def verified(self, channel_id, lease_seconds):
+		'''Record verification of a subscription by the hub, scheduling its renewal'''
+		if not (lease := self.leases.get(channel_id)):
+			return
+		try:
+			lease_seconds = int(lease_seconds)
+		except (TypeError, ValueError):
+			lease_seconds = self.default_lease_seconds
+		now = datetime.datetime.now(datetime.timezone.utc)
+		lease.verified_at = now
+		lease.lease_expires = now + datetime.timedelta(seconds = lease_seconds)
+		lease.next_renewal = lease.lease_expires - datetime.timedelta(seconds = lease_seconds * random.uniform(0.1, 0.2))
+		lease.failures = 0
+		lease.last_error = None
+		self.bot.loop.create_task(self.save(lease), name = f"Save YouTube upload subscription {channel_id}")
+		self.wake.set()
+	
+	def pop_due(self):
+		now = datetime.datetime.now(datetime.timezone.utc)
+		due = [lease for channel_id, lease in self.leases.items() 
+				if lease.next_renewal <= now and channel_id not in self.renewing]
+		self.renewing.update(lease.channel_id for lease in due)
+		return due
+	
+	def renew_due(self):
+		'''Start renewing leases that are due, tracking the tasks so they can be cancelled'''
+		for lease in self.pop_due():
+			task = self.bot.loop.create_task(self.renew(lease), 
+												name = f"Renew YouTube upload subscription {lease.channel_id}")
+			self.renewal_tasks.add(task)
+			task.add_done_callback(self.renewal_tasks.discard)
+	
+	def cancel_renewals(self):
+		for task in self.renewal_tasks.copy():
+			task.cancel()
+	
+	async def renew(self, lease):
+		try:
+			async with self.semaphore:
+				if lease.channel_id not in self.leases:
+					# Unsubscribed
+					return
+				if lease.pending:
+					lease.failures += 1
+					lease.last_error = "Subscription not verified by hub"
+				requested_at = datetime.datetime.now(datetime.timezone.utc)
+				try:
+					await self.request(lease.channel_id, "subscribe")
+				except (aiohttp.ClientError, asyncio.TimeoutError, HubRequestError) as e:
+					lease.failures += 1
+					lease.last_error = f"{type(e).__name__}: {e}"
+					delay = min(self.retry_delay * 2 ** (lease.failures - 1), self.max_retry_delay)
+					lease.next_renewal = requested_at + datetime.timedelta(seconds = delay * random.uniform(1, 1.5))
+					await self.save(lease)
+				else:
+					await self.requested(lease, requested_at)
+		except Exception as e:
+			errors_logger.error(f"Error renewing YouTube upload subscription for {lease.channel_id}\n", 
+								exc_info = (type(e), e, e.__traceback__))
+			lease.next_renewal = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds = self.max_retry_delay)
+		finally:
+			self.renewing.discard(lease.channel_id)
+			self.wake.set()
+	
+	async def wait(self):
+		'''Wait until the next renewal is due, or leases change'''
+		now = datetime.datetime.now(datetime.timezone.utc)
+		timeout = None
+		if next_renewals := [lease.next_renewal for channel_id, lease in self.leases.items() 
+								if channel_id not in self.renewing]:
+			timeout = max((min(next_renewals) - now).total_seconds(), 0)
+		self.wake.clear()
+		with contextlib.suppress(asyncio.TimeoutError):
+			await asyncio.wait_for(self.wake.wait(), timeout)
+
@@ -0,0 +1,236 @@
+
+import asyncio
+import collections
+import contextlib
+import functools
+import logging
+import os
+import re
+import threading
+
+from utilities.cache import TTLCache
+
+errors_logger = logging.getLogger("errors")
+
+class AudioCache:
+	
+	'''
+	Content-addressed on-disk audio cache, keyed by extractor and id
+	Audio is streamed to playback while it downloads
+	Least recently used files are removed once the cache exceeds max_size bytes
+	'''
+	
+	def __init__(self, bot, directory, *, max_size = 2 * 1024 ** 3, chunk_size = 64 * 1024):
+		self.bot = bot
+		self.directory = directory
+		self.max_size = max_size
+		self.chunk_size = chunk_size
+		self.entries = collections.OrderedDict()  # key: (path, size)
+		self.size = 0
+		self.downloads = {}
+		self.in_use = collections.Counter()
+		# Extracted info by URL, so repeat plays don't need youtube-dl
+		self.info = TTLCache(max_size = 1024, ttl = 3600)
+		self.hits = self.misses = self.evictions = 0
+		os.makedirs(directory, exist_ok = True)
+		self.load()
+	
+	@staticmethod
+	def get_key(info):
+		return re.sub(r"[^\w-]", '_', f"{info['extractor_key']}-{info['id']}")
+	
+	def load(self):
+		files = list(os.scandir(self.directory))
+		# Remove downloads interrupted by shutdown
+		incomplete = {os.path.splitext(file.name)[0] for file in files if file.name.endswith(".part")}
+		for file in files:
+			if os.path.splitext(file.name)[0] in incomplete:
+				os.remove(file.path)
+		files = [file for file in files if file.is_file() and os.path.splitext(file.name)[0] not in incomplete]
+		for file in sorted(files, key = lambda file: file.stat().st_mtime):
+			self.add(os.path.splitext(file.name)[0], file.path, file.stat().st_size)
+	
+	def add(self, key, path, size):
+		self.entries[key] = (path, size)
+		self.size += size
+		self.evict()
+	
+	def get(self, key):
+		if (entry := self.entries.get(key)) is None:
+			self.misses += 1
+			return None
+		path, _ = entry
+		self.entries.move_to_end(key)
+		# Persist recency across restarts
+		with contextlib.suppress(OSError):
+			os.utime(path)
+		self.hits += 1
+		return path
+	
+	def evict(self):
+		for key in list(self.entries):
+			if self.size <= self.max_size:
+				return
+			if self.in_use[key]:
+				continue
+			path, size = self.entries.pop(key)
+			try:
+				os.remove(path)
+			except FileNotFoundError:
+				pass
+			except OSError:
+				# Open elsewhere
+				self.entries[key] = (path, size)
+				self.entries.move_to_end(key, last = False)
+				continue
+			self.size -= size
+			self.evictions += 1
+	
+	async def open(self, info):
+		'''
+		Open audio for info, downloading it if not cached
+		Returns the key and the path of the cached file, or a pipe streaming the file while it downloads
+		release must be called with the key once playback ends
+		'''
+		key = self.get_key(info)
+		self.in_use[key] += 1
+		try:
+			if path := self.get(key):
+				return key, path
+			if not (download := self.downloads.get(key)):
+				download = AudioDownload(self, key, info)
+				self.downloads[key] = download
+				self.bot.loop.create_task(self.download(download), name = f"Audio download {key}")
+			if download.streamable:
+				await download.wait_for_data()
+				return key, download.open_stream()
+			await download.done.wait()
+			if download.failed:
+				raise download.exception
+			return key, download.path
+		except BaseException:
+			self.release(key)
+			raise
+	
+	def release(self, key):
+		self.in_use[key] -= 1
+		if self.in_use[key] <= 0:
+			del self.in_use[key]
+			self.evict()
+	
+	async def download(self, download):
+		# Marker for interrupted downloads
+		open(download.marker, 'w').close()
+		try:
+			if download.streamable:
+				async with self.bot.aiohttp_session.get(download.info["url"], 
+														headers = download.info.get("http_headers", {})) as resp:
+					resp.raise_for_status()
+					with open(download.path, "wb") as file:
+						async for chunk in resp.content.iter_chunked(self.chunk_size):
+							file.write(chunk)
+							file.flush()
+							download.add_data(len(chunk))
+			else:
+				# Fragmented and segmented protocols are downloaded by youtube-dl
+				func = functools.partial(self.bot.ytdl_download.extract_info, download.info["webpage_url"], download = True)
+				info = await self.bot.loop.run_in_executor(None, func)
+				filename = self.bot.ytdl_download.prepare_filename(info)
+				download.path = os.path.join(self.directory, download.key + os.path.splitext(filename)[1])
+				os.replace(filename, download.path)
+				download.add_data(os.path.getsize(download.path))
+		except Exception as e:
+			download.fail(e)
+			errors_logger.error(f"Failed to download audio for {download.key}\n", 
+								exc_info = (type(e), e, e.__traceback__))
+			for path in (download.path, download.marker):
+				try:
+					os.remove(path)
+				except OSError:
+					pass
+		else:
+			download.finish()
+			os.remove(download.marker)
+			self.add(download.key, download.path, download.size)
+		finally:
+			del self.downloads[download.key]
+	
+	@property
+	def stats(self):
+		return {"files": len(self.entries), "size": self.size, "max_size": self.max_size, 
+				"downloading": len(self.downloads), "in_use": len(self.in_use), 
+				"hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+class AudioDownload:
+	
+	'''
+	Audio file being downloaded into the cache
+	Streams read the file from the start, following it as it's written
+	'''
+	
+	def __init__(self, cache, key, info):
+		self.cache = cache
+		self.key = key
+		self.info = info
+		self.path = os.path.join(cache.directory, f"{key}.{info.get('ext', 'webm')}")
+		self.marker = os.path.join(cache.directory, f"{key}.part")
+		self.streamable = info.get("protocol", "https") in ("http", "https")
+		self.size = 0
+		self.failed = False
+		self.exception = None
+		self.finished = False
+		# Shared with stream threads
+		self.condition = threading.Condition()
+		self.data_available = asyncio.Event()
+		self.done = asyncio.Event()
+	
+	def add_data(self, size):
+		with self.condition:
+			self.size += size
+			self.condition.notify_all()
+		self.data_available.set()
+	
+	def finish(self):
+		with self.condition:
+			self.finished = True
+			self.condition.notify_all()
+		self.data_available.set()
+		self.done.set()
+	
+	def fail(self, exception):
+		with self.condition:
+			self.failed = True
+			self.exception = exception
+			self.condition.notify_all()
+		self.data_available.set()
+		self.done.set()
+	
+	async def wait_for_data(self):
+		await self.data_available.wait()
+		if not self.size and self.failed:
+			raise self.exception
+	
+	def wait_for_position(self, position):
+		'''Wait until data past position is available, returning False at the end of the download'''
+		with self.condition:
+			self.condition.wait_for(lambda: self.size > position or self.finished or self.failed)
+			return self.size > position
+	
+	def open_stream(self):
+		read_fd, write_fd = os.pipe()
+		threading.Thread(target = self.feed, args = (os.fdopen(write_fd, "wb"),), 
+							name = f"Audio stream {self.key}", daemon = True).start()
+		return os.fdopen(read_fd, "rb")
+	
+	def feed(self, pipe):
+		try:
+			with open(self.path, "rb") as file, pipe:
+				while True:
+					if data := file.read(self.cache.chunk_size):
+						pipe.write(data)
+					elif not self.wait_for_position(file.tell()):
+						return
+		except OSError:
+			# Playback stopped and pipe closed
+			pass
+
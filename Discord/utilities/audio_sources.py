@@ -14,12 +14,12 @@ class ModifiedFFmpegPCMAudio(discord.FFmpegPCMAudio):
 	To use ffmpeg log as stderr
 	'''
 	
-	def __init__(self, ctx, source, before_options = None):
+	def __init__(self, ctx, source, before_options = None, pipe = False):
 		self.ctx = ctx
 		self.source = source  # Unnecessary?
 		self.bot = ctx.bot
 		with open(self.bot.data_path + "/logs/ffmpeg.log", 'a') as ffmpeg_log:
-			super().__init__(source, executable = "bin/ffmpeg", 
+			super().__init__(source, executable = "bin/ffmpeg", pipe = pipe, 
 								stderr = ffmpeg_log, before_options = before_options)
 
 
@@ -135,11 +135,15 @@ class YTDLSource(ModifiedPCMVolumeTransformer):
 		
 		self.initialized = False
 		self.filename = None
+		self.pipe = None
+		self.cache_key = None
 		self.previous_played_time = 0
 	
 	async def get_info(self):
-		func = functools.partial(self.bot.ytdl_info.extract_info, self.url, download = False)
-		info = await self.bot.loop.run_in_executor(None, func)
+		if (info := self.bot.audio_cache.info.get(self.url)) is None:
+			func = functools.partial(self.bot.ytdl_info.extract_info, self.url, download = False)
+			info = await self.bot.loop.run_in_executor(None, func)
+			self.bot.audio_cache.info[self.url] = info
 		self.set_info(info)
 	
 	def set_info(self, info):
@@ -153,13 +157,17 @@ class YTDLSource(ModifiedPCMVolumeTransformer):
 		if self.stream:
 			super().__init__(ModifiedFFmpegPCMAudio(self.ctx, self.info["url"]), volume)
 		else:
-			func = functools.partial(self.bot.ytdl_download.extract_info, self.info["webpage_url"], download = True)
-			info = await self.bot.loop.run_in_executor(None, func)
-			self.filename = self.bot.ytdl_download.prepare_filename(info)
+			# Cached file, or pipe streaming the file while it downloads
+			self.cache_key, source = await self.bot.audio_cache.open(self.info)
+			if isinstance(source, str):
+				self.filename = source
+			else:
+				self.pipe = source
 			
 			before_options = "-ss {}".format(self.info["start_time"]) if self.info.get("start_time") else None
 			self.previous_played_time = self.info.get("start_time") if self.info.get("start_time") else 0
-			super().__init__(ModifiedFFmpegPCMAudio(self.ctx, self.filename, before_options = before_options), volume)
+			super().__init__(ModifiedFFmpegPCMAudio(self.ctx, source, before_options = before_options, 
+														pipe = self.pipe is not None), volume)
 		self.initialized = True
 	
 	@classmethod
@@ -171,9 +179,11 @@ class YTDLSource(ModifiedPCMVolumeTransformer):
 	
 	def cleanup(self):
 		if self.initialized: super().cleanup()
-		if self.filename and os.path.exists(self.filename):
-			try:
-				os.remove(self.filename)
-			except PermissionError as e:  # TODO: Fix
-				print(str(e))
+		if self.pipe:
+			self.pipe.close()
+			self.pipe = None
+		# Cached file is kept for replays and repeat plays
+		if self.cache_key:
+			self.bot.loop.call_soon_threadsafe(self.bot.audio_cache.release, self.cache_key)
+			self.cache_key = None
 
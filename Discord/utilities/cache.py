@@ -0,0 +1,89 @@
+
+import collections
+import time
+
+MISSING = object()
+
+class TTLCache:
+	
+	'''
+	Bounded LRU cache with per-entry time to live
+	Least recently used entries are evicted once max_size is reached
+	generation is incremented by every invalidation, even of keys not cached,
+	so values fetched while an invalidation arrives can be discarded with set_if_current
+	'''
+	
+	def __init__(self, max_size = 1024, ttl = None):
+		self.max_size = max_size
+		self.ttl = ttl
+		self._entries = collections.OrderedDict()
+		self.hits = self.misses = self.evictions = self.invalidations = 0
+		self.generation = 0
+	
+	def __len__(self):
+		return len(self._entries)
+	
+	def __contains__(self, key):
+		return self.get(key, MISSING) is not MISSING
+	
+	def __getitem__(self, key):
+		if (value := self.get(key, MISSING)) is MISSING:
+			raise KeyError(key)
+		return value
+	
+	def __setitem__(self, key, value):
+		self.set(key, value)
+	
+	def get(self, key, default = None):
+		try:
+			value, expires_at = self._entries[key]
+		except KeyError:
+			self.misses += 1
+			return default
+		if expires_at is not None and expires_at <= time.monotonic():
+			del self._entries[key]
+			self.misses += 1
+			return default
+		self._entries.move_to_end(key)
+		self.hits += 1
+		return value
+	
+	def set(self, key, value, *, ttl = MISSING):
+		if ttl is MISSING:
+			ttl = self.ttl
+		self._entries[key] = (value, None if ttl is None else time.monotonic() + ttl)
+		self._entries.move_to_end(key)
+		while len(self._entries) > self.max_size:
+			self._entries.popitem(last = False)
+			self.evictions += 1
+	
+	def set_if_current(self, key, value, generation, *, ttl = MISSING):
+		'''
+		Set key to value, fetched after reading generation, if nothing has been invalidated since
+		Returns whether the value was set
+		'''
+		if generation != self.generation:
+			return False
+		self.set(key, value, ttl = ttl)
+		return True
+	
+	def pop(self, key, default = None):
+		self.generation += 1
+		try:
+			value, _ = self._entries.pop(key)
+		except KeyError:
+			return default
+		self.invalidations += 1
+		return value
+	
+	def clear(self):
+		self.generation += 1
+		self.invalidations += len(self._entries)
+		self._entries.clear()
+	
+	@property
+	def stats(self):
+		return {"size": len(self._entries), "max_size": self.max_size, 
+				"hits": self.hits, "misses": self.misses, 
+				"evictions": self.evictions, "invalidations": self.invalidations}
+
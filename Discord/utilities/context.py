@@ -2,8 +2,6 @@
 import discord
 from discord.ext import commands
 
-from operator import attrgetter
-
 class Context(commands.Context):
 	
 	async def embed_reply(self, *args, in_response_to = True, attempt_delete = True, **kwargs):
@@ -58,43 +56,14 @@ class Context(commands.Context):
 	def whisper(self, *args, **kwargs):
 		return self.author.send(*args, **kwargs)
 	
-	# TODO: Improve
 	async def get_permission(self, permission, *, type = "user", user = None, id = None):
 		if not self.guild:
 			return True
-		role_ids = []
-		if type == "user":
-			if user:
-				id = user.id
-			user_setting  = await self.bot.db.fetchval(
-				"""
-				SELECT setting FROM permissions.users
-				WHERE guild_id = $1 AND user_id = $2 AND permission = $3
-				""", 
-				self.guild.id, id, permission
-			)
-			if user_setting is not None:
-				return user_setting
-			if not user:
-				user = self.guild.get_member(id)
-			role_ids.extend(role.id for role in sorted(user.roles, key = attrgetter("position"), reverse = True))
-		elif type == "role":
-			role_ids.append(id)
-		for role_id in role_ids:
-			role_setting = await self.bot.db.fetchval(
-				"""
-				SELECT setting FROM permissions.roles
-				WHERE guild_id = $1 AND role_id = $2 AND permission = $3
-				""", 
-				self.guild.id, role_id, permission
-			)
-			if role_setting is not None:
-				return role_setting
-		return await self.bot.db.fetchval(
-			"""
-			SELECT setting FROM permissions.everyone
-			WHERE guild_id = $1 AND permission = $2
-			""", 
-			self.guild.id, permission
-		)
+		return await self.bot.permission_resolver.resolve(self.guild, permission, type = type, user = user, id = id)
+	
+	async def get_command_permission(self, command, *, user = None, id = None):
+		'''Get permission for a command, falling back to its parents'''
+		if not self.guild:
+			return True
+		return await self.bot.permission_resolver.resolve_command(self.guild, command, user = user, id = id)
 
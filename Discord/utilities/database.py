@@ -10,6 +10,13 @@ BETA = any("beta" in arg.lower() for arg in sys.argv)
 
 @contextlib.asynccontextmanager
 async def create_database_connection():
+	connection = await open_database_connection()
+	try:
+		yield connection
+	finally:
+		await connection.close()
+
+async def open_database_connection():
 	connection = await asyncpg.connect(
 		user = "harmonbot", 
 		password = os.getenv("DATABASE_PASSWORD"), 
@@ -17,10 +24,7 @@ async def create_database_connection():
 		host = os.getenv("POSTGRES_HOST") or "localhost"
 	)
 	await initialize_database_connection(connection)
-	try:
-		yield connection
-	finally:
-		await connection.close()
+	return connection
 
 async def create_database_pool():
 	return await asyncpg.create_pool(
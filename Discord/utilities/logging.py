@@ -1,18 +1,24 @@
 
+import discord
+
 import asyncio
+import contextlib
 import datetime
+import json
 import logging
 import logging.handlers
+import random
 import sys
+import time
 
 from aiohttp.web_log import AccessLogger
 
-from utilities.database import create_database_connection
-
 sys.path.insert(0, "..")
 from units.files import create_folder
 sys.path.pop(0)
 
+errors_logger = logging.getLogger("errors")
+
 class ConsoleLogger(object):
 	
 	'''Console Logger'''
@@ -112,26 +118,267 @@ def initialize_logging(data_path):
 	aiohttp_web_logger_handler.setFormatter(logging.Formatter("%(asctime)s: %(message)s"))
 	aiohttp_web_logger.addHandler(aiohttp_web_logger_handler)
 
-class AiohttpAccessLogger(AccessLogger):
+def replace_null_character(data):
+	data_type = type(data)
+	if data_type is str:
+		return data.replace('\N{NULL}', "")
+	if data_type is dict:
+		return {key: replace_null_character(value) for key, value in data.items()}
+	if data_type is list:
+		return [replace_null_character(item) for item in data]
+	return data
+
+class BufferedDatabaseWriter:
 	
-	def log(self, request, response, time):
-		# super().log(request, response, time)
-		asyncio.create_task(self.log_to_database(request, response, time), name = "Log aiohttp access to database")
+	'''
+	Write-behind buffer for database records
+	Records are queued in memory and written in batches with COPY,
+	when the batch size is reached or the flush interval elapses
+	'''
+	
+	schema = None
+	table = None
+	columns = None
+	name = "Buffered database writer"
+	
+	def __init__(self, bot, *, max_queue_size = 10000, batch_size = 500, flush_interval = 5):
+		self.bot = bot
+		self.queue = asyncio.Queue(maxsize = max_queue_size)
+		self.batch_size = batch_size
+		self.flush_interval = flush_interval
+		self.batch_ready = asyncio.Event()
+		self.lock = asyncio.Lock()
+		self.writer = None
+		# Metrics
+		self.records_queued = 0
+		self.records_written = 0
+		self.records_failed = 0
+		self.batches_written = 0
+		self.queue_size_high_water_mark = 0
+		self.last_flush_duration = None
+	
+	@property
+	def metrics(self):
+		return {"queued": self.records_queued, "written": self.records_written, 
+				"failed": self.records_failed, "batches": self.batches_written, 
+				"queue_size": self.queue.qsize(), "queue_capacity": self.queue.maxsize, 
+				"queue_size_high_water_mark": self.queue_size_high_water_mark, 
+				"last_flush_duration": self.last_flush_duration}
+	
+	def start(self):
+		if not self.writer or self.writer.done():
+			self.writer = self.bot.loop.create_task(self.writer_task(), name = self.name)
+	
+	def record_queued(self):
+		self.records_queued += 1
+		self.queue_size_high_water_mark = max(self.queue_size_high_water_mark, self.queue.qsize())
+		if self.queue.qsize() >= self.batch_size:
+			self.batch_ready.set()
+	
+	async def writer_task(self):
+		while True:
+			if self.queue.qsize() < self.batch_size:
+				self.batch_ready.clear()
+				with contextlib.suppress(asyncio.TimeoutError):
+					await asyncio.wait_for(self.batch_ready.wait(), self.flush_interval)
+			records = self.get_batch()
+			if records:
+				# Shield so that a batch already taken off the queue is always written
+				await asyncio.shield(self.write(records))
+	
+	def get_batch(self):
+		records = []
+		while len(records) < self.batch_size and not self.queue.empty():
+			records.append(self.queue.get_nowait())
+		return records
+	
+	async def flush(self):
+		'''Write all queued records immediately'''
+		while records := self.get_batch():
+			await self.write(records)
+		# Wait for any batch already being written
+		async with self.lock:
+			pass
+	
+	async def write(self, records):
+		async with self.lock:
+			start = time.perf_counter()
+			try:
+				async with self.bot.database_connection_pool.acquire() as connection:
+					await self.copy_records(connection, records)
+			except Exception as e:
+				self.records_failed += len(records)
+				errors_logger.error(f"Failed to write {len(records)} records to {self.schema}.{self.table}\n", 
+									exc_info = (type(e), e, e.__traceback__))
+			else:
+				self.records_written += len(records)
+				self.batches_written += 1
+			finally:
+				self.last_flush_duration = time.perf_counter() - start
+				self.written(records)
+	
+	async def copy_records(self, connection, records):
+		await connection.copy_records_to_table(
+			self.table, schema_name = self.schema, records = records, columns = self.columns
+		)
+	
+	def written(self, records):
+		'''Called after each attempt to write a batch'''
+		pass
+	
+	async def stop(self):
+		'''Stop the writer and drain the queue'''
+		if self.writer:
+			self.writer.cancel()
+			with contextlib.suppress(asyncio.CancelledError):
+				await self.writer
+			self.writer = None
+		await self.flush()
+
+class ChatMessageLogger(BufferedDatabaseWriter):
+	
+	'''Write-behind logger for chat.messages'''
+	
+	schema = "chat"
+	table = "messages"
+	columns = ("created_at", "message_id", 
+				"author_id", "author_name", "author_discriminator", "author_display_name", 
+				"direct_message", "channel_id", "channel_name", "guild_id", "guild_name", 
+				"message_content", "embeds")
+	name = "Chat message logger"
+	
+	def __init__(self, bot, **kwargs):
+		super().__init__(bot, **kwargs)
+		self.pending_message_ids = set()
+		self.backpressure_waits = 0
+	
+	@property
+	def metrics(self):
+		return {**super().metrics, "backpressure_waits": self.backpressure_waits}
+	
+	async def log(self, message):
+		author = message.author
+		channel = message.channel
+		guild = message.guild
+		if channel.type is discord.ChannelType.private:
+			record = (message.created_at.replace(tzinfo = datetime.timezone.utc), message.id, 
+						author.id, author.name, author.discriminator, author.display_name, 
+						True, None, None, None, None, 
+						message.content.replace('\N{NULL}', ""), 
+						[replace_null_character(embed.to_dict()) for embed in message.embeds])
+		else:
+			record = (message.created_at.replace(tzinfo = datetime.timezone.utc), message.id, 
+						author.id, author.name, author.discriminator, author.display_name, 
+						False, channel.id, channel.name, guild.id, guild.name, 
+						message.content.replace('\N{NULL}', ""), 
+						[replace_null_character(embed.to_dict()) for embed in message.embeds])
+		self.pending_message_ids.add(message.id)
+		try:
+			self.queue.put_nowait(record)
+		except asyncio.QueueFull:
+			# Apply backpressure rather than dropping messages
+			self.backpressure_waits += 1
+			await self.queue.put(record)
+		self.record_queued()
 	
-	async def log_to_database(self, request, response, time):
-		async with create_database_connection() as connection:
+	async def copy_records(self, connection, records):
+		async with connection.transaction():
+			# COPY into a staging table, so that a duplicate message ID
+			# doesn't fail the entire batch
+			# Embeds are staged as JSON text, as COPY uses the binary format
+			# and the jsonb codec only has a text format encoder
 			await connection.execute(
 				"""
-				INSERT INTO aiohttp.access_log
-				VALUES ($1, $2, $3, $4, $5, $6, $7)
-				""", 
-				datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(seconds = time), 
-				self._format_a(request, response, time), 
-				self._format_r(request, response, time), 
-				response.status, response.body_length, 
-				self._format_i("Referer", request, response, time), 
-				self._format_i("User-Agent", request, response, time).encode("UTF-8", "backslashreplace").decode("UTF-8")
+				CREATE TEMPORARY TABLE chat_messages_staging
+				(LIKE chat.messages INCLUDING DEFAULTS)
+				ON COMMIT DROP
+				"""
+			)
+			await connection.execute("ALTER TABLE chat_messages_staging ALTER COLUMN embeds TYPE TEXT")
+			await connection.copy_records_to_table(
+				"chat_messages_staging", 
+				records = [record[:-1] + (json.dumps(record[-1]),) for record in records], 
+				columns = self.columns
 			)
+			await connection.execute(
+				"""
+				INSERT INTO chat.messages
+				SELECT created_at, message_id, 
+					author_id, author_name, author_discriminator, author_display_name, 
+					direct_message, channel_id, channel_name, guild_id, guild_name, 
+					message_content, ARRAY(SELECT jsonb_array_elements(CAST(embeds AS JSONB)))
+				FROM chat_messages_staging
+				ON CONFLICT (message_id) DO NOTHING
+				"""
+			)
+			# Dropped explicitly too, in case this is a nested transaction
+			await connection.execute("DROP TABLE chat_messages_staging")
+	
+	def written(self, records):
+		self.pending_message_ids.difference_update(record[1] for record in records)
+
+class AiohttpAccessLogSink(BufferedDatabaseWriter):
+	
+	'''
+	Write-behind sink for aiohttp.access_log
+	overflow_policy determines what happens when the buffer is full:
+	"drop_newest" drops new entries, "drop_oldest" drops the oldest buffered entries,
+	and "sample" keeps only sample_rate of new entries once the buffer is
+	sample_threshold full, then drops new entries when full
+	'''
+	
+	schema = "aiohttp"
+	table = "access_log"
+	columns = ("request_start_timestamp", "remote_ip_address", "request_first_line", 
+				"response_status_code", "response_bytes_size", "request_referer", "request_user_agent")
+	name = "aiohttp access log sink"
+	overflow_policies = ("drop_newest", "drop_oldest", "sample")
+	
+	def __init__(self, bot, *, overflow_policy = "sample", sample_rate = 0.1, sample_threshold = 0.8, **kwargs):
+		if overflow_policy not in self.overflow_policies:
+			raise ValueError(f"Invalid overflow policy: {overflow_policy}")
+		super().__init__(bot, **kwargs)
+		self.overflow_policy = overflow_policy
+		self.sample_rate = sample_rate
+		self.sample_threshold = sample_threshold
+		self.records_dropped = 0
+		self.records_sampled_out = 0
+	
+	@property
+	def metrics(self):
+		return {**super().metrics, "dropped": self.records_dropped, "sampled_out": self.records_sampled_out}
+	
+	def log(self, record):
+		if (self.overflow_policy == "sample" and 
+			self.queue.qsize() >= self.queue.maxsize * self.sample_threshold and 
+			random.random() >= self.sample_rate):
+			self.records_sampled_out += 1
+			return
+		if self.queue.full():
+			if self.overflow_policy != "drop_oldest":
+				self.records_dropped += 1
+				return
+			self.queue.get_nowait()
+			self.records_dropped += 1
+		self.queue.put_nowait(record)
+		self.record_queued()
+
+class AiohttpAccessLogger(AccessLogger):
+	
+	'''Logs to the AiohttpAccessLogSink of the web application'''
+	
+	def log(self, request, response, time):
+		# super().log(request, response, time)
+		if not (sink := request.app.get("access_log_sink")):
+			return
+		sink.log((
+			datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(seconds = time), 
+			self._format_a(request, response, time), 
+			self._format_r(request, response, time), 
+			response.status, response.body_length, 
+			self._format_i("Referer", request, response, time), 
+			self._format_i("User-Agent", request, response, time).encode("UTF-8", "backslashreplace").decode("UTF-8")
+		))
 
 
 async def initialize_aiohttp_access_logging(database):
@@ -139,7 +386,8 @@ async def initialize_aiohttp_access_logging(database):
 	await database.execute(
 		"""
 		CREATE TABLE IF NOT EXISTS aiohttp.access_log (
-			request_start_timestamp		TIMESTAMPTZ PRIMARY KEY, 
+			request_id					BIGSERIAL PRIMARY KEY, 
+			request_start_timestamp		TIMESTAMPTZ, 
 			remote_ip_address			TEXT, 
 			request_first_line			TEXT, 
 			response_status_code		INT, 
@@ -149,4 +397,26 @@ async def initialize_aiohttp_access_logging(database):
 		)
 		"""
 	)
+	# Migrate from being keyed by timestamp, which concurrent requests can collide on
+	await database.execute(
+		"""
+		DO $$
+		BEGIN
+			IF NOT EXISTS (
+				SELECT FROM information_schema.columns
+				WHERE table_schema = 'aiohttp' AND table_name = 'access_log' AND column_name = 'request_id'
+			) THEN
+				ALTER TABLE aiohttp.access_log DROP CONSTRAINT access_log_pkey;
+				ALTER TABLE aiohttp.access_log ADD COLUMN request_id BIGSERIAL PRIMARY KEY;
+			END IF;
+		END
+		$$
+		"""
+	)
+	await database.execute(
+		"""
+		CREATE INDEX IF NOT EXISTS access_log_request_start_timestamp_index
+		ON aiohttp.access_log (request_start_timestamp)
+		"""
+	)
 
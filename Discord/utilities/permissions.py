@@ -0,0 +1,110 @@
+
+import asyncio
+from operator import attrgetter
+
+from utilities.cache import TTLCache
+
+class GuildPermissions:
+	
+	'''
+	Permission settings for a guild
+	Indexed by (permission, target), where target is ("user", user_id),
+	("role", role_id), or ("everyone", None)
+	'''
+	
+	def __init__(self, records):
+		self.settings = {}
+		for record in records:
+			# NULL settings are equivalent to no setting
+			if record["setting"] is not None:
+				self.settings[(record["permission"], (record["type"], record["id"]))] = record["setting"]
+	
+	def get(self, permission, *, user_id = None, role_ids = ()):
+		if user_id is not None:
+			if (setting := self.settings.get((permission, ("user", user_id)))) is not None:
+				return setting
+		for role_id in role_ids:
+			if (setting := self.settings.get((permission, ("role", role_id)))) is not None:
+				return setting
+		return self.settings.get((permission, ("everyone", None)))
+	
+	def get_for_command(self, command, *, user_id = None, role_ids = ()):
+		'''Resolve permission for a command, falling back to its parents'''
+		while ((setting := self.get(command.name, user_id = user_id, role_ids = role_ids)) is None
+				and command.parent is not None):
+			command = command.parent
+		return setting
+
+class PermissionResolver:
+	
+	'''
+	Resolves permissions in memory from the full permission set of each guild,
+	loaded with a single query and cached until invalidated
+	'''
+	
+	def __init__(self, bot, *, max_guilds = 1000, ttl = 3600):
+		self.bot = bot
+		self.guilds = TTLCache(max_size = max_guilds, ttl = ttl)
+		self.locks = {}
+	
+	async def get_guild_permissions(self, guild_id):
+		if (guild_permissions := self.guilds.get(guild_id)) is not None:
+			return guild_permissions
+		# Prevent concurrent loads for the same guild
+		lock = self.locks.setdefault(guild_id, asyncio.Lock())
+		async with lock:
+			if (guild_permissions := self.guilds.get(guild_id)) is None:
+				# Not cached if invalidated during the load
+				generation = self.guilds.generation
+				records = await self.bot.db.fetch(
+					"""
+					SELECT 'user' AS type, user_id AS id, permission, setting
+					FROM permissions.users
+					WHERE guild_id = $1
+					UNION ALL
+					SELECT 'role', role_id, permission, setting
+					FROM permissions.roles
+					WHERE guild_id = $1
+					UNION ALL
+					SELECT 'everyone', NULL, permission, setting
+					FROM permissions.everyone
+					WHERE guild_id = $1
+					""", 
+					guild_id
+				)
+				guild_permissions = GuildPermissions(records)
+				self.guilds.set_if_current(guild_id, guild_permissions, generation)
+		self.locks.pop(guild_id, None)
+		return guild_permissions
+	
+	def invalidate(self, guild_id):
+		self.guilds.pop(guild_id)
+	
+	@staticmethod
+	def get_role_ids(member):
+		# Highest role first
+		return [role.id for role in sorted(member.roles, key = attrgetter("position"), reverse = True)]
+	
+	async def resolve(self, guild, permission, *, type = "user", user = None, id = None):
+		guild_permissions = await self.get_guild_permissions(guild.id)
+		if type == "user":
+			if user:
+				id = user.id
+			if (setting := guild_permissions.get(permission, user_id = id)) is not None:
+				return setting
+			if not user:
+				user = guild.get_member(id)
+			return guild_permissions.get(permission, role_ids = self.get_role_ids(user) if user else ())
+		if type == "role":
+			return guild_permissions.get(permission, role_ids = (id,))
+		return guild_permissions.get(permission)
+	
+	async def resolve_command(self, guild, command, *, user = None, id = None):
+		guild_permissions = await self.get_guild_permissions(guild.id)
+		if user:
+			id = user.id
+		else:
+			user = guild.get_member(id)
+		return guild_permissions.get_for_command(command, user_id = id, 
+													role_ids = self.get_role_ids(user) if user else ())
+
@@ -0,0 +1,143 @@
+
+import asyncio
+import collections
+import concurrent.futures
+import multiprocessing
+import os
+
+from utilities.cache import MISSING
+
+def worker_main(connection):
+	while True:
+		try:
+			job = connection.recv()
+		except (EOFError, OSError):
+			return
+		if job is None:
+			return
+		function, args, kwargs = job
+		try:
+			result = (True, function(*args, **kwargs))
+		except Exception as e:
+			result = (False, e)
+		try:
+			connection.send(result)
+		except Exception as e:
+			# Result or exception could not be pickled
+			connection.send((False, RuntimeError(f"{type(e).__name__}: {e}")))
+
+class Worker:
+	
+	def __init__(self, context):
+		self.connection, child_connection = context.Pipe()
+		self.process = context.Process(target = worker_main, args = (child_connection,), daemon = True)
+		self.process.start()
+		child_connection.close()
+		self.tasks_completed = 0
+	
+	def stop(self):
+		try:
+			self.connection.send(None)
+		except (BrokenPipeError, OSError):
+			self.kill()
+	
+	def kill(self):
+		if self.process.is_alive():
+			self.process.kill()
+
+class ProcessPool:
+	
+	'''
+	Bounded pool of long-lived worker processes for CPU-bound jobs
+	Workers still running a job after its timeout are killed and replaced
+	Workers are recycled after max_tasks_per_worker jobs
+	'''
+	
+	def __init__(self, *, max_workers = None, max_tasks_per_worker = 100, timeout = 10):
+		self.max_workers = max_workers or min(4, os.cpu_count() or 1)
+		self.max_tasks_per_worker = max_tasks_per_worker
+		self.timeout = timeout
+		# Spawned workers don't inherit the bot's event loop, threads, or connections
+		self.context = multiprocessing.get_context("spawn")
+		self.semaphore = asyncio.Semaphore(self.max_workers)
+		# Threads wait on worker results, so the event loop isn't blocked
+		self.executor = concurrent.futures.ThreadPoolExecutor(max_workers = self.max_workers, 
+																thread_name_prefix = "Process pool")
+		self.idle = collections.deque()
+		self.busy = set()
+		self.closed = False
+		self.tasks_submitted = self.tasks_completed = self.tasks_timed_out = 0
+		self.workers_started = self.workers_killed = self.workers_recycled = 0
+	
+	def get_worker(self):
+		while self.idle:
+			worker = self.idle.popleft()
+			if worker.process.is_alive():
+				return worker
+		self.workers_started += 1
+		return Worker(self.context)
+	
+	def kill_worker(self, worker):
+		worker.kill()
+		self.workers_killed += 1
+	
+	async def submit(self, function, *args, timeout = MISSING, **kwargs):
+		'''
+		Run function(*args, **kwargs) in a worker process and return its result
+		function, its arguments, and its result must be picklable
+		Exceptions raised by function are re-raised
+		Raises asyncio.TimeoutError if the job takes longer than timeout seconds
+		'''
+		if self.closed:
+			raise RuntimeError("Process pool is closed")
+		if timeout is MISSING:
+			timeout = self.timeout
+		self.tasks_submitted += 1
+		async with self.semaphore:
+			loop = asyncio.get_running_loop()
+			worker = self.get_worker()
+			self.busy.add(worker)
+			try:
+				worker.connection.send((function, args, kwargs))
+				success, result = await asyncio.wait_for(loop.run_in_executor(self.executor, worker.connection.recv), 
+															timeout = timeout)
+			except asyncio.TimeoutError:
+				self.tasks_timed_out += 1
+				self.kill_worker(worker)
+				raise
+			except (EOFError, OSError) as e:
+				# Worker exited while running the job
+				self.kill_worker(worker)
+				raise RuntimeError("Worker process exited unexpectedly") from e
+			except BaseException:
+				# Worker is still running the cancelled job
+				self.kill_worker(worker)
+				raise
+			finally:
+				self.busy.discard(worker)
+			self.tasks_completed += 1
+			worker.tasks_completed += 1
+			if worker.tasks_completed >= self.max_tasks_per_worker or self.closed:
+				worker.stop()
+				self.workers_recycled += 1
+			else:
+				self.idle.append(worker)
+		if success:
+			return result
+		raise result
+	
+	def close(self):
+		self.closed = True
+		while self.idle:
+			self.idle.popleft().stop()
+		for worker in self.busy:
+			self.kill_worker(worker)
+		self.executor.shutdown(wait = False)
+	
+	@property
+	def stats(self):
+		return {"max_workers": self.max_workers, "idle": len(self.idle), "busy": len(self.busy), 
+				"tasks_submitted": self.tasks_submitted, "tasks_completed": self.tasks_completed, 
+				"tasks_timed_out": self.tasks_timed_out, "workers_started": self.workers_started, 
+				"workers_killed": self.workers_killed, "workers_recycled": self.workers_recycled}
+
@@ -0,0 +1,125 @@
+
+import asyncio
+import collections
+import contextlib
+import logging
+
+errors_logger = logging.getLogger("errors")
+
+class CommandStatistics:
+	
+	'''
+	Aggregates command invocation counts in memory
+	Deltas are flushed in a single transaction every flush_interval seconds
+	'''
+	
+	def __init__(self, bot, *, flush_interval = 60, read_through = True):
+		self.bot = bot
+		self.flush_interval = flush_interval
+		# Include unflushed deltas when reading stats
+		self.read_through = read_through
+		self.commands_invoked = 0
+		self.menu_reactions = 0
+		self.command_invokes = collections.Counter()
+		self.user_commands_invoked = collections.Counter()
+		# Deltas being flushed
+		self.in_flight = (0, collections.Counter(), collections.Counter())
+		self.lock = asyncio.Lock()
+		self.flusher = None
+	
+	def start(self):
+		if not self.flusher or self.flusher.done():
+			self.flusher = self.bot.loop.create_task(self.flusher_task(), name = "Command statistics flusher")
+	
+	def record_command(self, command_name, user_id):
+		self.commands_invoked += 1
+		self.command_invokes[command_name] += 1
+		self.user_commands_invoked[user_id] += 1
+	
+	def record_menu_reaction(self):
+		self.menu_reactions += 1
+	
+	# Unflushed deltas, for read-through
+	
+	def unflushed_commands_invoked(self):
+		if not self.read_through:
+			return 0
+		return self.commands_invoked + self.in_flight[0]
+	
+	def unflushed_command_invokes(self):
+		if not self.read_through:
+			return collections.Counter()
+		return self.command_invokes + self.in_flight[1]
+	
+	def unflushed_user_commands_invoked(self, user_id):
+		if not self.read_through:
+			return 0
+		return self.user_commands_invoked[user_id] + self.in_flight[2][user_id]
+	
+	async def flusher_task(self):
+		while True:
+			await asyncio.sleep(self.flush_interval)
+			# Shield so that deltas taken for a flush are always written
+			await asyncio.shield(self.flush())
+	
+	async def flush(self):
+		async with self.lock:
+			if not (self.commands_invoked or self.menu_reactions):
+				return
+			commands_invoked, self.commands_invoked = self.commands_invoked, 0
+			menu_reactions, self.menu_reactions = self.menu_reactions, 0
+			command_invokes, self.command_invokes = self.command_invokes, collections.Counter()
+			user_commands_invoked, self.user_commands_invoked = self.user_commands_invoked, collections.Counter()
+			self.in_flight = (commands_invoked, command_invokes, user_commands_invoked)
+			try:
+				async with self.bot.database_connection_pool.acquire() as connection:
+					async with connection.transaction():
+						await connection.execute(
+							"""
+							UPDATE meta.stats
+							SET commands_invoked = commands_invoked + $2, 
+								menu_reactions = menu_reactions + $3
+							WHERE timestamp = $1
+							""", 
+							self.bot.online_time, commands_invoked, menu_reactions
+						)
+						if command_invokes:
+							await connection.execute(
+								"""
+								INSERT INTO meta.commands_invoked (command, invokes)
+								SELECT * FROM UNNEST($1::TEXT[], $2::BIGINT[])
+								ON CONFLICT (command) DO
+								UPDATE SET invokes = commands_invoked.invokes + EXCLUDED.invokes
+								""", 
+								list(command_invokes.keys()), list(command_invokes.values())
+							)
+						if user_commands_invoked:
+							await connection.execute(
+								"""
+								INSERT INTO users.stats (user_id, commands_invoked)
+								SELECT * FROM UNNEST($1::BIGINT[], $2::INT[])
+								ON CONFLICT (user_id) DO
+								UPDATE SET commands_invoked = stats.commands_invoked + EXCLUDED.commands_invoked
+								""", 
+								list(user_commands_invoked.keys()), list(user_commands_invoked.values())
+							)
+			except Exception as e:
+				# Restore deltas to retry on next flush
+				self.commands_invoked += commands_invoked
+				self.menu_reactions += menu_reactions
+				self.command_invokes.update(command_invokes)
+				self.user_commands_invoked.update(user_commands_invoked)
+				errors_logger.error("Failed to flush command statistics\n", 
+									exc_info = (type(e), e, e.__traceback__))
+			finally:
+				self.in_flight = (0, collections.Counter(), collections.Counter())
+	
+	async def stop(self):
+		'''Stop the flusher and flush remaining deltas'''
+		if self.flusher:
+			self.flusher.cancel()
+			with contextlib.suppress(asyncio.CancelledError):
+				await self.flusher
+			self.flusher = None
+		await self.flush()
+
@@ -0,0 +1,12 @@
+
+import pytest
+
+def pytest_collection_modifyitems(config, items):
+	'''Skip benchmarks if pytest-benchmark isn't installed, rather than erroring on the missing fixture'''
+	if config.pluginmanager.hasplugin("benchmark"):
+		return
+	skip = pytest.mark.skip(reason = "pytest-benchmark not installed")
+	for item in items:
+		if "benchmark" in getattr(item, "fixturenames", ()):
+			item.add_marker(skip)
+
@@ -0,0 +1,52 @@
+
+import unittest
+
+import math
+
+from hypothesis import given
+from hypothesis.strategies import integers
+
+from units.arithmetic import evaluate
+from units.errors import UnitExecutionError, UnitOutputError
+
+class TestEvaluate(unittest.TestCase):
+	
+	@given(integers(), integers(), integers(min_value = 1))
+	def test_operators(self, operand_1, operand_2, operand_3):
+		self.assertEqual(evaluate(f"{operand_1} + {operand_2} * {operand_3}"), operand_1 + operand_2 * operand_3)
+		self.assertEqual(evaluate(f"({operand_1} - {operand_2}) / {operand_3}"), (operand_1 - operand_2) / operand_3)
+		self.assertEqual(evaluate(f"{operand_1} // {operand_3} % {operand_3}"), operand_1 // operand_3 % operand_3)
+	
+	def test_caret_is_power(self):
+		self.assertEqual(evaluate("2^10"), 1024)
+		self.assertEqual(evaluate("2^3^2"), 512)
+	
+	def test_names(self):
+		self.assertEqual(evaluate("e"), math.e)
+		self.assertEqual(evaluate("sec(0)"), 1)
+		self.assertEqual(evaluate("ceil(pi)"), 4)
+		self.assertEqual(evaluate("log(8, 2)"), 3)
+	
+	def test_unsupported(self):
+		for expression in ("x + 1", "__import__('os')", "(1).real", "[1] * 10", "sin(x = 1)", "'a'", "1 +"):
+			with self.assertRaises(UnitExecutionError):
+				evaluate(expression)
+	
+	def test_limits(self):
+		for expression in ("9**9**9", "2**2**2**2**2", "factorial(10000)", "10.0**400", "exp(1000)", 
+							"(2**5000) * (2**5001)"):
+			with self.assertRaises(UnitOutputError):
+				evaluate(expression)
+		with self.assertRaises(UnitExecutionError):
+			evaluate("1 + " * 1000 + "1")
+		for expression in ("round(1, -10**8)", "round(1.5, 10**8)", "factorial(100000.0)", "factorial(5.5)"):
+			with self.assertRaises(UnitExecutionError):
+				evaluate(expression)
+		self.assertEqual(evaluate("round(12345, -2)"), 12300)
+	
+	def test_errors(self):
+		with self.assertRaises(UnitExecutionError):
+			evaluate("1 / 0")
+		with self.assertRaises(UnitExecutionError):
+			evaluate("sqrt(-1)")
+
@@ -1,14 +1,16 @@
 
 import unittest
 
+import concurrent.futures
 import math
+import random
 
 from hypothesis import assume, given
 from hypothesis.strategies import characters, integers, lists, text
 
 import pyparsing
 
-from units.calculation import calculate
+from units.calculation import calculate, compile_expression, evaluate_program
 
 class TestCalculate(unittest.TestCase):
 	
@@ -98,4 +100,40 @@ class TestCalculate(unittest.TestCase):
 	@given(integers(min_value = 0))
 	def test_division_by_zero(self, dividend):
 		self.assertRaises(ZeroDivisionError, calculate, f"{dividend}/0")
+	
+	def test_nested_parentheses(self):
+		self.assertEqual(calculate("(" * 50 + "1+2" + ")*3" * 50), 3 ** 51)
+		self.assertEqual(calculate("(" * 1000 + "1+2" + ")*3" * 1000), 3 ** 1001)
+		self.assertEqual(calculate("1-(" * 10000 + "1" + ")" * 10000), 1)
+		self.assertEqual(calculate("(" * 100000 + "1" + ")" * 100000), 1)
+		self.assertRaises(pyparsing.ParseException, calculate, "(" * 1000 + "1" + ")" * 999)
+	
+	def test_compiled_programs_immutable(self):
+		program = compile_expression("(1+2)*3")
+		self.assertEqual(program, (1, 2, '+', 3, '*'))
+		self.assertIsInstance(program, tuple)
+		self.assertEqual(evaluate_program(program), 9)
+		self.assertEqual(evaluate_program(program), 9)
+	
+	def test_concurrent(self):
+		compile_expression.cache_clear()
+		operands = [(random.randrange(1000), random.randrange(1000), random.randrange(1, 1000)) 
+					for _ in range(2000)]
+		def check(operands):
+			operand_1, operand_2, operand_3 = operands
+			return (calculate(f"({operand_1}+{operand_2})*{operand_3}-{operand_1}/{operand_3}") == 
+					(operand_1 + operand_2) * operand_3 - operand_1 / operand_3)
+		with concurrent.futures.ThreadPoolExecutor(max_workers = 8) as executor:
+			self.assertTrue(all(executor.map(check, operands)))
+
+EXPRESSION = "(12+34)*56-78/(9+10)*11"
+
+def test_benchmark_calculate(benchmark):
+	benchmark.group = "calculate"
+	assert benchmark(calculate, EXPRESSION) == eval(EXPRESSION)
+
+def test_benchmark_calculate_uncached(benchmark):
+	benchmark.group = "calculate"
+	compile = compile_expression.__wrapped__
+	assert benchmark(lambda: evaluate_program(compile(EXPRESSION))) == eval(EXPRESSION)
 
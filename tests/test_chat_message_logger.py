@@ -0,0 +1,85 @@
+
+import unittest
+
+import datetime
+import os
+import sys
+
+import pytest
+
+asyncpg = pytest.importorskip("asyncpg")
+pytest.importorskip("discord")
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "Discord"))
+from utilities.database import open_database_connection
+from utilities.logging import ChatMessageLogger
+sys.path.pop(0)
+
+class TestChatMessageLogger(unittest.IsolatedAsyncioTestCase):
+	
+	async def asyncSetUp(self):
+		# Uses a connection with the same jsonb codec as the bot's pool
+		try:
+			self.connection = await open_database_connection()
+		except (OSError, asyncpg.PostgresError) as e:
+			self.skipTest(f"Database unavailable: {e}")
+		# Everything is rolled back after each test
+		self.transaction = self.connection.transaction()
+		await self.transaction.start()
+		await self.connection.execute("CREATE SCHEMA IF NOT EXISTS chat")
+		await self.connection.execute(
+			"""
+			CREATE TABLE IF NOT EXISTS chat.messages (
+				created_at				TIMESTAMPTZ, 
+				message_id				BIGINT PRIMARY KEY, 
+				author_id				BIGINT, 
+				author_name				TEXT, 
+				author_discriminator	TEXT, 
+				author_display_name		TEXT, 
+				direct_message			BOOL, 
+				channel_id				BIGINT, 
+				channel_name			TEXT, 
+				guild_id				BIGINT, 
+				guild_name				TEXT, 
+				message_content			TEXT, 
+				embeds					JSONB []
+			)
+			"""
+		)
+		self.logger = ChatMessageLogger(None)
+	
+	async def asyncTearDown(self):
+		await self.transaction.rollback()
+		await self.connection.close()
+	
+	def create_record(self, message_id, content, embeds):
+		return (datetime.datetime.now(datetime.timezone.utc), message_id, 
+				1, "author", "0001", "author", 
+				False, 2, "channel", 3, "guild", 
+				content, embeds)
+	
+	async def test_copy_records(self):
+		embeds = [{"title": "Title", "fields": [{"name": "Name", "value": "Value"}]}, {"description": "Description"}]
+		message_ids = (-1, -2, -3)
+		await self.logger.copy_records(self.connection, [
+			self.create_record(message_ids[0], "embeds", embeds), 
+			self.create_record(message_ids[1], "no embeds", []), 
+			self.create_record(message_ids[2], "duplicate", [])
+		])
+		# Duplicate message IDs don't fail the batch
+		await self.logger.copy_records(self.connection, [
+			self.create_record(message_ids[2], "duplicate again", []), 
+			self.create_record(-4, "new", [])
+		])
+		rows = await self.connection.fetch(
+			"""
+			SELECT message_id, message_content, embeds FROM chat.messages
+			WHERE message_id = ANY($1)
+			ORDER BY message_id DESC
+			""", 
+			message_ids + (-4,)
+		)
+		self.assertEqual([tuple(row) for row in rows], [
+			(-1, "embeds", embeds), (-2, "no embeds", []), (-3, "duplicate", []), (-4, "new", [])
+		])
+
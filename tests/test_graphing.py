@@ -0,0 +1,65 @@
+
+import unittest
+
+import numpy
+
+from units.graphing import normalize_graph, parse_graph, parse_jointplot_arguments, render_graph, sample_curve
+from units.errors import UnitExecutionError
+
+def count_breaks(x, y):
+	'''Count NaNs inserted between defined points'''
+	undefined = numpy.isnan(x) | numpy.isnan(y)
+	return int(numpy.sum(undefined[1:-1] & ~undefined[:-2] & ~undefined[2:]))
+
+class TestGraphing(unittest.TestCase):
+	
+	def sample(self, mode, expression, lower, upper):
+		return sample_curve(mode, parse_graph(mode, [expression])[0], lower, upper)
+	
+	def test_unsupported(self):
+		for expression in ("__import__('os')", "x.real", "y", "sin(x, 2)", "'a'", "x, x", "lambda: x", "[x]"):
+			with self.assertRaises(UnitExecutionError):
+				parse_graph("cartesian", [expression])
+		with self.assertRaises(UnitExecutionError):
+			parse_graph("parametric", ["cos(t)"])
+		with self.assertRaises(UnitExecutionError):
+			parse_graph("cartesian", ["x"] * 6)
+	
+	def test_normalized(self):
+		self.assertEqual(normalize_graph("cartesian", ["x^2 + 1"]), normalize_graph("cartesian", ["x ** 2+1"]))
+		self.assertNotEqual(normalize_graph("cartesian", ["2"]), normalize_graph("polar", ["2"]))
+	
+	def test_continuous(self):
+		for expression in ("sin(x)", "x^3", "exp(x)", "2"):
+			x, y = self.sample("cartesian", expression, -5, 5)
+			self.assertEqual(count_breaks(x, y), 0, expression)
+		x, y = self.sample("parametric", "cos(t), sin(t)", 0, 2 * numpy.pi)
+		numpy.testing.assert_allclose(numpy.hypot(x, y), 1)
+	
+	def test_discontinuities(self):
+		# Asymptotes at ±pi / 2 and ±3 pi / 2
+		x, y = self.sample("cartesian", "tan(x)", -5, 5)
+		self.assertEqual(count_breaks(x, y), 4)
+		# Jumps at each integer
+		x, y = self.sample("cartesian", "floor(x)", -4.5, 4.5)
+		self.assertEqual(count_breaks(x, y), 9)
+	
+	def test_adaptive_sampling(self):
+		x, _ = self.sample("cartesian", "1/x", -1, 1)
+		# Samples are concentrated near the asymptote
+		self.assertGreater(numpy.sum(numpy.abs(x) < 0.01), numpy.sum((0.5 < x) & (x < 0.51)) * 5)
+	
+	def test_render(self):
+		for mode, expressions in (("cartesian", ["tan(x)", "x^2"]), ("parametric", ["cos(3*t), sin(2*t)"]), 
+									("polar", ["sin(2*theta)"])):
+			self.assertTrue(render_graph(mode, expressions, 0, 6).startswith(b"\x89PNG"))
+		with self.assertRaises(UnitExecutionError):
+			render_graph("cartesian", ["x"], 1, 0)
+	
+	def test_jointplot_arguments(self):
+		self.assertEqual(parse_jointplot_arguments("x=1,2 y=3,4.5 kind=hex color=#00ff00"), 
+							{'x': [1, 2], 'y': [3, 4.5], "kind": "hex", "color": "#00ff00"})
+		for arguments in ("x=1,2", "x=1,2 y=3", "x=1,a y=1,2", "x=1 y=2 kind=pie", "x=1 y=2 data=__import__('os')"):
+			with self.assertRaises(UnitExecutionError):
+				parse_jointplot_arguments(arguments)
+
@@ -0,0 +1,138 @@
+
+import unittest
+
+import io
+
+from PIL import Image
+import pytest
+
+from units.maze import Direction, generate_maze, GENERATORS, render_maze, render_maze_image, Viewport
+from units.errors import UnitExecutionError
+
+class TestMaze(unittest.TestCase):
+	
+	def assert_perfect(self, connections):
+		'''Assert that connections are symmetric, in bounds, and form a spanning tree'''
+		rows, columns = connections.shape
+		edges = 0
+		for row in range(rows):
+			for column in range(columns):
+				for direction in Direction:
+					if connections[row, column] & direction.bit:
+						vertical, horizontal = direction.vector
+						self.assertTrue(0 <= row + vertical < rows and 0 <= column + horizontal < columns)
+						self.assertTrue(connections[row + vertical, column + horizontal] & direction.reverse.bit)
+						edges += 1
+		self.assertEqual(edges // 2, rows * columns - 1)
+		reached = {(0, 0)}
+		to_visit = [(0, 0)]
+		while to_visit:
+			row, column = to_visit.pop()
+			for direction in Direction:
+				vertical, horizontal = direction.vector
+				cell = (row + vertical, column + horizontal)
+				if connections[row, column] & direction.bit and cell not in reached:
+					reached.add(cell)
+					to_visit.append(cell)
+		self.assertEqual(len(reached), rows * columns)
+	
+	def test_perfect(self):
+		for algorithm in GENERATORS:
+			for rows, columns in ((1, 1), (1, 8), (8, 1), (13, 21)):
+				with self.subTest(algorithm = algorithm, rows = rows, columns = columns):
+					self.assert_perfect(generate_maze(rows, columns, algorithm, seed = 1))
+	
+	def test_reproducible(self):
+		for algorithm in GENERATORS:
+			with self.subTest(algorithm = algorithm):
+				self.assertTrue((generate_maze(20, 30, algorithm, seed = 42) == 
+									generate_maze(20, 30, algorithm, seed = 42)).all())
+				self.assertFalse((generate_maze(20, 30, algorithm, seed = 42) == 
+									generate_maze(20, 30, algorithm, seed = 43)).all())
+	
+	def test_unknown_algorithm(self):
+		with self.assertRaises(UnitExecutionError):
+			generate_maze(5, 5, "unknown")
+	
+	def test_render(self):
+		connections = generate_maze(7, 9, seed = 3)
+		expected = ""
+		for row in range(7):
+			for column in range(9):
+				expected += "+   " if connections[row, column] & Direction.UP.bit else "+---"
+			expected += "+\n"
+			for column in range(9):
+				expected += "    " if connections[row, column] & Direction.LEFT.bit else "|   "
+			expected += "|\n"
+		expected += "+---" * 9 + "+\n"
+		self.assertEqual(render_maze(connections), expected)
+
+class TestViewport(unittest.TestCase):
+	
+	def setUp(self):
+		self.connections = generate_maze(30, 40, seed = 5)
+		self.viewport = Viewport(self.connections)
+	
+	def test_reveal(self):
+		self.viewport.reveal(0, 0)
+		self.viewport.mark(0, 0, 'I')
+		lines = self.viewport.text.split('\n')
+		map_lines = render_maze(self.connections).split('\n')
+		self.assertEqual(len(lines), 61)
+		self.assertEqual(lines[0][:5], map_lines[0][:5])
+		self.assertEqual(lines[1][:5], map_lines[1][:2] + 'I' + map_lines[1][3:5])
+		self.assertEqual(lines[2][:5], map_lines[2][:5])
+		self.assertEqual(lines[1][5:], " X " + "| X " * 38 + '|')
+		self.assertEqual(lines[3], "| X " * 40 + '|')
+	
+	def test_window(self):
+		self.viewport.reveal(15, 20)
+		window = self.viewport.render(15, 20).split('\n')
+		self.assertEqual(len(window), 21)
+		self.assertTrue(all(len(line) == 41 for line in window))
+		# Centered on the position
+		lines = self.viewport.text.split('\n')
+		self.assertEqual(window[11], lines[31][60:101])
+		self.assertEqual(self.viewport.get_origin(15, 20), (10, 15))
+		# Clamped to the maze
+		self.assertEqual(self.viewport.get_origin(0, 39), (0, 30))
+		self.assertEqual(Viewport(generate_maze(3, 4, seed = 5)).get_origin(2, 3), (0, 0))
+	
+	def test_dirty(self):
+		rendered = self.viewport.render(15, 20)
+		self.assertIs(self.viewport.render(15, 20), rendered)
+		self.viewport.reveal(0, 0)
+		self.assertIs(self.viewport.render(15, 20), rendered)
+		# Neighboring cells share walls with the window
+		self.viewport.reveal(15, 25)
+		self.assertIsNot(self.viewport.render(15, 20), rendered)
+	
+	def test_image(self):
+		self.viewport.reveal(0, 0)
+		image = Image.open(io.BytesIO(render_maze_image(self.connections, self.viewport.revealed, (0, 0), (29, 39), 
+															cell_size = 10)))
+		self.assertEqual(image.format, "PNG")
+		self.assertEqual(image.size, (401, 301))
+
+@pytest.mark.parametrize("size", (100, 250, 500))
+@pytest.mark.parametrize("algorithm", tuple(GENERATORS))
+def test_benchmark_generate_maze(benchmark, algorithm, size):
+	benchmark.group = f"generate_maze {size}x{size}"
+	benchmark.pedantic(generate_maze, args = (size, size, algorithm), kwargs = {"seed": 0}, rounds = 3)
+
+@pytest.mark.parametrize("size", (100, 250, 500))
+def test_benchmark_render_maze(benchmark, size):
+	benchmark.group = "render_maze"
+	benchmark(render_maze, generate_maze(size, size, seed = 0))
+
+@pytest.mark.parametrize("size", (100, 250))
+def test_benchmark_viewport_move(benchmark, size):
+	benchmark.group = "Viewport move"
+	viewport = Viewport(generate_maze(size, size, seed = 0))
+	def move():
+		viewport.mark(size // 2, size // 2, ' ')
+		viewport.reveal(size // 2, size // 2 + 1)
+		viewport.mark(size // 2, size // 2 + 1, 'I')
+		return viewport.render(size // 2, size // 2 + 1)
+	benchmark(move)
+
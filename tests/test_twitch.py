@@ -0,0 +1,183 @@
+
+import unittest
+
+import aiohttp
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from units.twitch import HelixClient, StreamPoller
+from units.errors import UnitOutputError
+
+class FakeHelix:
+	
+	'''Local fake of the Twitch Helix API endpoints used by the poller'''
+	
+	def __init__(self):
+		self.users = {}
+		self.games = {}
+		self.streams = {}
+		self.requests = []
+		self.tokens_issued = 0
+		self.valid_token = None
+		self.fail = False
+		self.app = web.Application()
+		self.app.router.add_post("/oauth2/token", self.token)
+		self.app.router.add_get("/helix/users", self.get_users)
+		self.app.router.add_get("/helix/games", self.get_games)
+		self.app.router.add_get("/helix/streams", self.get_streams)
+		self.app.router.add_get("/helix/search/channels", self.search_channels)
+	
+	def add_stream(self, user_id, title = "Stream", game_id = "1"):
+		self.users[user_id] = {"id": user_id, "login": f"user{user_id}", "display_name": f"User{user_id}"}
+		self.streams[user_id] = {"id": f"stream{user_id}", "user_id": user_id, "user_login": f"user{user_id}", 
+									"user_name": f"User{user_id}", "game_id": game_id, "type": "live", 
+									"title": title, "viewer_count": 1, "started_at": "2021-01-01T00:00:00Z"}
+	
+	async def token(self, request):
+		self.tokens_issued += 1
+		self.valid_token = f"token{self.tokens_issued}"
+		return web.json_response({"access_token": self.valid_token, "expires_in": 3600})
+	
+	def check(self, request):
+		self.requests.append((request.path, request.query))
+		if self.fail:
+			raise web.HTTPServiceUnavailable()
+		if request.headers.get("Authorization") != f"Bearer {self.valid_token}":
+			raise web.HTTPUnauthorized()
+		if len(set(request.query.getall("user_id", []) + request.query.getall("game_id", []) + 
+				request.query.getall("id", []) + request.query.getall("login", []) + 
+				request.query.getall("name", []))) > 100:
+			raise web.HTTPBadRequest()
+	
+	def paginate(self, request, items):
+		first = int(request.query.get("first", 20))
+		start = int(request.query.get("after", 0))
+		page = {"data": items[start:start + first], "pagination": {}}
+		if start + first < len(items):
+			page["pagination"]["cursor"] = str(start + first)
+		return web.json_response(page)
+	
+	async def get_users(self, request):
+		self.check(request)
+		ids = request.query.getall("id", [])
+		logins = request.query.getall("login", [])
+		return web.json_response({"data": [user for user in self.users.values()
+											if user["id"] in ids or user["login"] in logins]})
+	
+	async def get_games(self, request):
+		self.check(request)
+		names = [name.casefold() for name in request.query.getall("name", [])]
+		return web.json_response({"data": [{"id": id, "name": name} for id, name in self.games.items()
+											if name.casefold() in names]})
+	
+	async def get_streams(self, request):
+		self.check(request)
+		user_ids = request.query.getall("user_id", [])
+		game_ids = request.query.getall("game_id", [])
+		return self.paginate(request, [stream for stream in self.streams.values()
+										if stream["user_id"] in user_ids or stream["game_id"] in game_ids])
+	
+	async def search_channels(self, request):
+		self.check(request)
+		query = request.query["query"].casefold()
+		return self.paginate(request, [{"id": stream["user_id"], "is_live": True, "title": stream["title"]}
+										for stream in self.streams.values()
+										if query in stream["title"].casefold()])
+
+class TestStreamPoller(unittest.IsolatedAsyncioTestCase):
+	
+	async def asyncSetUp(self):
+		self.helix = FakeHelix()
+		self.server = TestServer(self.helix.app)
+		await self.server.start_server()
+		self.session = aiohttp.ClientSession()
+		self.client = HelixClient("client_id", "client_secret", self.session, 
+									base_url = str(self.server.make_url("/helix")), 
+									token_url = str(self.server.make_url("/oauth2/token")))
+		self.poller = StreamPoller(self.client)
+		self.events = []
+		self.poller.subscribe("go_live", self.on_go_live)
+		self.poller.subscribe("go_offline", self.on_go_offline)
+	
+	async def asyncTearDown(self):
+		await self.session.close()
+		await self.server.close()
+	
+	async def on_go_live(self, streams):
+		self.events.append(("go_live", sorted(stream.user_id for stream in streams)))
+	
+	async def on_go_offline(self, streams):
+		self.events.append(("go_offline", sorted(stream.user_id for stream in streams)))
+	
+	def stream_requests(self):
+		return [query for path, query in self.helix.requests if path == "/helix/streams"]
+	
+	async def test_user_ids_batched(self):
+		user_ids = [str(id) for id in range(250)]
+		for user_id in user_ids[::10]:
+			self.helix.add_stream(user_id)
+		await self.poller.poll(user_ids = user_ids)
+		self.assertEqual(len(self.stream_requests()), 3)
+		self.assertEqual(set(self.poller.live), {f"stream{user_id}" for user_id in user_ids[::10]})
+	
+	async def test_live_state_diff(self):
+		self.helix.add_stream("1")
+		self.helix.add_stream("2")
+		await self.poller.poll(user_ids = ["1", "2", "3"])
+		await self.poller.poll(user_ids = ["1", "2", "3"])
+		del self.helix.streams["2"]
+		self.helix.add_stream("3")
+		await self.poller.poll(user_ids = ["1", "2", "3"])
+		self.assertEqual(self.events, [("go_live", ["1", "2"]), ("go_live", ["3"]), ("go_offline", ["2"])])
+	
+	async def test_game_and_keyword_matches(self):
+		self.helix.games = {"10": "Chess", "20": "Go"}
+		self.helix.add_stream("1", title = "Speedrun", game_id = "10")
+		self.helix.add_stream("2", title = "Chill speedrun practice", game_id = "30")
+		self.helix.add_stream("3", title = "Unfollowed", game_id = "30")
+		went_live, _ = await self.poller.poll(games = ["chess", "Go"], keywords = ["speedrun"])
+		streams = {stream.user_id: stream for stream in went_live}
+		self.assertEqual(set(streams), {"1", "2"})
+		self.assertEqual(streams["1"].games, {"chess"})
+		self.assertEqual(streams["1"].keywords, {"speedrun"})
+		self.assertEqual(streams["2"].games, frozenset())
+		self.assertFalse(streams["2"].user)
+		# Game ids are cached between polls
+		await self.poller.poll(games = ["chess", "Go"], keywords = ["speedrun"])
+		game_requests = [path for path, query in self.helix.requests if path == "/helix/games"]
+		self.assertEqual(len(game_requests), 1)
+	
+	async def test_token_refreshed(self):
+		self.helix.add_stream("1")
+		await self.poller.poll(user_ids = ["1"])
+		# Revoke token
+		self.helix.valid_token = None
+		self.helix.add_stream("2")
+		await self.poller.poll(user_ids = ["1", "2"])
+		self.assertEqual(self.helix.tokens_issued, 2)
+		self.assertEqual(self.events, [("go_live", ["1"]), ("go_live", ["2"])])
+	
+	async def test_failed_poll_keeps_state(self):
+		self.helix.add_stream("1")
+		await self.poller.poll(user_ids = ["1"])
+		self.helix.fail = True
+		with self.assertRaises(UnitOutputError):
+			await self.poller.poll(user_ids = ["1"])
+		self.helix.fail = False
+		await self.poller.poll(user_ids = ["1"])
+		self.assertEqual(self.events, [("go_live", ["1"])])
+	
+	async def test_failed_handler_retried(self):
+		failures = [RuntimeError("Failed to announce")]
+		async def failing_handler(streams):
+			if failures:
+				raise failures.pop()
+		self.poller.subscribe("go_live", failing_handler)
+		self.helix.add_stream("1")
+		with self.assertRaises(RuntimeError):
+			await self.poller.poll(user_ids = ["1"])
+		self.assertEqual(self.poller.live, {})
+		await self.poller.poll(user_ids = ["1"])
+		self.assertEqual(set(self.poller.live), {"stream1"})
+		self.assertEqual(self.events, [("go_live", ["1"]), ("go_live", ["1"])])
+
@@ -0,0 +1,137 @@
+
+import ast
+import functools
+import math
+import operator
+
+from .errors import UnitExecutionError, UnitOutputError
+
+MAX_LENGTH = 1000
+# Maximum size of integer results and intermediate values
+# Kept under the 4300 digit limit for converting integers to strings
+MAX_BITS = 10_000
+MAX_ROUND_DIGITS = 1000
+
+def power(base, exponent):
+	if (isinstance(base, int) and isinstance(exponent, int) and abs(base) > 1 and 
+		exponent * base.bit_length() > MAX_BITS):
+		raise UnitOutputError("Result too large")
+	return operator.pow(base, exponent)
+
+def multiply(operand_1, operand_2):
+	if (isinstance(operand_1, int) and isinstance(operand_2, int) and 
+		operand_1.bit_length() + operand_2.bit_length() > MAX_BITS):
+		raise UnitOutputError("Result too large")
+	return operator.mul(operand_1, operand_2)
+
+def factorial(number):
+	# Floats are accepted by math.factorial before Python 3.10, bypassing the size check
+	if not isinstance(number, int):
+		raise UnitExecutionError("factorial() only accepts integers")
+	if number > 1 and math.lgamma(number + 1) / math.log(2) > MAX_BITS:
+		raise UnitOutputError("Result too large")
+	return math.factorial(number)
+
+def round_number(number, ndigits = None):
+	# Rounding to a large number of digits takes time quadratic in the number of digits
+	if isinstance(ndigits, int) and abs(ndigits) > MAX_ROUND_DIGITS:
+		raise UnitExecutionError("Number of digits to round to too large")
+	return round(number, ndigits)
+
+binary_operators = {
+	ast.Add: operator.add,
+	ast.Sub: operator.sub,
+	ast.Mult: multiply,
+	ast.Div: operator.truediv,
+	ast.FloorDiv: operator.floordiv,
+	ast.Mod: operator.mod,
+	ast.Pow: power
+}
+
+unary_operators = {
+	ast.UAdd: operator.pos,
+	ast.USub: operator.neg
+}
+
+constants = {
+	"pi": math.pi,
+	'e': math.e,
+	"tau": math.tau,
+	"inf": math.inf
+}
+
+functions = {
+	"abs": abs,
+	"acos": math.acos,
+	"acosh": math.acosh,
+	"asin": math.asin,
+	"asinh": math.asinh,
+	"atan": math.atan,
+	"atan2": math.atan2,
+	"atanh": math.atanh,
+	"ceil": math.ceil,
+	"cos": math.cos,
+	"cosh": math.cosh,
+	"cot": lambda x: 1 / math.tan(x),
+	"csc": lambda x: 1 / math.sin(x),
+	"degrees": math.degrees,
+	"exp": math.exp,
+	"factorial": factorial,
+	"floor": math.floor,
+	"gcd": math.gcd,
+	"hypot": math.hypot,
+	"ln": math.log,
+	"log": math.log,
+	"log10": math.log10,
+	"log2": math.log2,
+	"radians": math.radians,
+	"round": round_number,
+	"sec": lambda x: 1 / math.cos(x),
+	"sin": math.sin,
+	"sinh": math.sinh,
+	"sqrt": math.sqrt,
+	"tan": math.tan,
+	"tanh": math.tanh
+}
+
+def evaluate_node(node, source):
+	if isinstance(node, ast.Expression):
+		return evaluate_node(node.body, source)
+	if isinstance(node, ast.Constant) and type(node.value) in (int, float):
+		return node.value
+	if isinstance(node, ast.Name):
+		if node.id not in constants:
+			raise UnitExecutionError(f"Unknown constant: {node.id}")
+		return constants[node.id]
+	if isinstance(node, ast.BinOp) and type(node.op) in binary_operators:
+		return binary_operators[type(node.op)](evaluate_node(node.left, source), evaluate_node(node.right, source))
+	if isinstance(node, ast.UnaryOp) and type(node.op) in unary_operators:
+		return unary_operators[type(node.op)](evaluate_node(node.operand, source))
+	if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and not node.keywords:
+		if node.func.id not in functions:
+			raise UnitExecutionError(f"Unknown function: {node.func.id}")
+		return functions[node.func.id](*(evaluate_node(argument, source) for argument in node.args))
+	raise UnitExecutionError(f"Unsupported expression: {ast.get_source_segment(source, node)}")
+
+@functools.lru_cache(maxsize = 1024)
+def evaluate(expression: str):
+	'''
+	Evaluate an arithmetic expression
+	Supports +, -, *, /, //, %, ** or ^, and whitelisted constants and functions
+	Raises UnitExecutionError for invalid expressions and UnitOutputError for results that are too large
+	'''
+	if len(expression) > MAX_LENGTH:
+		raise UnitExecutionError("Expression too long")
+	try:
+		expression = expression.replace('^', "**").strip()
+		return evaluate_node(ast.parse(expression, mode = "eval"), expression)
+	except SyntaxError:
+		raise UnitExecutionError("Syntax error")
+	except ZeroDivisionError:
+		raise UnitExecutionError("Division by zero")
+	except (TypeError, ValueError) as e:
+		raise UnitExecutionError(str(e))
+	except OverflowError:
+		raise UnitOutputError("Result too large")
+	except RecursionError:
+		raise UnitExecutionError("Expression too complex")
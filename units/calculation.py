@@ -1,42 +1,95 @@
 
+import functools
 import operator
 
-from pyparsing import Forward, Group, Literal, nums, Suppress, Word
+from pyparsing import nums, ParseException
 
-expression_stack = []
+operations = {
+	'+': operator.add,
+	'-': operator.sub,
+	'*': operator.mul,
+	'/': operator.truediv
+}
 
-def push_first(tokens):
-	expression_stack.append(tokens[0])
+precedences = {
+	'+': 1,
+	'-': 1,
+	'*': 2,
+	'/': 2
+}
 
 """
 atom       :: '0'..'9'+ | '(' expression ')'
 term       :: atom [ ('*' | '/') atom ]*
 expression :: term [ ('+' | '-') term ]*
 """
-expression = Forward()
-atom = (Word(nums)).setParseAction(push_first) | Group(Suppress('(') + expression + Suppress(')'))
-term = atom + ((Literal('*') | Literal('/')) + atom).setParseAction(push_first)[...]
-expression <<= term + ((Literal('+') | Literal('-')) + term).setParseAction(push_first)[...]
+# Parsed with the shunting-yard algorithm, without recursion,
+# so deeply nested parentheses don't hit the recursion limit
 
-operations = {
-	'+': operator.add,
-	'-': operator.sub,
-	'*': operator.mul,
-	'/': operator.truediv
-}
+@functools.lru_cache(maxsize = 256)
+def compile_expression(input_string: str):
+	'''
+	Compile input_string into a postfix program
+	Programs are tuples of ints, for operands, and operator strs
+	Raises pyparsing.ParseException for invalid syntax
+	'''
+	program = []
+	# Pending operators and open parentheses
+	stack = []
+	expecting_operand = True
+	position = 0
+	while True:
+		while position < len(input_string) and input_string[position] in " \t\n\r":
+			position += 1
+		if position == len(input_string):
+			break
+		character = input_string[position]
+		if expecting_operand:
+			if character in nums:
+				start = position
+				while position < len(input_string) and input_string[position] in nums:
+					position += 1
+				program.append(int(input_string[start:position]))
+				expecting_operand = False
+				continue
+			if character != '(':
+				raise ParseException(input_string, position, "Expected number or '('")
+			stack.append(character)
+		elif character in precedences:
+			# Operators are left-associative
+			while stack and stack[-1] != '(' and precedences[stack[-1]] >= precedences[character]:
+				program.append(stack.pop())
+			stack.append(character)
+			expecting_operand = True
+		elif character == ')':
+			while stack and stack[-1] != '(':
+				program.append(stack.pop())
+			if not stack:
+				raise ParseException(input_string, position, "Unmatched ')'")
+			stack.pop()
+		else:
+			raise ParseException(input_string, position, "Expected operator or ')'")
+		position += 1
+	if expecting_operand:
+		raise ParseException(input_string, position, "Expected number or '('")
+	while stack:
+		token = stack.pop()
+		if token == '(':
+			raise ParseException(input_string, position, "Expected ')'")
+		program.append(token)
+	return tuple(program)
 
-def evaluate_stack(stack):
-	token = stack.pop()
-	if token in "+-*/":
-		# Operands are pushed onto the stack in reverse order
-		operand_2 = evaluate_stack(stack)
-		operand_1 = evaluate_stack(stack)
-		return operations[token](operand_1, operand_2)
-	else:
-		return int(token)
+def evaluate_program(program):
+	stack = []
+	for token in program:
+		if isinstance(token, int):
+			stack.append(token)
+		else:
+			operand_2 = stack.pop()
+			operand_1 = stack.pop()
+			stack.append(operations[token](operand_1, operand_2))
+	return stack.pop()
 
 def calculate(input_string: str):
-	expression_stack.clear()
-	expression.parseString(input_string, parseAll=True)  # can raise pyparsing.ParseException
-	return evaluate_stack(expression_stack)  # can raise ZeroDivisionError
+	return evaluate_program(compile_expression(input_string))  # can raise ZeroDivisionError
 
@@ -0,0 +1,292 @@
+
+import ast
+import io
+import re
+
+import matplotlib.figure
+import numpy
+
+from .errors import UnitExecutionError
+
+MODES = ("cartesian", "parametric", "polar")
+VARIABLES = {"cartesian": ('x',), "parametric": ('t',), "polar": ("theta", 't', '\N{GREEK SMALL LETTER THETA}')}
+MAX_EXPRESSIONS = 5
+MAX_LENGTH = 500
+INITIAL_SAMPLES = 500
+MAX_SAMPLES = 10_000
+MAX_REFINEMENTS = 8
+# Segment length relative to the curve's extent
+# Longer segments are subdivided, and segments still longer after being
+# subdivided MAX_REFINEMENTS times are treated as discontinuities
+SEGMENT_LENGTH = 0.01
+JOINTPLOT_KINDS = ("scatter", "kde", "hist", "hex", "reg", "resid")
+
+binary_operators = {
+	ast.Add: numpy.add, 
+	ast.Sub: numpy.subtract, 
+	ast.Mult: numpy.multiply, 
+	ast.Div: numpy.true_divide, 
+	ast.FloorDiv: numpy.floor_divide, 
+	ast.Mod: numpy.mod, 
+	ast.Pow: numpy.power
+}
+
+unary_operators = {
+	ast.UAdd: numpy.positive, 
+	ast.USub: numpy.negative
+}
+
+constants = {
+	"pi": numpy.pi, 
+	'e': numpy.e, 
+	"tau": 2 * numpy.pi
+}
+
+functions = {
+	"abs": numpy.abs, 
+	"arccos": numpy.arccos, "acos": numpy.arccos, 
+	"arccosh": numpy.arccosh, "acosh": numpy.arccosh, 
+	"arcsin": numpy.arcsin, "asin": numpy.arcsin, 
+	"arcsinh": numpy.arcsinh, "asinh": numpy.arcsinh, 
+	"arctan": numpy.arctan, "atan": numpy.arctan, 
+	"arctan2": numpy.arctan2, "atan2": numpy.arctan2, 
+	"arctanh": numpy.arctanh, "atanh": numpy.arctanh, 
+	"ceil": numpy.ceil, 
+	"cos": numpy.cos, 
+	"cosh": numpy.cosh, 
+	"cot": lambda x: 1 / numpy.tan(x), 
+	"csc": lambda x: 1 / numpy.sin(x), 
+	"exp": numpy.exp, 
+	"expm1": numpy.expm1, 
+	"floor": numpy.floor, 
+	"ln": numpy.log, 
+	"log": numpy.log, 
+	"log10": numpy.log10, 
+	"log1p": numpy.log1p, 
+	"log2": numpy.log2, 
+	"max": numpy.maximum, 
+	"min": numpy.minimum, 
+	"sec": lambda x: 1 / numpy.cos(x), 
+	"sign": numpy.sign, 
+	"sin": numpy.sin, 
+	"sinh": numpy.sinh, 
+	"sqrt": numpy.sqrt, 
+	"tan": numpy.tan, 
+	"tanh": numpy.tanh
+}
+binary_functions = ("arctan2", "atan2", "max", "min")
+
+def parse_expression(expression, variables):
+	'''Parse and validate an expression of variables, raising UnitExecutionError if it's unsupported'''
+	if len(expression) > MAX_LENGTH:
+		raise UnitExecutionError("Expression too long")
+	expression = expression.replace('^', "**").strip()
+	try:
+		tree = ast.parse(expression, mode = "eval")
+	except SyntaxError:
+		raise UnitExecutionError(f"Syntax error in `{expression}`")
+	for node in ast.walk(tree):
+		if isinstance(node, ast.Name):
+			if node.id not in variables and node.id not in constants and node.id not in functions:
+				raise UnitExecutionError(f"`{node.id}` is not supported")
+		elif isinstance(node, ast.Call):
+			if not isinstance(node.func, ast.Name) or node.func.id not in functions or node.keywords:
+				raise UnitExecutionError(f"`{ast.get_source_segment(expression, node)}` is not supported")
+			if len(node.args) != (2 if node.func.id in binary_functions else 1):
+				raise UnitExecutionError(f"Wrong number of arguments: `{ast.get_source_segment(expression, node)}`")
+		elif isinstance(node, ast.BinOp):
+			if type(node.op) not in binary_operators:
+				raise UnitExecutionError(f"`{ast.get_source_segment(expression, node)}` is not supported")
+		elif isinstance(node, ast.UnaryOp):
+			if type(node.op) not in unary_operators:
+				raise UnitExecutionError(f"`{ast.get_source_segment(expression, node)}` is not supported")
+		elif isinstance(node, ast.Constant):
+			if type(node.value) not in (int, float):
+				raise UnitExecutionError(f"`{ast.get_source_segment(expression, node)}` is not supported")
+		elif not isinstance(node, (ast.Expression, ast.Tuple, ast.Load, ast.operator, ast.unaryop)):
+			raise UnitExecutionError(f"`{ast.get_source_segment(expression, node)}` is not supported")
+	return tree.body
+
+def parse_graph(mode, expressions):
+	'''
+	Parse the expressions for each curve of a graph
+	Parametric curves are pairs of expressions for x and y, e.g. `cos(t), sin(t)`
+	Returns a list of tuples of expressions, one for each curve
+	'''
+	if mode not in MODES:
+		raise UnitExecutionError(f"Unknown mode: {mode}")
+	if not expressions:
+		raise UnitExecutionError("No expressions to graph")
+	if len(expressions) > MAX_EXPRESSIONS:
+		raise UnitExecutionError(f"Graphs can have at most {MAX_EXPRESSIONS} expressions")
+	curves = []
+	for expression in expressions:
+		node = parse_expression(expression, VARIABLES[mode])
+		if mode == "parametric":
+			if not isinstance(node, ast.Tuple) or len(node.elts) != 2:
+				raise UnitExecutionError(f"Parametric expressions must be pairs of x and y expressions: `{expression}`")
+			curves.append(tuple(node.elts))
+		elif isinstance(node, ast.Tuple):
+			raise UnitExecutionError(f"`{expression}` is not supported")
+		else:
+			curves.append((node,))
+	return curves
+
+def normalize_graph(mode, expressions):
+	'''Normalize a graph's expressions, e.g. for use as a cache key, ignoring whitespace and notation'''
+	return (mode,) + tuple(ast.dump(node) for curve in parse_graph(mode, expressions) for node in curve)
+
+def evaluate_node(node, variables):
+	if isinstance(node, ast.Constant):
+		return float(node.value)
+	if isinstance(node, ast.Name):
+		return variables[node.id] if node.id in variables else constants[node.id]
+	if isinstance(node, ast.BinOp):
+		return binary_operators[type(node.op)](evaluate_node(node.left, variables), 
+												evaluate_node(node.right, variables))
+	if isinstance(node, ast.UnaryOp):
+		return unary_operators[type(node.op)](evaluate_node(node.operand, variables))
+	if isinstance(node, ast.Call):
+		return functions[node.func.id](*(evaluate_node(argument, variables) for argument in node.args))
+	raise UnitExecutionError(f"Unsupported expression: {type(node).__name__}")
+
+def evaluate_curve(mode, curve, parameter):
+	'''Evaluate a curve at parameter values, returning arrays of x and y coordinates'''
+	variables = dict.fromkeys(VARIABLES[mode], parameter)
+	with numpy.errstate(all = "ignore"):
+		values = [numpy.broadcast_to(numpy.asarray(evaluate_node(node, variables), dtype = float), parameter.shape)
+					for node in curve]
+		if mode == "cartesian":
+			x, y = parameter, values[0]
+		elif mode == "parametric":
+			x, y = values
+		else:
+			x, y = values[0] * numpy.cos(parameter), values[0] * numpy.sin(parameter)
+	# Infinite values are treated as undefined, breaking the curve
+	return numpy.where(numpy.isfinite(x), x, numpy.nan), numpy.where(numpy.isfinite(y), y, numpy.nan)
+
+def get_extent(values):
+	'''Extent of the bulk of values, ignoring outliers like asymptotes'''
+	values = values[numpy.isfinite(values)]
+	if not values.size:
+		return 1
+	lower, upper = numpy.percentile(values, (5, 95))
+	return upper - lower or abs(upper) or 1
+
+def get_segment_lengths(x, y):
+	with numpy.errstate(all = "ignore"):
+		return numpy.hypot(numpy.diff(x) / get_extent(x), numpy.diff(y) / get_extent(y))
+
+def sample_curve(mode, curve, lower, upper):
+	'''
+	Sample a curve adaptively between parameter values lower and upper
+	Segments that are long relative to the curve's extent, or that cross into or out of its domain, 
+	are subdivided, so samples are concentrated near discontinuities and asymptotes
+	Returns arrays of x and y coordinates, with NaNs at discontinuities to break the curve
+	'''
+	parameter = numpy.linspace(lower, upper, INITIAL_SAMPLES)
+	x, y = evaluate_curve(mode, curve, parameter)
+	for _ in range(MAX_REFINEMENTS):
+		defined = numpy.isfinite(x) & numpy.isfinite(y)
+		indices = numpy.flatnonzero((get_segment_lengths(x, y) > SEGMENT_LENGTH) | (defined[:-1] != defined[1:]))
+		indices = indices[:MAX_SAMPLES - parameter.size]
+		if not indices.size:
+			break
+		midpoints = (parameter[indices] + parameter[indices + 1]) / 2
+		midpoint_x, midpoint_y = evaluate_curve(mode, curve, midpoints)
+		parameter = numpy.insert(parameter, indices + 1, midpoints)
+		x = numpy.insert(x, indices + 1, midpoint_x)
+		y = numpy.insert(y, indices + 1, midpoint_y)
+	# Discontinuities are long segments that couldn't be subdivided further,
+	# at least as long as their neighbours, which are also long near asymptotes
+	lengths = get_segment_lengths(x, y)
+	finest_spacing = (upper - lower) / (INITIAL_SAMPLES - 1) / 2 ** MAX_REFINEMENTS
+	padded_lengths = numpy.concatenate(([0], numpy.nan_to_num(lengths), [0]))
+	discontinuities = numpy.flatnonzero((lengths > SEGMENT_LENGTH) & 
+										(numpy.diff(parameter) < finest_spacing * 1.5) & 
+										(padded_lengths[1:-1] >= padded_lengths[:-2]) & 
+										(padded_lengths[1:-1] >= padded_lengths[2:]))
+	return (numpy.insert(x, discontinuities + 1, numpy.nan), 
+			numpy.insert(y, discontinuities + 1, numpy.nan))
+
+def get_limits(values):
+	'''Axis limits for values, excluding values far outside their bulk, e.g. near asymptotes'''
+	values = values[numpy.isfinite(values)]
+	if not values.size:
+		return None
+	lower, upper = numpy.percentile(values, (5, 95))
+	margin = (upper - lower) * 0.5 or 1
+	lower, upper = max(values.min(), lower - margin), min(values.max(), upper + margin)
+	padding = (upper - lower) * 0.05 or 1
+	return lower - padding, upper + padding
+
+def render_graph(mode, expressions, lower, upper):
+	'''Render a graph of expressions between parameter values lower and upper as PNG'''
+	if not (numpy.isfinite(lower) and numpy.isfinite(upper)) or lower >= upper:
+		raise UnitExecutionError("Lower limit must be less than upper limit")
+	curves = parse_graph(mode, expressions)
+	figure = matplotlib.figure.Figure()
+	axes = figure.add_subplot()
+	# Limits are from uniform samples, as adaptive samples are concentrated near asymptotes
+	uniform_x, uniform_y = [], []
+	for expression, curve in zip(expressions, curves):
+		axes.plot(*sample_curve(mode, curve, lower, upper), label = expression)
+		x, y = evaluate_curve(mode, curve, numpy.linspace(lower, upper, INITIAL_SAMPLES))
+		uniform_x.append(x)
+		uniform_y.append(y)
+	if mode == "cartesian":
+		axes.set_xlim(lower, upper)
+	elif x_limits := get_limits(numpy.concatenate(uniform_x)):
+		axes.set_xlim(*x_limits)
+	if y_limits := get_limits(numpy.concatenate(uniform_y)):
+		axes.set_ylim(*y_limits)
+	if mode != "cartesian":
+		axes.set_aspect("equal")
+	if len(expressions) > 1:
+		axes.legend()
+	axes.grid(True)
+	buffer = io.BytesIO()
+	figure.savefig(buffer, format = "PNG")
+	return buffer.getvalue()
+
+def parse_jointplot_arguments(string):
+	'''
+	Parse jointplot arguments from space-separated key=value pairs
+	x and y are comma-separated numbers, kind is a jointplot kind, 
+	height is a number, and color is a color name or hex code
+	'''
+	arguments = {}
+	for pair in string.split():
+		key, separator, value = pair.partition('=')
+		if not separator or not value:
+			raise UnitExecutionError(f"Expected key=value: `{pair}`")
+		if key in arguments:
+			raise UnitExecutionError(f"Duplicate argument: {key}")
+		if key in ('x', 'y'):
+			try:
+				arguments[key] = [float(number) for number in value.split(',')]
+			except ValueError:
+				raise UnitExecutionError(f"{key} must be comma-separated numbers")
+		elif key == "kind":
+			if value not in JOINTPLOT_KINDS:
+				raise UnitExecutionError(f"kind must be one of {', '.join(JOINTPLOT_KINDS)}")
+			arguments[key] = value
+		elif key == "height":
+			try:
+				arguments[key] = float(value)
+			except ValueError:
+				raise UnitExecutionError("height must be a number")
+			if not 1 <= arguments[key] <= 20:
+				raise UnitExecutionError("height must be between 1 and 20")
+		elif key == "color":
+			if not re.fullmatch(r"[a-z]+|#[0-9a-fA-F]{6}", value):
+				raise UnitExecutionError("color must be a color name or hex code")
+			arguments[key] = value
+		else:
+			raise UnitExecutionError(f"Unknown argument: {key}")
+	if 'x' not in arguments or 'y' not in arguments:
+		raise UnitExecutionError("x and y are required")
+	if len(arguments['x']) != len(arguments['y']):
+		raise UnitExecutionError("x and y must have the same number of values")
+	return arguments
+
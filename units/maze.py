@@ -0,0 +1,319 @@
+
+from enum import IntEnum
+import io
+import random
+
+import numpy
+from PIL import Image
+
+from .errors import UnitExecutionError
+
+class Direction(IntEnum):
+	UP = 0
+	RIGHT = 1
+	DOWN = 2
+	LEFT = 3
+	
+	@property
+	def reverse(self):
+		return {self.UP: self.DOWN, self.LEFT: self.RIGHT, self.DOWN: self.UP, self.RIGHT: self.LEFT}[self]
+	
+	@property
+	def vector(self):
+		# (-y, x) to match vertical, horizontal / row, column
+		return {self.UP: (-1, 0), self.RIGHT: (0, 1), self.DOWN: (1, 0), self.LEFT: (0, -1)}[self]
+	
+	@property
+	def bit(self):
+		'''Bit for this direction in connection bitmasks'''
+		return 1 << self
+
+# Connections between cells are bitmasks of Direction bits, one byte per cell
+# Generators carve into a flat bytearray of cells in row-major order
+
+def get_neighbors(index, rows, columns):
+	'''Directions and indices of the neighbors of the cell at index'''
+	row, column = divmod(index, columns)
+	neighbors = []
+	if row > 0:
+		neighbors.append((Direction.UP, index - columns))
+	if column < columns - 1:
+		neighbors.append((Direction.RIGHT, index + 1))
+	if row < rows - 1:
+		neighbors.append((Direction.DOWN, index + columns))
+	if column > 0:
+		neighbors.append((Direction.LEFT, index - 1))
+	return neighbors
+
+def carve(cells, index, direction, neighbor):
+	cells[index] |= direction.bit
+	cells[neighbor] |= direction.reverse.bit
+
+def generate_recursive_backtracker(rows, columns, rng):
+	'''Depth-first search, carving to random unvisited neighbors and backtracking at dead ends'''
+	cells = bytearray(rows * columns)
+	visited = bytearray(rows * columns)
+	start = rng.randrange(rows * columns)
+	visited[start] = True
+	stack = [start]
+	while stack:
+		index = stack[-1]
+		unvisited = [(direction, neighbor) for direction, neighbor in get_neighbors(index, rows, columns)
+						if not visited[neighbor]]
+		if not unvisited:
+			stack.pop()
+			continue
+		direction, neighbor = rng.choice(unvisited)
+		carve(cells, index, direction, neighbor)
+		visited[neighbor] = True
+		stack.append(neighbor)
+	return cells
+
+def generate_prim(rows, columns, rng):
+	'''Randomized Prim's algorithm, connecting random frontier cells to the maze'''
+	cells = bytearray(rows * columns)
+	in_maze = bytearray(rows * columns)
+	in_frontier = bytearray(rows * columns)
+	frontier = []
+	def add(index):
+		in_maze[index] = True
+		for _, neighbor in get_neighbors(index, rows, columns):
+			if not in_maze[neighbor] and not in_frontier[neighbor]:
+				in_frontier[neighbor] = True
+				frontier.append(neighbor)
+	add(rng.randrange(rows * columns))
+	while frontier:
+		# Swap with last to remove in constant time
+		position = rng.randrange(len(frontier))
+		frontier[position], frontier[-1] = frontier[-1], frontier[position]
+		index = frontier.pop()
+		direction, neighbor = rng.choice([(direction, neighbor) for direction, neighbor in get_neighbors(index, rows, columns)
+											if in_maze[neighbor]])
+		carve(cells, index, direction, neighbor)
+		add(index)
+	return cells
+
+def generate_kruskal(rows, columns, rng):
+	'''Randomized Kruskal's algorithm, removing random walls between disjoint sets of cells'''
+	cells = bytearray(rows * columns)
+	parents = list(range(rows * columns))
+	def find(index):
+		while parents[index] != index:
+			# Path halving
+			parents[index] = parents[parents[index]]
+			index = parents[index]
+		return index
+	walls = [(index, Direction.RIGHT) for index in range(rows * columns) if index % columns < columns - 1]
+	walls += [(index, Direction.DOWN) for index in range(rows * columns - columns)]
+	rng.shuffle(walls)
+	for index, direction in walls:
+		neighbor = index + (1 if direction is Direction.RIGHT else columns)
+		root, neighbor_root = find(index), find(neighbor)
+		if root != neighbor_root:
+			parents[root] = neighbor_root
+			carve(cells, index, direction, neighbor)
+	return cells
+
+def generate_wilson(rows, columns, rng):
+	'''
+	Wilson's algorithm, adding loop-erased random walks to the maze
+	Generates uniformly random spanning trees
+	'''
+	cells = bytearray(rows * columns)
+	in_maze = bytearray(rows * columns)
+	in_maze[rng.randrange(rows * columns)] = True
+	# Last direction taken from each cell in the current walk, which erases loops
+	walk = {}
+	order = list(range(rows * columns))
+	rng.shuffle(order)
+	for start in order:
+		if in_maze[start]:
+			continue
+		walk.clear()
+		index = start
+		while not in_maze[index]:
+			direction, neighbor = rng.choice(get_neighbors(index, rows, columns))
+			walk[index] = (direction, neighbor)
+			index = neighbor
+		index = start
+		while not in_maze[index]:
+			direction, neighbor = walk[index]
+			carve(cells, index, direction, neighbor)
+			in_maze[index] = True
+			index = neighbor
+	return cells
+
+def generate_eller(rows, columns, rng):
+	'''Eller's algorithm, generating a row at a time with sets of connected cells'''
+	cells = bytearray(rows * columns)
+	sets = [None] * columns
+	next_set = 0
+	for row in range(rows):
+		offset = row * columns
+		for column in range(columns):
+			if sets[column] is None:
+				sets[column] = next_set
+				next_set += 1
+		last_row = row == rows - 1
+		# Join adjacent cells in different sets, randomly or, in the last row, always
+		for column in range(columns - 1):
+			if sets[column] != sets[column + 1] and (last_row or rng.random() < 0.5):
+				carve(cells, offset + column, Direction.RIGHT, offset + column + 1)
+				merged, kept = sets[column + 1], sets[column]
+				sets = [kept if cell_set == merged else cell_set for cell_set in sets]
+		if last_row:
+			break
+		# Connect each set down at least once
+		columns_by_set = {}
+		for column, cell_set in enumerate(sets):
+			columns_by_set.setdefault(cell_set, []).append(column)
+		next_sets = [None] * columns
+		for cell_set, set_columns in columns_by_set.items():
+			down = [column for column in set_columns if rng.random() < 0.5] or [rng.choice(set_columns)]
+			for column in down:
+				carve(cells, offset + column, Direction.DOWN, offset + columns + column)
+				next_sets[column] = cell_set
+		sets = next_sets
+	return cells
+
+GENERATORS = {
+	"backtracker": generate_recursive_backtracker, 
+	"prim": generate_prim, 
+	"kruskal": generate_kruskal, 
+	"wilson": generate_wilson, 
+	"eller": generate_eller
+}
+
+def generate_maze(rows, columns, algorithm = "backtracker", seed = None):
+	'''
+	Generate a perfect maze, with exactly one path between each pair of cells
+	Returns a rows x columns numpy array of connection bitmasks
+	Mazes are reproducible for the same dimensions, algorithm, and seed
+	'''
+	if algorithm not in GENERATORS:
+		raise UnitExecutionError(f"Unknown maze generation algorithm: {algorithm}")
+	if rows < 1 or columns < 1:
+		raise UnitExecutionError("Mazes must have at least one row and column")
+	cells = GENERATORS[algorithm](rows, columns, random.Random(seed))
+	return numpy.frombuffer(cells, dtype = numpy.uint8).reshape(rows, columns).copy()
+
+def render_maze(connections):
+	'''Render a maze as ASCII, with each cell 3 characters wide and 1 character tall'''
+	rows, columns = connections.shape
+	pieces = numpy.empty((2 * rows + 1, columns + 1), dtype = object)
+	pieces[0:-1:2, :-1] = numpy.where(connections & Direction.UP.bit, "+   ", "+---")
+	pieces[1::2, :-1] = numpy.where(connections & Direction.LEFT.bit, "    ", "|   ")
+	pieces[-1, :-1] = "+---"
+	pieces[::2, -1] = "+\n"
+	pieces[1::2, -1] = "|\n"
+	return "".join(pieces.ravel())
+
+class Viewport:
+	'''
+	Fog of war view of a maze, revealing cells as they're visited
+	The revealed map is kept as a mutable character buffer that's updated in place,
+	and only the window of rows x columns cells around a position is rendered
+	'''
+	
+	def __init__(self, connections, rows = 10, columns = 10):
+		self.connections = connections
+		self.maze_rows, self.maze_columns = connections.shape
+		self.rows = min(rows, self.maze_rows)
+		self.columns = min(columns, self.maze_columns)
+		# Characters per line of the map, including the newline
+		self.stride = 4 * self.maze_columns + 2
+		self.map = render_maze(connections).encode()
+		self.buffer = bytearray(
+			(b"+---" * self.maze_columns + b"+\n" + b"| X " * self.maze_columns + b"|\n") * self.maze_rows + 
+			b"+---" * self.maze_columns + b"+\n"
+		)
+		self.revealed = numpy.zeros(connections.shape, dtype = bool)
+		# Cells changed since the last render
+		self.dirty = set()
+		self.origin = None
+		self.rendered = None
+	
+	@property
+	def text(self):
+		'''Full revealed map'''
+		return self.buffer[:-1].decode()
+	
+	def offset(self, row, column):
+		'''Index of the top left corner of a cell in the buffer'''
+		return 2 * row * self.stride + 4 * column
+	
+	def reveal(self, row, column):
+		'''Reveal the walls of a cell'''
+		offset = self.offset(row, column)
+		for start in range(offset, offset + 3 * self.stride, self.stride):
+			self.buffer[start:start + 5] = self.map[start:start + 5]
+		self.revealed[row, column] = True
+		self.dirty.add((row, column))
+	
+	def mark(self, row, column, character):
+		'''Set the character in the center of a cell'''
+		self.buffer[self.offset(row, column) + self.stride + 2] = ord(character)
+		self.dirty.add((row, column))
+	
+	def get_origin(self, row, column):
+		'''Top left cell of the window centered on a position, clamped to the maze'''
+		return (min(max(row - self.rows // 2, 0), self.maze_rows - self.rows), 
+				min(max(column - self.columns // 2, 0), self.maze_columns - self.columns))
+	
+	def render(self, row, column):
+		'''
+		Render the window centered on a position
+		The previous render is reused if the window hasn't moved and none of its cells have changed
+		'''
+		origin = self.get_origin(row, column)
+		start_row, start_column = origin
+		# Revealing a cell also changes the walls it shares with its neighbors
+		if origin != self.origin or any(
+			start_row - 1 <= dirty_row <= start_row + self.rows and 
+			start_column - 1 <= dirty_column <= start_column + self.columns
+			for dirty_row, dirty_column in self.dirty
+		):
+			start = self.offset(start_row, start_column)
+			width = 4 * self.columns + 1
+			self.rendered = b'\n'.join(
+				self.buffer[line:line + width]
+				for line in range(start, start + (2 * self.rows + 1) * self.stride, self.stride)
+			).decode()
+			self.origin = origin
+		self.dirty.clear()
+		return self.rendered
+
+FOG_COLOR = (64, 64, 64)
+FLOOR_COLOR = (255, 255, 255)
+WALL_COLOR = (0, 0, 0)
+POSITION_COLOR = (0, 96, 255)
+END_COLOR = (255, 32, 32)
+MAX_IMAGE_SIZE = 2000
+
+def render_maze_image(connections, revealed, position, end, cell_size = None):
+	'''
+	Render the revealed map of a maze as a PNG
+	As with the text map, walls are only shown open next to revealed cells
+	'''
+	rows, columns = connections.shape
+	if cell_size is None:
+		cell_size = min(max(MAX_IMAGE_SIZE // max(rows, columns), 2), 16)
+	image = numpy.full((rows * cell_size + 1, columns * cell_size + 1, 3), FOG_COLOR, dtype = numpy.uint8)
+	image[:-1, :-1][revealed.repeat(cell_size, axis = 0).repeat(cell_size, axis = 1)] = FLOOR_COLOR
+	above = numpy.zeros_like(revealed)
+	above[1:] = revealed[:-1]
+	beside = numpy.zeros_like(revealed)
+	beside[:, 1:] = revealed[:, :-1]
+	closed_up = ((connections & Direction.UP.bit) == 0) | ~(revealed | above)
+	closed_left = ((connections & Direction.LEFT.bit) == 0) | ~(revealed | beside)
+	walls = numpy.zeros(image.shape[:2], dtype = bool)
+	walls[:-1:cell_size, :-1] = closed_up.repeat(cell_size, axis = 1)
+	walls[:-1, :-1:cell_size] |= closed_left.repeat(cell_size, axis = 0)
+	walls[::cell_size, ::cell_size] = True
+	walls[-1] = walls[:, -1] = True
+	image[walls] = WALL_COLOR
+	for (row, column), color in ((end, END_COLOR), (position, POSITION_COLOR)):
+		image[row * cell_size + 1:(row + 1) * cell_size, column * cell_size + 1:(column + 1) * cell_size] = color
+	buffer = io.BytesIO()
+	Image.fromarray(image).save(buffer, "PNG")
+	return buffer.getvalue()
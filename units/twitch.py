@@ -0,0 +1,217 @@
+
+import asyncio
+import time
+
+from .errors import UnitExecutionError, UnitOutputError
+
+# https://dev.twitch.tv/docs/api/reference
+HELIX_URL = "https://api.twitch.tv/helix"
+TOKEN_URL = "https://id.twitch.tv/oauth2/token"
+# Maximum number of ids or names per Helix request
+BATCH_SIZE = 100
+
+class HelixClient:
+	
+	'''
+	Twitch Helix API client, using an app access token
+	Lookups of multiple ids or names are batched into requests of up to 100
+	'''
+	
+	def __init__(self, client_id, client_secret, aiohttp_session, *, 
+					base_url = HELIX_URL, token_url = TOKEN_URL):
+		if not aiohttp_session:
+			raise UnitExecutionError("aiohttp session required")
+		self.client_id = client_id
+		self.client_secret = client_secret
+		self.aiohttp_session = aiohttp_session
+		self.base_url = base_url
+		self.token_url = token_url
+		self.token = None
+		self.token_expires = 0
+		self.token_lock = asyncio.Lock()
+		self.requests = 0
+	
+	async def get_token(self, *, refresh = False):
+		async with self.token_lock:
+			if refresh or not self.token or time.monotonic() >= self.token_expires:
+				params = {"client_id": self.client_id, "client_secret": self.client_secret, 
+							"grant_type": "client_credentials"}
+				async with self.aiohttp_session.post(self.token_url, params = params) as resp:
+					if resp.status != 200:
+						raise UnitOutputError(f"Failed to get Twitch app access token: {resp.status}")
+					data = await resp.json()
+				self.token = data["access_token"]
+				# Refresh a minute early
+				self.token_expires = time.monotonic() + data.get("expires_in", 3600) - 60
+			return self.token
+	
+	async def request(self, path, params):
+		refreshed = rate_limited = False
+		while True:
+			headers = {"Client-ID": self.client_id, 
+						"Authorization": f"Bearer {await self.get_token(refresh = refreshed)}"}
+			self.requests += 1
+			async with self.aiohttp_session.get(f"{self.base_url}/{path}", params = params, 
+												headers = headers) as resp:
+				if resp.status == 401 and not refreshed:
+					# Token expired or revoked
+					refreshed = True
+					continue
+				if resp.status == 429 and not rate_limited:
+					rate_limited = True
+					reset = float(resp.headers.get("Ratelimit-Reset", time.time() + 1))
+					await asyncio.sleep(max(0, min(reset - time.time(), 60)))
+					continue
+				if resp.status != 200:
+					raise UnitOutputError(f"Twitch API error for {path}: {resp.status}")
+				return await resp.json()
+	
+	async def get_paginated(self, path, params, *, max_pages = None):
+		'''Get data from all pages of a request, or from up to max_pages pages'''
+		params = list(params) + [("first", BATCH_SIZE)]
+		results = []
+		cursor = None
+		page = 0
+		while True:
+			data = await self.request(path, params + ([("after", cursor)] if cursor else []))
+			results.extend(data.get("data", []))
+			page += 1
+			cursor = data.get("pagination", {}).get("cursor")
+			if not cursor or not data.get("data") or max_pages and page >= max_pages:
+				return results
+	
+	async def get_batched(self, path, parameter, values, *, pages_per_value = None):
+		'''
+		Get data for values of a repeatable parameter, batched into concurrent requests of up to 100 values
+		Paginated results are limited to pages_per_value pages per value in each batch, if specified
+		'''
+		values = list(dict.fromkeys(values))
+		batches = [values[index:index + BATCH_SIZE] for index in range(0, len(values), BATCH_SIZE)]
+		results = await asyncio.gather(*(
+			self.get_paginated(path, [(parameter, value) for value in batch], 
+								max_pages = pages_per_value and pages_per_value * len(batch))
+			for batch in batches
+		))
+		return [item for result in results for item in result]
+	
+	async def get_users(self, *, ids = (), logins = ()):
+		return (await self.get_batched("users", "id", ids) + 
+				await self.get_batched("users", "login", logins))
+	
+	async def get_games(self, *, ids = (), names = ()):
+		return (await self.get_batched("games", "id", ids) + 
+				await self.get_batched("games", "name", names))
+	
+	async def get_streams(self, *, user_ids = (), game_ids = (), pages_per_game = 1):
+		user_streams, game_streams = await asyncio.gather(
+			self.get_batched("streams", "user_id", user_ids), 
+			self.get_batched("streams", "game_id", game_ids, pages_per_value = pages_per_game)
+		)
+		return list({stream["id"]: stream for stream in user_streams + game_streams}.values())
+	
+	async def search_channels(self, query, *, live_only = True, max_pages = 1):
+		params = [("query", query), ("live_only", "true" if live_only else "false")]
+		return await self.get_paginated("search/channels", params, max_pages = max_pages)
+
+class LiveStream:
+	
+	'''Live stream and the followed users, games, and keywords it matched'''
+	
+	def __init__(self, data, *, user = False, games = (), keywords = ()):
+		self.data = data
+		self.id = data["id"]
+		self.user_id = data["user_id"]
+		self.user = user
+		self.games = frozenset(games)
+		self.keywords = frozenset(keywords)
+	
+	def __repr__(self):
+		return f"<LiveStream id={self.id!r} user_id={self.user_id!r}>"
+
+class StreamPoller:
+	
+	'''
+	Polls Twitch for live streams of followed users, games, and keywords
+	Live state is kept in memory and diffed between polls
+	go_live and go_offline handlers are called with the list of streams that changed state
+	'''
+	
+	EVENTS = ("go_live", "go_offline")
+	
+	def __init__(self, client):
+		self.client = client
+		self.live = {}
+		self.handlers = {event: [] for event in self.EVENTS}
+		self.game_ids = {}
+		self.polls = 0
+	
+	def subscribe(self, event, handler):
+		if event not in self.handlers:
+			raise UnitExecutionError(f"Unknown event: {event}")
+		self.handlers[event].append(handler)
+	
+	async def emit(self, event, streams):
+		for handler in self.handlers[event]:
+			await handler(streams)
+	
+	async def resolve_games(self, names):
+		'''Get game ids for game names, caching them between polls'''
+		if missing := [name for name in names if name not in self.game_ids]:
+			for game in await self.client.get_games(names = missing):
+				self.game_ids[game["name"]] = game["id"]
+			# Returned names may differ in case from followed names
+			ids = {name.casefold(): id for name, id in self.game_ids.items()}
+			for name in missing:
+				if name.casefold() in ids:
+					self.game_ids[name] = ids[name.casefold()]
+		return {name: self.game_ids[name] for name in names if name in self.game_ids}
+	
+	async def get_live_streams(self, *, user_ids = (), games = (), keywords = ()):
+		user_ids = set(user_ids)
+		keywords = list(dict.fromkeys(keywords))
+		game_ids, *search_results = await asyncio.gather(
+			self.resolve_games(set(games)), 
+			*(self.client.search_channels(keyword) for keyword in keywords)
+		)
+		keyword_user_ids = {}
+		for keyword, channels in zip(keywords, search_results):
+			for channel in channels:
+				if channel.get("is_live", True):
+					keyword_user_ids.setdefault(channel["id"], set()).add(keyword)
+		streams = await self.client.get_streams(user_ids = user_ids | set(keyword_user_ids), 
+												game_ids = set(game_ids.values()))
+		game_names = {}
+		for name, id in game_ids.items():
+			game_names.setdefault(id, set()).add(name)
+		live_streams = {}
+		for stream in streams:
+			if stream.get("type", "live") != "live":
+				continue
+			live_stream = LiveStream(stream, user = stream["user_id"] in user_ids, 
+										games = game_names.get(stream["game_id"], ()), 
+										keywords = keyword_user_ids.get(stream["user_id"], ()))
+			if live_stream.user or live_stream.games or live_stream.keywords:
+				live_streams[live_stream.id] = live_stream
+		return live_streams
+	
+	async def poll(self, *, user_ids = (), games = (), keywords = ()):
+		'''
+		Poll for live streams and emit events for streams that went live or offline since the last poll
+		Live state is left unchanged if any request fails
+		Changes are only committed to live state after their handlers succeed,
+		so streams are announced again on the next poll if a handler fails
+		Returns the lists of streams that went live and offline
+		'''
+		live_streams = await self.get_live_streams(user_ids = user_ids, games = games, keywords = keywords)
+		went_live = [stream for id, stream in live_streams.items() if id not in self.live]
+		went_offline = [stream for id, stream in self.live.items() if id not in live_streams]
+		if went_live:
+			await self.emit("go_live", went_live)
+		# Streams that went offline are kept until their handlers succeed too
+		self.live = {**self.live, **live_streams}
+		if went_offline:
+			await self.emit("go_offline", went_offline)
+		self.live = live_streams
+		self.polls += 1
+		return went_live, went_offline
+